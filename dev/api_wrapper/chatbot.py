@@ -1,14 +1,9 @@
-import os
 import json
-import jsonschema
-
-from openai import OpenAI
-from google import genai
-from anthropic import Anthropic
 
 from utils.loaders import SchemaLoader
+from api_wrapper.client_pool import get_client, get_async_client
+from api_wrapper.rate_limiter import get_rate_limiter
 
-schema_draft = "http://json-schema.org/draft-07/schema#"
 class ChatBot():
     
     def __init__(self, model: str, sys_prompt: str, schema_loader: SchemaLoader) -> None:
@@ -20,6 +15,12 @@ class ChatBot():
     def get_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7):
         raise NotImplementedError("get_structured_response method must be implemented by subclasses")
     
+    async def asend_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
+        raise NotImplementedError("asend_message method must be implemented by subclasses")
+    
+    async def aget_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7):
+        raise NotImplementedError("aget_structured_response method must be implemented by subclasses")
+    
     def append_history(self, conversation: dict) -> None:
         raise NotImplementedError("send_message method must be implemented by subclasses")
 
@@ -42,23 +43,35 @@ class ChatBot():
         return False
 
 class ChatBotDeepSeekSimple(ChatBot):
+    provider = "deepseek"
 
     def __init__(self, model: str, sys_prompt: str = None, schema_loader: SchemaLoader = None) -> None:
-        cur_dir = os.path.dirname(os.path.realpath(__file__))
-        api_key_dir = os.path.join(cur_dir, "api_keys")
-        deepseek_key_dir = os.path.join(api_key_dir, "deepseek_api_key")
-        with open(deepseek_key_dir, "r") as f:
-            deepseek_api_key = f.read().strip()
-            
         self.history = [{"role": "system", "content": sys_prompt}]
         self.init_history = self.history.copy()
-        self.client = OpenAI(api_key=deepseek_api_key, base_url="https://api.deepseek.com")
+        self.client = get_client("deepseek", "deepseek_api_key")
+        self.rate_limiter = get_rate_limiter(self.provider, model)
         self.model = model
         self.schema_loader = schema_loader
 
     def send_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
         new_message = {"role": "user", "content": message}
-        response = self.client.chat.completions.create(
+        response = self.rate_limiter.call(
+            self.client.chat.completions.create,
+            messages=self.history + [new_message],
+            model=self.model,
+            temperature=temperature
+        )
+        response_message = response.choices[0].message.content
+        if record:
+            self.history.append(new_message)
+            new_response_message = {"role": "assistant", "content": response_message}
+            self.history.append(new_response_message)
+        return response_message
+    
+    async def asend_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
+        new_message = {"role": "user", "content": message}
+        response = await self.rate_limiter.acall(
+            get_async_client("deepseek", "deepseek_api_key").chat.completions.create,
             messages=self.history + [new_message],
             model=self.model,
             temperature=temperature
@@ -73,14 +86,35 @@ class ChatBotDeepSeekSimple(ChatBot):
     def get_structured_response(self, message: str, schema_key: dict, record: bool = True, temperature: float = 0.7) -> dict:
         if not self.schema_loader:
             raise ValueError("Schema loader must be provided for structured responses.")
-        schema = self.schema_loader.load_output_schema(schema_key)
         new_message = {"role": "user", "content": message}
-        validating_schema = schema.copy()
-        validating_schema["$schema"] = schema_draft
         response_format = {
             "type": "json_object"
         }
-        response = self.client.chat.completions.create(
+        response = self.rate_limiter.call(
+            self.client.chat.completions.create,
+            messages=self.history + [new_message],
+            model=self.model,
+            temperature=temperature,
+            response_format=response_format
+        )
+        response_message = response.choices[0].message.content
+        response_parsed = json.loads(response_message)
+        self.schema_loader.validate_output(response_parsed, schema_key)
+        if record:
+            self.history.append(new_message)
+            new_response_message = {"role": "assistant", "content": response_message}
+            self.history.append(new_response_message)
+        return json.dumps(response_parsed, indent=2).encode().decode('unicode_escape'), response_parsed
+    
+    async def aget_structured_response(self, message: str, schema_key: dict, record: bool = True, temperature: float = 0.7) -> dict:
+        if not self.schema_loader:
+            raise ValueError("Schema loader must be provided for structured responses.")
+        new_message = {"role": "user", "content": message}
+        response_format = {
+            "type": "json_object"
+        }
+        response = await self.rate_limiter.acall(
+            get_async_client("deepseek", "deepseek_api_key").chat.completions.create,
             messages=self.history + [new_message],
             model=self.model,
             temperature=temperature,
@@ -88,7 +122,7 @@ class ChatBotDeepSeekSimple(ChatBot):
         )
         response_message = response.choices[0].message.content
         response_parsed = json.loads(response_message)
-        jsonschema.validate(instance=response_parsed, schema=validating_schema)
+        self.schema_loader.validate_output(response_parsed, schema_key)
         if record:
             self.history.append(new_message)
             new_response_message = {"role": "assistant", "content": response_message}
@@ -119,23 +153,35 @@ class ChatBotDeepSeekSimple(ChatBot):
         return True
 
 class ChatBotGPTSimple(ChatBot):
+    provider = "gpt"
 
     def __init__(self, model: str, sys_prompt: str = None, schema_loader: SchemaLoader = None) -> None:
-        cur_dir = os.path.dirname(os.path.realpath(__file__))
-        api_key_dir = os.path.join(cur_dir, "api_keys")
-        gpt_key_dir = os.path.join(api_key_dir, "gpt_api_key")
-        with open(gpt_key_dir, "r") as f:
-            gpt_api_key = f.read().strip()
-            
         self.history = [{"role": "system", "content": sys_prompt}]
         self.init_history = self.history.copy()
-        self.client = OpenAI(api_key=gpt_api_key)
+        self.client = get_client("gpt", "gpt_api_key")
+        self.rate_limiter = get_rate_limiter(self.provider, model)
         self.model = model
         self.schema_loader = schema_loader
 
     def send_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
         new_message = {"role": "user", "content": message}
-        response = self.client.chat.completions.create(
+        response = self.rate_limiter.call(
+            self.client.chat.completions.create,
+            messages=self.history + [new_message],
+            model=self.model,
+            temperature=temperature
+        )
+        response_message = response.choices[0].message.content
+        if record:
+            self.history.append(new_message)
+            new_response_message = {"role": "assistant", "content": response_message}
+            self.history.append(new_response_message)
+        return response_message
+    
+    async def asend_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
+        new_message = {"role": "user", "content": message}
+        response = await self.rate_limiter.acall(
+            get_async_client("gpt", "gpt_api_key").chat.completions.create,
             messages=self.history + [new_message],
             model=self.model,
             temperature=temperature
@@ -160,7 +206,37 @@ class ChatBotGPTSimple(ChatBot):
                 "schema": schema
             }
         }
-        response = self.client.chat.completions.create(
+        response = self.rate_limiter.call(
+            self.client.chat.completions.create,
+            messages=self.history + [new_message],
+            model=self.model,
+            temperature=temperature,
+            response_format=response_format
+        )
+        response_message = response.choices[0].message.content
+        response_parsed = json.loads(response_message)
+        self.schema_loader.validate_output(response_parsed, schema_key, "strict")
+        if record:
+            self.history.append(new_message)
+            new_response_message = {"role": "assistant", "content": response_message}
+            self.history.append(new_response_message)
+        return json.dumps(response_parsed, indent=2).encode().decode('unicode_escape'), response_parsed
+    
+    async def aget_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7) -> dict:
+        if not self.schema_loader:
+            raise ValueError("Schema loader must be provided for structured responses.")
+        schema = self.schema_loader.load_output_schema(schema_key, "strict")
+        new_message = {"role": "user", "content": message}
+        response_format = {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "output_schema",
+                "strict": True,
+                "schema": schema
+            }
+        }
+        response = await self.rate_limiter.acall(
+            get_async_client("gpt", "gpt_api_key").chat.completions.create,
             messages=self.history + [new_message],
             model=self.model,
             temperature=temperature,
@@ -168,6 +244,7 @@ class ChatBotGPTSimple(ChatBot):
         )
         response_message = response.choices[0].message.content
         response_parsed = json.loads(response_message)
+        self.schema_loader.validate_output(response_parsed, schema_key, "strict")
         if record:
             self.history.append(new_message)
             new_response_message = {"role": "assistant", "content": response_message}
@@ -198,18 +275,14 @@ class ChatBotGPTSimple(ChatBot):
         return True
     
 class ChatBotGeminiSimple(ChatBot):
+    provider = "gemini"
 
     def __init__(self, model: str, sys_prompt: str = None, schema_loader: SchemaLoader = None) -> None:
-        cur_dir = os.path.dirname(os.path.realpath(__file__))
-        api_key_dir = os.path.join(cur_dir, "api_keys")
-        gemini_key_dir = os.path.join(api_key_dir, "gemini_api_key")
-        with open(gemini_key_dir, "r") as f:
-            gemini_api_key = f.read().strip()
-            
         self.sys_prompt = sys_prompt
         self.history = []
         self.init_history = self.history.copy()
-        self.client = genai.Client(api_key=gemini_api_key)
+        self.client = get_client("gemini", "gemini_api_key")
+        self.rate_limiter = get_rate_limiter(self.provider, model)
         self.model = model
         self.schema_loader = schema_loader
     
@@ -219,7 +292,27 @@ class ChatBotGeminiSimple(ChatBot):
             "temperature": temperature,
             "system_instruction": self.sys_prompt
         }
-        response = self.client.models.generate_content(
+        response = self.rate_limiter.call(
+            self.client.models.generate_content,
+            contents=self.history + [new_message],
+            model=self.model,
+            config=message_config
+        )
+        response_message = response.text
+        if record:
+            self.history.append(new_message)
+            new_response_message = {"role": "model", "parts": [{"text": response_message}]}
+            self.history.append(new_response_message)
+        return response_message
+    
+    async def asend_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
+        new_message = {"role": "user", "parts": [{"text": message}]}
+        message_config = {
+            "temperature": temperature,
+            "system_instruction": self.sys_prompt
+        }
+        response = await self.rate_limiter.acall(
+            get_async_client("gemini", "gemini_api_key").models.generate_content,
             contents=self.history + [new_message],
             model=self.model,
             config=message_config
@@ -242,13 +335,41 @@ class ChatBotGeminiSimple(ChatBot):
             "response_mime_type": "application/json",
             "response_schema": schema
         }
-        response = self.client.models.generate_content(
+        response = self.rate_limiter.call(
+            self.client.models.generate_content,
+            contents=self.history + [new_message],
+            model=self.model,
+            config=message_config
+        )
+        response_message = response.text
+        response_parsed = response.parsed
+        self.schema_loader.validate_output(response_parsed, schema_key)
+        if record:
+            self.history.append(new_message)
+            new_response_message = {"role": "model", "parts": [{"text": response_message}]}
+            self.history.append(new_response_message)
+        return json.dumps(response_message, indent=2).encode().decode('unicode_escape'), response_parsed
+    
+    async def aget_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7) -> dict:
+        if not self.schema_loader:
+            raise ValueError("Schema loader must be provided for structured responses.")
+        schema = self.schema_loader.load_output_schema(schema_key)
+        new_message = {"role": "user", "parts": [{"text": message}]}
+        message_config = {
+            "temperature": temperature,
+            "system_instruction": self.sys_prompt,
+            "response_mime_type": "application/json",
+            "response_schema": schema
+        }
+        response = await self.rate_limiter.acall(
+            get_async_client("gemini", "gemini_api_key").models.generate_content,
             contents=self.history + [new_message],
             model=self.model,
             config=message_config
         )
         response_message = response.text
         response_parsed = response.parsed
+        self.schema_loader.validate_output(response_parsed, schema_key)
         if record:
             self.history.append(new_message)
             new_response_message = {"role": "model", "parts": [{"text": response_message}]}
@@ -279,24 +400,21 @@ class ChatBotGeminiSimple(ChatBot):
         return True
 
 class ChatBotClaudeSimple(ChatBot):
+    provider = "claude"
 
     def __init__(self, model: str, sys_prompt: str = None, schema_loader: SchemaLoader = None) -> None:
-        cur_dir = os.path.dirname(os.path.realpath(__file__))
-        api_key_dir = os.path.join(cur_dir, "api_keys")
-        claude_key_dir = os.path.join(api_key_dir, "claude_api_key")
-        with open(claude_key_dir, "r") as f:
-            claude_api_key = f.read()
-        
         self.sys_prompt = sys_prompt
         self.history = []
         self.init_history = self.history.copy()
-        self.client = Anthropic(api_key=claude_api_key)
+        self.client = get_client("claude", "claude_api_key")
+        self.rate_limiter = get_rate_limiter(self.provider, model)
         self.model = model
         self.schema_loader = schema_loader
     
     def send_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
         new_message = {"role": "user", "content": message}
-        response = self.client.messages.create(
+        response = self.rate_limiter.call(
+            self.client.messages.create,
             messages=self.history + [new_message],
             model=self.model,
             temperature=temperature
@@ -311,6 +429,24 @@ class ChatBotClaudeSimple(ChatBot):
             self.history.append(new_response_message)
         return response_message
 
+    async def asend_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
+        new_message = {"role": "user", "content": message}
+        response = await self.rate_limiter.acall(
+            get_async_client("claude", "claude_api_key").messages.create,
+            messages=self.history + [new_message],
+            model=self.model,
+            temperature=temperature
+        )
+        response_message = ""
+        for content_block in response.content:
+            if content_block.type == "text":
+                response_message += content_block.text
+        if record:
+            self.history.append(new_message)
+            new_response_message = {"role": "assistant", "content": response_message}
+            self.history.append(new_response_message)
+        return response_message
+    
     def get_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7) -> dict:
         if not self.schema_loader:
             raise ValueError("Schema loader must be provided for structured responses.")
@@ -327,7 +463,8 @@ class ChatBotClaudeSimple(ChatBot):
             "type": "tool",
             "name": "structured_output"
         }
-        response = self.client.messages.create(
+        response = self.rate_limiter.call(
+            self.client.messages.create,
             messages=self.history + [new_message],
             model=self.model,
             tools=tools,
@@ -341,6 +478,44 @@ class ChatBotClaudeSimple(ChatBot):
         for content_block in response.content:
             if content_block.type == "tool_use" and content_block.name == "structured_output":
                 response_parsed = content_block.input
+                self.schema_loader.validate_output(response_parsed, schema_key, "strict")
+                response_message = str(response_parsed)
+                if record:
+                    self.history.append(new_message)
+                    new_response_message = {"role": "assistant", "content": response_message}
+                    self.history.append(new_response_message)
+                return json.dumps(response_parsed, indent=2).encode().decode('unicode_escape'), response_parsed
+        raise ValueError("Structured output invalid in Claude's response.")
+    
+    async def aget_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7) -> dict:
+        if not self.schema_loader:
+            raise ValueError("Schema loader must be provided for structured responses.")
+        schema = self.schema_loader.load_output_schema(schema_key, "strict")
+        new_message = {"role": "user", "content": message}
+        tools = [
+            {
+                "name": "structured_output",
+                "description": "Your response must be in the form of a single json according to this provided schema.",
+                "input_schema": schema
+            }
+        ]
+        tool_choice = {
+            "type": "tool",
+            "name": "structured_output"
+        }
+        response = await self.rate_limiter.acall(
+            get_async_client("claude", "claude_api_key").messages.create,
+            messages=self.history + [new_message],
+            model=self.model,
+            tools=tools,
+            tool_choice=tool_choice,
+            temperature=temperature,
+            max_tokens=1000
+        )
+        for content_block in response.content:
+            if content_block.type == "tool_use" and content_block.name == "structured_output":
+                response_parsed = content_block.input
+                self.schema_loader.validate_output(response_parsed, schema_key, "strict")
                 response_message = str(response_parsed)
                 if record:
                     self.history.append(new_message)
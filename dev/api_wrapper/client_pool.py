@@ -0,0 +1,157 @@
+import os
+import asyncio
+import weakref
+import threading
+import httpx
+
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient as OpenAIHttpxClient, DefaultAsyncHttpxClient as OpenAIAsyncHttpxClient
+from google import genai
+from google.genai import types as genai_types
+from anthropic import Anthropic, AsyncAnthropic, DefaultHttpxClient as AnthropicHttpxClient, DefaultAsyncHttpxClient as AnthropicAsyncHttpxClient
+
+# Every ChatBot draws its provider client from here, so all bots of a process share the key file reads,
+# the HTTP connection pools and their keep-alive connections instead of opening new ones per stage and section.
+# The SDKs' own retries are turned off, retrying is left to the rate limiter.
+
+_MAX_CONNECTIONS = 100
+_MAX_KEEPALIVE_CONNECTIONS = 20
+_KEEPALIVE_EXPIRY = 60.0
+
+_api_key_dir = os.path.join(os.path.dirname(os.path.realpath(__file__)), "api_keys")
+_api_keys = {}
+_clients = {}
+# Async connections belong to the event loop that opened them, so every running loop gets clients of its own
+_async_clients = weakref.WeakKeyDictionary()
+_client_stats = {}
+_client_pool_lock = threading.Lock()
+
+def configure_client_pool(max_connections: int = None, max_keepalive_connections: int = None, keepalive_expiry: float = None) -> None:
+    # Only affects clients created afterwards
+    global _MAX_CONNECTIONS, _MAX_KEEPALIVE_CONNECTIONS, _KEEPALIVE_EXPIRY
+    if max_connections is not None:
+        _MAX_CONNECTIONS = max_connections
+    if max_keepalive_connections is not None:
+        _MAX_KEEPALIVE_CONNECTIONS = max_keepalive_connections
+    if keepalive_expiry is not None:
+        _KEEPALIVE_EXPIRY = keepalive_expiry
+
+def read_api_key(key_file: str) -> str:
+    with _client_pool_lock:
+        if key_file not in _api_keys:
+            with open(os.path.join(_api_key_dir, key_file), "r") as f:
+                _api_keys[key_file] = f.read().strip()
+        return _api_keys[key_file]
+
+class ClientStats:
+    # Counts requests and the connections opened for them, every request on an existing connection is a reuse
+    def __init__(self, provider: str) -> None:
+        self.provider = provider
+        self.bots_served = 0
+        self.requests = 0
+        self.connections_opened = 0
+        self.lock = threading.Lock()
+
+    def trace(self, event_name: str, info: dict) -> None:
+        if event_name == "connection.connect_tcp.complete":
+            with self.lock:
+                self.connections_opened += 1
+
+    async def atrace(self, event_name: str, info: dict) -> None:
+        self.trace(event_name, info)
+
+    def on_request(self, request: httpx.Request) -> None:
+        with self.lock:
+            self.requests += 1
+        request.extensions["trace"] = self.trace
+
+    async def on_async_request(self, request: httpx.Request) -> None:
+        with self.lock:
+            self.requests += 1
+        request.extensions["trace"] = self.atrace
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "provider": self.provider,
+                "bots_served": self.bots_served,
+                "requests": self.requests,
+                "connections_opened": self.connections_opened,
+                "connections_reused": max(self.requests - self.connections_opened, 0),
+            }
+
+def get_http_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=_MAX_CONNECTIONS, max_keepalive_connections=_MAX_KEEPALIVE_CONNECTIONS, keepalive_expiry=_KEEPALIVE_EXPIRY)
+
+def get_http_client_args(stats: ClientStats) -> dict:
+    return {"limits": get_http_limits(), "event_hooks": {"request": [stats.on_request]}}
+
+def get_async_http_client_args(stats: ClientStats) -> dict:
+    return {"limits": get_http_limits(), "event_hooks": {"request": [stats.on_async_request]}}
+
+def create_client(provider: str, api_key: str, stats: ClientStats):
+    http_client_args = get_http_client_args(stats)
+    if provider == "deepseek":
+        return OpenAI(api_key=api_key, base_url="https://api.deepseek.com", max_retries=0, http_client=OpenAIHttpxClient(**http_client_args))
+    elif provider == "gpt":
+        return OpenAI(api_key=api_key, max_retries=0, http_client=OpenAIHttpxClient(**http_client_args))
+    elif provider == "gemini":
+        return genai.Client(api_key=api_key, http_options=genai_types.HttpOptions(client_args=http_client_args))
+    elif provider == "claude":
+        return Anthropic(api_key=api_key, max_retries=0, http_client=AnthropicHttpxClient(**http_client_args))
+    else:
+        raise ValueError(f"Unknown LLM provider '{provider}'")
+
+def create_async_client(provider: str, api_key: str, stats: ClientStats):
+    http_client_args = get_async_http_client_args(stats)
+    if provider == "deepseek":
+        return AsyncOpenAI(api_key=api_key, base_url="https://api.deepseek.com", max_retries=0, http_client=OpenAIAsyncHttpxClient(**http_client_args))
+    elif provider == "gpt":
+        return AsyncOpenAI(api_key=api_key, max_retries=0, http_client=OpenAIAsyncHttpxClient(**http_client_args))
+    elif provider == "gemini":
+        return genai.Client(api_key=api_key, http_options=genai_types.HttpOptions(async_client_args=http_client_args)).aio
+    elif provider == "claude":
+        return AsyncAnthropic(api_key=api_key, max_retries=0, http_client=AnthropicAsyncHttpxClient(**http_client_args))
+    else:
+        raise ValueError(f"Unknown LLM provider '{provider}'")
+
+def get_client_stats(pool_key: tuple) -> ClientStats:
+    # Callers hold _client_pool_lock
+    if pool_key not in _client_stats:
+        _client_stats[pool_key] = ClientStats(pool_key[0])
+    return _client_stats[pool_key]
+
+def get_client(provider: str, key_file: str):
+    # One client per provider and key for the whole process
+    api_key = read_api_key(key_file)
+    with _client_pool_lock:
+        pool_key = (provider, api_key)
+        stats = get_client_stats(pool_key)
+        if pool_key not in _clients:
+            _clients[pool_key] = create_client(provider, api_key, stats)
+        stats.bots_served += 1
+        return _clients[pool_key]
+
+def get_async_client(provider: str, key_file: str):
+    # Must be called from a coroutine, the client is tied to the running event loop
+    loop = asyncio.get_running_loop()
+    api_key = read_api_key(key_file)
+    with _client_pool_lock:
+        pool_key = (provider, api_key)
+        stats = get_client_stats(pool_key)
+        loop_clients = _async_clients.setdefault(loop, {})
+        if pool_key not in loop_clients:
+            loop_clients[pool_key] = create_async_client(provider, api_key, stats)
+        return loop_clients[pool_key]
+
+def get_client_pool_stats() -> list:
+    with _client_pool_lock:
+        return [stats.to_dict() for stats in _client_stats.values()]
+
+def close_client_pool() -> None:
+    with _client_pool_lock:
+        for client in _clients.values():
+            if hasattr(client, "close"):
+                client.close()
+        _clients.clear()
+        _async_clients.clear()
+        _client_stats.clear()
@@ -0,0 +1,92 @@
+import os
+import re
+import hashlib
+import threading
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Sentence embeddings kept on disk per model: a float32 matrix read through a memory map, and an index of "<text hash> <row>"
+# lines. Both files are only appended to, and only under a lock on the index file, so batch workers in several processes can
+# share a cache directory. Rows another process added are picked up by reading the index past where this one stopped.
+# Without fcntl (Windows) the lock only covers the threads of one process.
+
+def hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingCache:
+    def __init__(self, cache_dir: str, model_name: str, dimension: int) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        file_stem = re.sub(r"[^A-Za-z0-9_.-]", "_", model_name) + "_" + hash_text(model_name)[:8]
+        self.data_path = os.path.join(cache_dir, file_stem + ".f32")
+        self.index_path = os.path.join(cache_dir, file_stem + ".index")
+        self.dimension = dimension
+        self.row_bytes = dimension * np.dtype(np.float32).itemsize
+        self.rows = {}
+        self.index_offset = 0
+        self.data = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        for path in [self.data_path, self.index_path]:
+            open(path, "ab").close()
+        self.refresh_index()
+
+    def refresh_index(self) -> None:
+        with open(self.index_path, "rb") as f:
+            f.seek(self.index_offset)
+            new_text = f.read()
+        # A line another process is still writing is left for the next refresh
+        complete_length = new_text.rfind(b"\n") + 1
+        for line in new_text[:complete_length].decode("ascii").splitlines():
+            text_hash, row = line.split()
+            self.rows[text_hash] = int(row)
+        self.index_offset += complete_length
+
+    def map_rows(self, row_count: int) -> None:
+        # Appending does not grow an existing map, so the file is mapped again once rows past its end are needed
+        if self.data is None or self.data.shape[0] < row_count:
+            mapped_rows = os.path.getsize(self.data_path) // self.row_bytes
+            self.data = np.memmap(self.data_path, dtype=np.float32, mode="r", shape=(mapped_rows, self.dimension))
+
+    def get(self, texts: list) -> list:
+        # The cached embedding of every text, or None where there is none
+        text_hashes = [hash_text(text) for text in texts]
+        with self.lock:
+            if any(text_hash not in self.rows for text_hash in text_hashes):
+                self.refresh_index()
+            found_rows = [self.rows.get(text_hash) for text_hash in text_hashes]
+            known_rows = [row for row in found_rows if row is not None]
+            if known_rows:
+                self.map_rows(max(known_rows) + 1)
+            self.hits += len(known_rows)
+            self.misses += len(found_rows) - len(known_rows)
+            return [np.array(self.data[row]) if row is not None else None for row in found_rows]
+
+    def put(self, texts: list, embeddings) -> None:
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32).reshape(len(texts), self.dimension)
+        with self.lock, open(self.index_path, "ab") as index_file:
+            if fcntl is not None:
+                fcntl.flock(index_file.fileno(), fcntl.LOCK_EX)
+            try:
+                # The data goes in before the index lines pointing at it, and a row cut short by a crash is overwritten
+                with open(self.data_path, "r+b") as data_file:
+                    first_row = os.path.getsize(self.data_path) // self.row_bytes
+                    data_file.seek(first_row * self.row_bytes)
+                    data_file.truncate()
+                    data_file.write(embeddings.tobytes())
+                    data_file.flush()
+                new_rows = {hash_text(text): first_row + i for i, text in enumerate(texts)}
+                index_file.write("".join(f"{text_hash} {row}\n" for text_hash, row in new_rows.items()).encode("ascii"))
+                index_file.flush()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(index_file.fileno(), fcntl.LOCK_UN)
+            self.rows.update(new_rows)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"path": self.data_path, "size": len(self.rows), "hits": self.hits, "misses": self.misses}
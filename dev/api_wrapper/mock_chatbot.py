@@ -0,0 +1,261 @@
+import re
+import ast
+import json
+import math
+import time
+import random
+import asyncio
+import hashlib
+
+from api_wrapper.chatbot import ChatBot
+from api_wrapper.rate_limiter import get_rate_limiter
+from utils.loaders import SchemaLoader
+
+# Offline stand-in for a provider, answering every structured request with a response that is valid for its schema
+# and usable by the sessions, after an artificial latency. Responses are synthesized from the schema itself, except for
+# the stages whose content the sessions parse further (declarations, formulas, timeline and outline options), which get
+# responses built from the names found in the request. Responses are seeded by the request, so runs are reproducible.
+
+_MOCK_RELATIONS = {
+    "located_at": ["a", "b", "t"],
+    "knows": ["a", "b", "t"],
+    "owns": ["a", "b", "t"],
+    "gives_to": ["a", "b", "c", "t"],
+}
+_BLOCK_HEADER_PATTERN = re.compile(r"^\*\*(.+?)\*\*\s*$", re.M)
+_NAME_PATTERN = re.compile(r"\b[A-Z][a-z]{2,}\b")
+# Capitalised words that must not become object names, as they are formula keywords or just start a sentence
+_RESERVED_NAMES = {"and", "or", "not", "forall", "exists", "the", "but", "then", "she", "her", "his", "they", "their", "you", "your", "with", "this", "that", "there", "what", "when", "how", "for", "from", "its"}
+_DECLARATION_PATTERN = re.compile(r"^\s*([a-zA-Z][a-zA-Z0-9_]*)(\([^()]*\))?\s*:", re.M)
+_TIME_POINT_PATTERN = re.compile(r"\bT(\d+)\b")
+
+# Latency profiles by model name, as (distribution, parameters in seconds)
+_mock_latency_profiles = {
+    "mock": ("none", {}),
+    "mock-realistic": ("lognormal", {"median": 2.0, "sigma": 0.5}),
+}
+
+def set_mock_latency(model: str, distribution: str, **params) -> None:
+    if distribution not in ["none", "fixed", "uniform", "lognormal"]:
+        raise ValueError(f"Unknown latency distribution '{distribution}', expected one of none, fixed, uniform, lognormal")
+    _mock_latency_profiles[model] = (distribution, params)
+
+def sample_mock_latency(model: str, rng: random.Random) -> float:
+    distribution, params = _mock_latency_profiles.get(model, ("none", {}))
+    if distribution == "fixed":
+        return params["seconds"]
+    elif distribution == "uniform":
+        return rng.uniform(params["low"], params["high"])
+    elif distribution == "lognormal":
+        return rng.lognormvariate(math.log(params["median"]), params["sigma"])
+    return 0.0
+
+def split_message_blocks(message: str) -> dict:
+    # Input templates mark each part with a "**Header**" line
+    blocks = {}
+    headers = list(_BLOCK_HEADER_PATTERN.finditer(message))
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(message)
+        blocks[header.group(1).strip()] = message[header.end():end].strip()
+    return blocks
+
+def find_story_names(story: str, limit: int = 8) -> list:
+    names = []
+    for name in _NAME_PATTERN.findall(story):
+        object_name = name.lower()
+        if object_name not in names and object_name not in _RESERVED_NAMES and object_name not in _MOCK_RELATIONS:
+            names.append(object_name)
+        if len(names) >= limit:
+            break
+    return names if len(names) >= 2 else names + ["someone", "somewhere"][len(names):]
+
+def find_declarations(block: str) -> tuple[list, dict]:
+    objects = []
+    relations = {}
+    for match in _DECLARATION_PATTERN.finditer(block):
+        name, params = match.groups()
+        if params is None:
+            objects.append(name)
+        else:
+            relations[name] = [param.strip() for param in params[1:-1].split(",")]
+    return objects, relations
+
+def synthesize_from_schema(schema: dict, rng: random.Random):
+    schema_type = schema.get("type")
+    if "enum" in schema:
+        return schema["enum"][0]
+    if schema_type == "object":
+        return {key: synthesize_from_schema(value, rng) for key, value in schema.get("properties", {}).items()}
+    elif schema_type == "array":
+        item_count = max(schema.get("minItems", 1), 1)
+        if "maxItems" in schema:
+            item_count = min(item_count, schema["maxItems"])
+        return [synthesize_from_schema(schema.get("items", {}), rng) for i in range(item_count)]
+    elif schema_type == "number":
+        return round(rng.uniform(schema.get("minimum", 0), schema.get("maximum", 1)), 4)
+    elif schema_type == "integer":
+        return rng.randint(schema.get("minimum", 0), schema.get("maximum", 10))
+    elif schema_type == "boolean":
+        return rng.random() < 0.5
+    return f"mock text {rng.randint(0, 9999)}"
+
+class MockResponder:
+    def __init__(self, rng: random.Random) -> None:
+        self.rng = rng
+
+    def respond(self, schema_key: str, message: str, schema: dict, history_text: str) -> dict:
+        response = synthesize_from_schema(schema, self.rng)
+        build_response = getattr(self, f"build_{schema_key}", None)
+        if build_response is not None:
+            response.update(build_response(split_message_blocks(message), history_text))
+        return response
+
+    def build_declaration_builder(self, blocks: dict, history_text: str) -> dict:
+        object_names = find_story_names(blocks.get("Story", ""))
+        relations = []
+        for relation_name, params in _MOCK_RELATIONS.items():
+            case_args = [self.rng.choice(object_names) for param in params[:-1]] + ["[DUMMY]"]
+            relations.append({
+                "relation_name": f"{relation_name}({', '.join(params)})",
+                "relation_description": " ".join(f"[{param}]" for param in params),
+                "relation_cases": [f"{relation_name}({', '.join(case_args)})"],
+            })
+        return {
+            "objects": [{"object_name": name, "object_description": f"{name}, mentioned in the story"} for name in object_names],
+            "relations": relations,
+            "replenishments": [],
+        }
+
+    def build_semantic_analyser(self, blocks: dict, history_text: str) -> dict:
+        objects, relations = find_declarations(blocks.get("Declarerations", ""))
+        exclusiveness_definitions = []
+        for relation_name, params in relations.items():
+            if len(params) == 3 and self.rng.random() < 0.5:
+                exclusiveness_definitions.append(f"{relation_name}({params[0]}, [exclusive_arg], {params[2]})")
+        return {"exclusiveness_definitions": exclusiveness_definitions, "formulas": []}
+
+    def build_formula_maker(self, blocks: dict, history_text: str) -> dict:
+        objects, unused_relations = find_declarations(blocks.get("Objects", ""))
+        time_points, unused_relations = find_declarations(blocks.get("Existing Timeline", ""))
+        unused_objects, relations = find_declarations(blocks.get("Relations", ""))
+        objects = objects or ["someone", "somewhere"]
+        time_points = time_points or ["T0"]
+        formulas = []
+        atoms = []
+        for i in range(self.rng.randint(3, 8) if relations else 0):
+            relation_name, params = self.rng.choice(list(relations.items()))
+            args = [self.rng.choice(objects) for param in params[:-1]] + [self.rng.choice(time_points)]
+            atom = f"{relation_name}({', '.join(args)})"
+            shape = self.rng.random()
+            # Mostly facts, with some rules and some negated earlier facts so a share of the sections contradict themselves
+            if shape < 0.6 or not atoms:
+                formula = atom
+                atoms.append(atom)
+            elif shape < 0.85:
+                formula = f"forall (x) . {relation_name}({', '.join(['x'] + args[1:])}) -> {atom}"
+            else:
+                formula = f"not {self.rng.choice(atoms)}"
+            formulas.append({"scope": "global", "formula": formula})
+        return {"scopes": [], "formulas": formulas}
+
+    def build_timeline_maker(self, blocks: dict, history_text: str) -> dict:
+        # Earlier time points only appear in the faked history, the new one continues their numbering
+        time_point_index = max([int(index) + 1 for index in _TIME_POINT_PATTERN.findall(history_text)], default=0)
+        return {"timeline_definition": [{"time_point_name": f"T{time_point_index}", "time_point_description": "The time of this section."}]}
+
+    def build_outline_similarity(self, blocks: dict, history_text: str) -> dict:
+        # Kept below 1 as the session takes a log of the best similarity
+        try:
+            prediction_count = len(ast.literal_eval(blocks.get("Predictions", "")))
+        except (ValueError, SyntaxError):
+            prediction_count = 1
+        return {"similarities": [round(self.rng.uniform(0.05, 0.95), 4) for i in range(max(prediction_count, 1))]}
+
+    def build_outline_multi_likelihood(self, blocks: dict, history_text: str) -> dict:
+        option_count = max(len(re.findall(r"^\d+\. ", blocks.get("Options", ""), re.M)), 1)
+        return {"option_likelihoods": [round(self.rng.uniform(0, 1), 4) for i in range(option_count)]}
+
+class ChatBotMock(ChatBot):
+    provider = "mock"
+
+    def __init__(self, model: str, sys_prompt: str = None, schema_loader: SchemaLoader = None) -> None:
+        self.history = [{"role": "system", "content": sys_prompt}]
+        self.init_history = self.history.copy()
+        self.rate_limiter = get_rate_limiter(self.provider, model)
+        self.model = model
+        self.schema_loader = schema_loader
+
+    def get_rng(self, message: str) -> random.Random:
+        # Seeded by the conversation so far, so the same run always gets the same responses
+        seed_text = json.dumps(self.history + [message])
+        return random.Random(hashlib.sha256(seed_text.encode("utf-8")).hexdigest())
+
+    def make_response(self, message: str) -> tuple[str, random.Random]:
+        rng = self.get_rng(message)
+        return "-- **Reasoning**\nMock response.\n-- **Result**\n" + message[:200], rng
+
+    def make_structured_response(self, message: str, schema_key: str) -> tuple[str, dict, random.Random]:
+        if not self.schema_loader:
+            raise ValueError("Schema loader must be provided for structured responses.")
+        schema = self.schema_loader.load_output_schema(schema_key)
+        rng = self.get_rng(message)
+        response_parsed = MockResponder(rng).respond(schema_key, message, schema, json.dumps(self.history[1:]))
+        self.schema_loader.validate_output(response_parsed, schema_key)
+        return json.dumps(response_parsed), response_parsed, rng
+
+    # The artificial latency stands in for the provider request, so mock runs wait for the rate limit of their entry as well
+    def wait_latency(self, messages: list, latency: float) -> None:
+        time.sleep(latency)
+
+    async def await_latency(self, messages: list, latency: float) -> None:
+        await asyncio.sleep(latency)
+
+    def record_response(self, message: str, response_message: str, record: bool) -> None:
+        if record:
+            self.history.append({"role": "user", "content": message})
+            self.history.append({"role": "assistant", "content": response_message})
+
+    def send_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
+        response_message, rng = self.make_response(message)
+        self.rate_limiter.call(self.wait_latency, messages=self.history + [{"role": "user", "content": message}], latency=sample_mock_latency(self.model, rng))
+        self.record_response(message, response_message, record)
+        return response_message
+
+    def get_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7) -> dict:
+        response_message, response_parsed, rng = self.make_structured_response(message, schema_key)
+        self.rate_limiter.call(self.wait_latency, messages=self.history + [{"role": "user", "content": message}], latency=sample_mock_latency(self.model, rng))
+        self.record_response(message, response_message, record)
+        return json.dumps(response_parsed, indent=2), response_parsed
+
+    async def asend_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
+        response_message, rng = self.make_response(message)
+        await self.rate_limiter.acall(self.await_latency, messages=self.history + [{"role": "user", "content": message}], latency=sample_mock_latency(self.model, rng))
+        self.record_response(message, response_message, record)
+        return response_message
+
+    async def aget_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7) -> dict:
+        response_message, response_parsed, rng = self.make_structured_response(message, schema_key)
+        await self.rate_limiter.acall(self.await_latency, messages=self.history + [{"role": "user", "content": message}], latency=sample_mock_latency(self.model, rng))
+        self.record_response(message, response_message, record)
+        return json.dumps(response_parsed, indent=2), response_parsed
+
+    def append_history(self, conversation: dict) -> None:
+        self.history.append(conversation)
+
+    def get_history(self) -> list:
+        return self.history
+
+    def set_history(self, history: list) -> None:
+        self.history = history
+
+    def reset_history(self) -> None:
+        self.history = self.init_history.copy()
+
+    def add_fake_user_message(self, message: str) -> None:
+        self.history.append({"role": "user", "content": message})
+
+    def add_fake_model_message(self, message: str) -> None:
+        self.history.append({"role": "assistant", "content": message})
+
+    def is_structured(self) -> bool:
+        return True
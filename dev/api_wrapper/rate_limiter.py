@@ -0,0 +1,219 @@
+import json
+import time
+import random
+import asyncio
+import threading
+import httpx
+
+from openai import APIStatusError as OpenAIStatusError, APIConnectionError as OpenAIConnectionError
+from anthropic import APIStatusError as AnthropicStatusError, APIConnectionError as AnthropicConnectionError
+from google.genai.errors import APIError as GeminiAPIError
+
+# Every ChatBot request goes through the limiter of its provider and model. Requests wait for the request and token buckets
+# and for a free in-flight slot, and rate limit (429), server (5xx) and connection errors are retried with exponential
+# backoff and jitter. Anything else, e.g. an invalid structured response, is raised straight to the caller's retry loop.
+
+_API_RETRIES = 6
+_BACKOFF_BASE = 1.0
+_BACKOFF_MAX = 60.0
+_IN_FLIGHT_POLL = 0.05
+
+class TokenBucket:
+    # Refills continuously up to one minute's worth, and a reservation may drive it below zero so callers queue up in order
+    def __init__(self, per_minute: float) -> None:
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float) -> float:
+        # Returns how long the caller has to wait before its reservation is covered
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        # A single request larger than the bucket only waits for a full bucket
+        self.level -= min(amount, self.capacity)
+        return max(-self.level / self.rate, 0.0)
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float = None, tokens_per_minute: float = None, max_in_flight: int = None) -> None:
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_in_flight = max_in_flight
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self.in_flight_free = threading.Condition(self.lock)
+
+        # A request is counted once however many attempts it takes, every attempt goes through the buckets
+        self.requests = 0
+        self.attempts = 0
+        self.throttled_attempts = 0
+        self.throttled_time = 0.0
+        self.retries = 0
+        self.rate_limited_responses = 0
+        self.server_errors = 0
+        self.connection_errors = 0
+        self.backoff_time = 0.0
+
+    def reserve(self, estimated_tokens: int) -> float:
+        with self.lock:
+            self.attempts += 1
+            delay = 0.0
+            if self.request_bucket:
+                delay = max(delay, self.request_bucket.reserve(1))
+            if self.token_bucket:
+                delay = max(delay, self.token_bucket.reserve(estimated_tokens))
+            return delay
+
+    def try_enter(self) -> bool:
+        # Callers hold the lock
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return False
+        self.in_flight += 1
+        return True
+
+    def leave(self) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            self.in_flight_free.notify()
+
+    def add_throttled(self, waited: float) -> None:
+        with self.lock:
+            self.throttled_attempts += 1
+            self.throttled_time += waited
+
+    def acquire(self, estimated_tokens: int) -> None:
+        start = time.monotonic()
+        delay = self.reserve(estimated_tokens)
+        throttled = delay > 0
+        if throttled:
+            time.sleep(delay)
+        with self.lock:
+            while not self.try_enter():
+                throttled = True
+                self.in_flight_free.wait()
+        if throttled:
+            self.add_throttled(time.monotonic() - start)
+
+    async def aacquire(self, estimated_tokens: int) -> None:
+        start = time.monotonic()
+        delay = self.reserve(estimated_tokens)
+        throttled = delay > 0
+        if throttled:
+            await asyncio.sleep(delay)
+        # Waiting on the condition would block the event loop, so async callers poll for a free slot
+        while True:
+            with self.lock:
+                if self.try_enter():
+                    break
+            throttled = True
+            await asyncio.sleep(_IN_FLIGHT_POLL)
+        if throttled:
+            self.add_throttled(time.monotonic() - start)
+
+    def add_request(self) -> None:
+        with self.lock:
+            self.requests += 1
+
+    def backoff_delay(self, attempt: int, error: Exception) -> float:
+        status = get_error_status(error)
+        with self.lock:
+            self.retries += 1
+            if status == 429:
+                self.rate_limited_responses += 1
+            elif status is None:
+                self.connection_errors += 1
+            else:
+                self.server_errors += 1
+        # Full jitter keeps the bots of many sessions from retrying in lockstep
+        delay = random.uniform(0, min(_BACKOFF_MAX, _BACKOFF_BASE * 2 ** attempt))
+        with self.lock:
+            self.backoff_time += delay
+        return delay
+
+    def call(self, request, **kwargs):
+        estimated_tokens = estimate_request_tokens(kwargs)
+        self.add_request()
+        for attempt in range(_API_RETRIES + 1):
+            self.acquire(estimated_tokens)
+            try:
+                return request(**kwargs)
+            except Exception as e:
+                if attempt >= _API_RETRIES or not is_retryable_error(e):
+                    raise e
+                delay = self.backoff_delay(attempt, e)
+            finally:
+                self.leave()
+            time.sleep(delay)
+
+    async def acall(self, request, **kwargs):
+        estimated_tokens = estimate_request_tokens(kwargs)
+        self.add_request()
+        for attempt in range(_API_RETRIES + 1):
+            await self.aacquire(estimated_tokens)
+            try:
+                return await request(**kwargs)
+            except Exception as e:
+                if attempt >= _API_RETRIES or not is_retryable_error(e):
+                    raise e
+                delay = self.backoff_delay(attempt, e)
+            finally:
+                self.leave()
+            await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests_per_minute": self.requests_per_minute,
+                "tokens_per_minute": self.tokens_per_minute,
+                "max_in_flight": self.max_in_flight,
+                "requests": self.requests,
+                "attempts": self.attempts,
+                "throttled_attempts": self.throttled_attempts,
+                "throttled_time": round(self.throttled_time, 4),
+                "retries": self.retries,
+                "rate_limited_responses": self.rate_limited_responses,
+                "server_errors": self.server_errors,
+                "connection_errors": self.connection_errors,
+                "backoff_time": round(self.backoff_time, 4),
+            }
+
+def get_error_status(error: Exception) -> int:
+    if isinstance(error, (OpenAIStatusError, AnthropicStatusError)):
+        return error.status_code
+    if isinstance(error, GeminiAPIError):
+        return error.code
+    return None
+
+def is_retryable_error(error: Exception) -> bool:
+    if isinstance(error, (OpenAIConnectionError, AnthropicConnectionError, httpx.TransportError)):
+        return True
+    status = get_error_status(error)
+    return status is not None and (status == 429 or 500 <= status < 600)
+
+def estimate_request_tokens(request_kwargs: dict) -> int:
+    # Rough count of 4 characters per token over everything sent, the real count is only known from the response
+    return len(json.dumps(request_kwargs, default=str)) // 4
+
+_rate_limit_configs = {}
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+def configure_rate_limit(provider: str, model: str, requests_per_minute: float = None, tokens_per_minute: float = None, max_in_flight: int = None) -> None:
+    # Limits are per provider and model, as quotas are, so entries sharing a model share one limiter
+    with _rate_limiters_lock:
+        _rate_limit_configs[(provider, model)] = {"requests_per_minute": requests_per_minute, "tokens_per_minute": tokens_per_minute, "max_in_flight": max_in_flight}
+        _rate_limiters.pop((provider, model), None)
+
+def get_rate_limiter(provider: str, model: str) -> RateLimiter:
+    with _rate_limiters_lock:
+        limiter_key = (provider, model)
+        if limiter_key not in _rate_limiters:
+            _rate_limiters[limiter_key] = RateLimiter(**_rate_limit_configs.get(limiter_key, {}))
+        return _rate_limiters[limiter_key]
+
+def get_rate_limiter_stats() -> dict:
+    with _rate_limiters_lock:
+        return {f"{provider}/{model}": limiter.stats() for (provider, model), limiter in _rate_limiters.items()}
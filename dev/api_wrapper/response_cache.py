@@ -0,0 +1,188 @@
+import json
+import hashlib
+import sqlite3
+import threading
+
+from api_wrapper.chatbot import ChatBot
+from utils.loaders import SchemaLoader
+from utils.steps import FatalCallError
+
+# Responses are keyed by provider, model, system prompt, the whole conversation so far, schema key and temperature,
+# so a re-run of the same narrative replays every call from disk. In replay mode the provider is never contacted
+# and a request that was not recorded fails instead, without the stage retrying it.
+
+class ResponseCacheMiss(FatalCallError):
+    pass
+
+class LLMResponseCache:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS llm_responses (key TEXT PRIMARY KEY, provider TEXT NOT NULL, model TEXT NOT NULL, schema_key TEXT, response_text TEXT NOT NULL, response_parsed TEXT, model_message TEXT NOT NULL)")
+        self.connection.commit()
+
+    @staticmethod
+    def make_key(provider: str, model: str, sys_prompt: str, turns: list, message: str, schema_key: str, temperature: float) -> str:
+        sys_prompt_hash = hashlib.sha256(str(sys_prompt).encode("utf-8")).hexdigest()
+        history_hash = hashlib.sha256(json.dumps(turns + [["user", message]]).encode("utf-8")).hexdigest()
+        key_parts = [provider, model, sys_prompt_hash, history_hash, schema_key, temperature]
+        return hashlib.sha256(json.dumps(key_parts).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> tuple[str, object, str]:
+        with self.lock:
+            row = self.connection.execute("SELECT response_text, response_parsed, model_message FROM llm_responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        response_text, response_parsed, model_message = row
+        return response_text, json.loads(response_parsed) if response_parsed is not None else None, model_message
+
+    def put(self, key: str, provider: str, model: str, schema_key: str, response_text: str, response_parsed, model_message: str) -> None:
+        parsed_json = json.dumps(response_parsed, default=str) if response_parsed is not None else None
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO llm_responses VALUES (?, ?, ?, ?, ?, ?, ?)", (key, provider, model, schema_key, response_text, parsed_json, model_message))
+            self.connection.commit()
+
+    def stats(self) -> dict:
+        with self.lock:
+            size = self.connection.execute("SELECT COUNT(*) FROM llm_responses").fetchone()[0]
+            return {"path": self.path, "size": size, "hits": self.hits, "misses": self.misses}
+
+_response_caches = {}
+_response_caches_lock = threading.Lock()
+
+def get_response_cache(path: str) -> LLMResponseCache:
+    with _response_caches_lock:
+        if path not in _response_caches:
+            _response_caches[path] = LLMResponseCache(path)
+        return _response_caches[path]
+
+def get_history_entry_text(history_entry: dict) -> str:
+    if "content" in history_entry:
+        return history_entry["content"]
+    return history_entry["parts"][0]["text"]
+
+class CachingChatBot(ChatBot):
+    # Wraps a provider bot, which is only created on the first miss so replaying needs neither API keys nor network.
+    # The conversation is tracked as provider independent turns, which is what the cache keys are built from.
+    def __init__(self, chatbot_class: type, model: str, sys_prompt: str = None, schema_loader: SchemaLoader = None, cache: LLMResponseCache = None, replay_only: bool = False) -> None:
+        self.chatbot_class = chatbot_class
+        self.provider = chatbot_class.provider
+        self.model = model
+        self.sys_prompt = sys_prompt
+        self.schema_loader = schema_loader
+        self.cache = cache
+        self.replay_only = replay_only
+        self.turns = []
+        self.inner_bot = None
+
+    def get_inner_bot(self) -> ChatBot:
+        if self.inner_bot is None:
+            self.inner_bot = self.chatbot_class(self.model, self.sys_prompt, self.schema_loader)
+            for role, text in self.turns:
+                if role == "user":
+                    self.inner_bot.add_fake_user_message(text)
+                else:
+                    self.inner_bot.add_fake_model_message(text)
+        return self.inner_bot
+
+    def make_key(self, message: str, schema_key: str, temperature: float) -> str:
+        return LLMResponseCache.make_key(self.provider, self.model, self.sys_prompt, self.turns, message, schema_key, temperature)
+
+    def replay(self, cache_key: str, message: str, record: bool) -> tuple[str, object]:
+        cached_response = self.cache.get(cache_key)
+        if cached_response is None:
+            return None
+        response_text, response_parsed, model_message = cached_response
+        if record:
+            self.add_fake_user_message(message)
+            self.add_fake_model_message(model_message)
+        return response_text, response_parsed
+
+    def start_request(self, cache_key: str, message: str, schema_key: str) -> tuple[ChatBot, int]:
+        if self.replay_only:
+            response_kind = f"{schema_key} response" if schema_key is not None else "plain response"
+            raise ResponseCacheMiss(f"No recorded {self.provider}/{self.model} {response_kind} after {len(self.turns)} turns (cache key {cache_key}) for the message: {message[:200]}")
+        inner_bot = self.get_inner_bot()
+        return inner_bot, len(inner_bot.get_history())
+
+    def finish_request(self, cache_key: str, inner_bot: ChatBot, history_length: int, message: str, schema_key: str, response_text: str, response_parsed, record: bool) -> None:
+        # The inner bot always records, so the model message exactly as the provider bot stores it can be cached
+        model_message = get_history_entry_text(inner_bot.get_history()[-1])
+        if record:
+            self.turns += [["user", message], ["model", model_message]]
+        else:
+            inner_bot.set_history(inner_bot.get_history()[:history_length])
+        self.cache.put(cache_key, self.provider, self.model, schema_key, response_text, response_parsed, model_message)
+
+    def send_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
+        cache_key = self.make_key(message, None, temperature)
+        cached_response = self.replay(cache_key, message, record)
+        if cached_response is not None:
+            return cached_response[0]
+        inner_bot, history_length = self.start_request(cache_key, message, None)
+        response_message = inner_bot.send_message(message, record=True, temperature=temperature)
+        self.finish_request(cache_key, inner_bot, history_length, message, None, response_message, None, record)
+        return response_message
+
+    def get_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7):
+        cache_key = self.make_key(message, schema_key, temperature)
+        cached_response = self.replay(cache_key, message, record)
+        if cached_response is not None:
+            return cached_response
+        inner_bot, history_length = self.start_request(cache_key, message, schema_key)
+        response_text, response_parsed = inner_bot.get_structured_response(message, schema_key, record=True, temperature=temperature)
+        self.finish_request(cache_key, inner_bot, history_length, message, schema_key, response_text, response_parsed, record)
+        return response_text, response_parsed
+
+    async def asend_message(self, message: str, record: bool = True, temperature: float = 0.7) -> str:
+        cache_key = self.make_key(message, None, temperature)
+        cached_response = self.replay(cache_key, message, record)
+        if cached_response is not None:
+            return cached_response[0]
+        inner_bot, history_length = self.start_request(cache_key, message, None)
+        response_message = await inner_bot.asend_message(message, record=True, temperature=temperature)
+        self.finish_request(cache_key, inner_bot, history_length, message, None, response_message, None, record)
+        return response_message
+
+    async def aget_structured_response(self, message: str, schema_key: str, record: bool = True, temperature: float = 0.7):
+        cache_key = self.make_key(message, schema_key, temperature)
+        cached_response = self.replay(cache_key, message, record)
+        if cached_response is not None:
+            return cached_response
+        inner_bot, history_length = self.start_request(cache_key, message, schema_key)
+        response_text, response_parsed = await inner_bot.aget_structured_response(message, schema_key, record=True, temperature=temperature)
+        self.finish_request(cache_key, inner_bot, history_length, message, schema_key, response_text, response_parsed, record)
+        return response_text, response_parsed
+
+    def append_history(self, conversation: dict) -> None:
+        raise NotImplementedError("Raw provider history cannot be cached, use add_fake_user_message or add_fake_model_message")
+
+    def get_history(self) -> list:
+        return self.turns
+
+    def set_history(self, history: list) -> None:
+        self.turns = history
+        self.inner_bot = None
+
+    def reset_history(self) -> None:
+        self.turns = []
+        self.inner_bot = None
+
+    def add_fake_user_message(self, message: str) -> None:
+        self.turns.append(["user", message])
+        if self.inner_bot is not None:
+            self.inner_bot.add_fake_user_message(message)
+
+    def add_fake_model_message(self, message: str) -> None:
+        self.turns.append(["model", message])
+        if self.inner_bot is not None:
+            self.inner_bot.add_fake_model_message(message)
+
+    def is_structured(self) -> bool:
+        return True
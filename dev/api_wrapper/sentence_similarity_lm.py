@@ -1,11 +1,102 @@
+import os
+import platform
+import warnings
+import threading
+import numpy as np
 from sentence_transformers import SentenceTransformer, util
 
+from api_wrapper.embedding_cache import EmbeddingCache
+
+# "torch" runs the model as published. "onnx" runs it exported to ONNX on onnxruntime, and "onnx-int8" runs the dynamically
+# int8 quantized export, which is the fastest on CPU only machines. Exports the model hub does not ship are made on first use
+# and kept in the export directory. Embeddings differ slightly between backends, so each backend has its own embedding cache.
+_SIMILARITY_BACKENDS = ["torch", "onnx", "onnx-int8"]
+_ONNX_EXPORT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "sentence_similarity_onnx")
+
+# Loading a model takes seconds, so every session of a process shares one worker per model, backend and embedding cache
+_similarity_workers = {}
+_similarity_workers_lock = threading.Lock()
+
+def get_similarity_worker(model_name='all-MiniLM-L6-v2', embedding_cache_dir=None, backend="torch"):
+    with _similarity_workers_lock:
+        worker_key = (model_name, backend, embedding_cache_dir)
+        if worker_key not in _similarity_workers:
+            _similarity_workers[worker_key] = SentenceSimilarityWorker(model_name, embedding_cache_dir, backend)
+        return _similarity_workers[worker_key]
+
+def get_quantization_config():
+    return "arm64" if platform.machine().lower() in ["arm64", "aarch64"] else "avx512_vnni"
+
+def has_model_file(model_name, file_name):
+    # Asked up front, as sentence-transformers may quietly export a plain fp32 model instead of failing when file_name is missing
+    if os.path.isdir(model_name):
+        return os.path.isfile(os.path.join(model_name, file_name))
+    from huggingface_hub import file_exists, try_to_load_from_cache
+    repo_id = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    if isinstance(try_to_load_from_cache(repo_id, file_name), str):
+        return True
+    try:
+        return file_exists(repo_id, file_name)
+    except Exception as e:
+        warnings.warn(f"Could not check {repo_id} for {file_name}: {e}")
+        return False
+
+def find_quantized_model(model_name, quantized_file):
+    # Where the int8 model loads from: the model itself when it ships the quantized export, otherwise a local export of it
+    if has_model_file(model_name, quantized_file):
+        return model_name
+    export_dir = os.path.join(_ONNX_EXPORT_DIR, model_name.replace("/", "_"))
+    if not os.path.isfile(os.path.join(export_dir, quantized_file)):
+        # Only in sentence-transformers 3.3 and later, which the other backends do not need
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        warnings.warn(f"{model_name} ships no {quantized_file}, quantizing it into {export_dir}")
+        onnx_model = SentenceTransformer(model_name, backend="onnx")
+        onnx_model.save(export_dir)
+        export_dynamic_quantized_onnx_model(onnx_model, get_quantization_config(), export_dir)
+        if not os.path.isfile(os.path.join(export_dir, quantized_file)):
+            raise FileNotFoundError(f"Quantizing {model_name} did not produce {os.path.join(export_dir, quantized_file)}")
+    return export_dir
+
+def load_sentence_model(model_name, backend):
+    if backend not in _SIMILARITY_BACKENDS:
+        raise ValueError(f"Unknown similarity backend '{backend}', expected one of {_SIMILARITY_BACKENDS}")
+    if backend == "torch":
+        return SentenceTransformer(model_name)
+    if backend == "onnx":
+        return SentenceTransformer(model_name, backend="onnx")
+    quantized_file = f"onnx/model_qint8_{get_quantization_config()}.onnx"
+    return SentenceTransformer(find_quantized_model(model_name, quantized_file), backend="onnx", model_kwargs={"file_name": quantized_file})
+
 class SentenceSimilarityWorker:
-    def __init__(self, model_name='all-MiniLM-L6-v2'):
-        self.model = SentenceTransformer(model_name)
+    def __init__(self, model_name='all-MiniLM-L6-v2', embedding_cache_dir=None, backend="torch"):
+        self.model = load_sentence_model(model_name, backend)
+        self.backend = backend
+        cache_model_name = model_name if backend == "torch" else f"{model_name}-{backend}"
+        self.embedding_cache = EmbeddingCache(embedding_cache_dir, cache_model_name, self.model.get_sentence_embedding_dimension()) if embedding_cache_dir else None
+        # The tokenizer of a shared model must not be used from several threads at once
+        self.lock = threading.Lock()
+
+    def encode(self, sentences):
+        # Only the sentences missing from the embedding cache go through the model
+        if self.embedding_cache is None:
+            with self.lock:
+                return self.model.encode(sentences, convert_to_numpy=True)
+        embeddings = self.embedding_cache.get(sentences)
+        missing_indices = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing_indices:
+            missing_sentences = [sentences[i] for i in missing_indices]
+            with self.lock:
+                new_embeddings = self.model.encode(missing_sentences, convert_to_numpy=True)
+            self.embedding_cache.put(missing_sentences, new_embeddings)
+            for i, embedding in zip(missing_indices, new_embeddings):
+                embeddings[i] = embedding
+        return np.stack(embeddings)
 
     def cosine_similarity(self, sentence1, sentence2):
-        embeddings1 = self.model.encode(sentence1, convert_to_tensor=True)
-        embeddings2 = self.model.encode(sentence2, convert_to_tensor=True)
-        similarity = util.pytorch_cos_sim(embeddings1, embeddings2)
-        return similarity.item()
\ No newline at end of file
+        return self.batch_cosine_similarity(sentence1, [sentence2])[0]
+
+    def batch_cosine_similarity(self, sentence, candidates):
+        # The sentence and all candidates are encoded in one batch, then compared by a single matrix product
+        embeddings = self.encode([sentence] + list(candidates))
+        similarities = util.pytorch_cos_sim(embeddings[:1], embeddings[1:])
+        return similarities[0].tolist()
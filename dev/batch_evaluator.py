@@ -0,0 +1,304 @@
+import os
+import io
+import csv
+import sys
+import json
+import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config import ModelInfo, _SOLVER_TIMEOUT_MS, _SOLVER_TIME_BUDGET, _SOLVER_CACHE_PATH
+from utils.loaders import SchemaLoader, InputTemplateLoader
+from utils.steps import FatalCallError
+from fol_evaluator import FOLEvaluationSession
+from timeline_maker import TimelineMakerSession
+from character_evaluator import CharacterEvaluationSession
+
+# Batch runner for the evaluators of main_evaluator.ipynb. Narratives of the input CSV are fanned out over a process pool,
+# every finished narrative is appended to the output CSV straight away, and a rerun skips the narratives already in it.
+# Usage (from dev/): python batch_evaluator.py fol --model gemini-structured --input test_data/hanna_stories.csv [--workers N] [--shard i/n]
+
+cur_dir = os.path.dirname(os.path.abspath(__file__))
+prompt_dir = os.path.join(cur_dir, "prompts")
+schema_dir = os.path.join(cur_dir, "schemas")
+input_template_dir = os.path.join(cur_dir, "input_templates")
+
+_EVALUATORS = ["baseline", "fol", "outline", "character", "combined"]
+_RESULT_COLUMNS = {"baseline": "consistency", "fol": "unsat_formulas", "outline": "outline_scores", "character": "character_scores", "combined": "consistency"}
+_NARRATIVE_RETRIES = 10
+
+csv.field_size_limit(sys.maxsize)
+
+# Utility functions for narrative processing
+def wrap_narrative(narrative: str) -> str:
+    if not "(User:" in narrative:
+        return narrative + "\n(User:[hidden])"
+    return narrative
+
+def divide_long_narratives(narrative: str, threshold: int = 1000, section_length: int = 800) -> list[str]:
+    sections = []
+    start = 0
+    at_least_one_section = False
+    while len(narrative) - start > threshold or not at_least_one_section:
+        at_least_one_section = True
+        step_length = section_length if (len(narrative) - start) > (section_length * 2) else start + (len(narrative) - start) // 2
+        fullstop_index = narrative.find('. ', start + step_length)
+        if fullstop_index != -1:
+            sections.append(wrap_narrative(narrative[start:fullstop_index + 1].strip()))
+            start = fullstop_index + 2
+        else:
+            sections.append(wrap_narrative(narrative[start:].strip()))
+            return sections
+    if start < len(narrative):
+        sections.append(wrap_narrative(narrative[start:].strip()))
+
+    return sections
+
+def run_baseline_evaluator_one(model_info: ModelInfo, row: dict) -> int:
+    message = InputTemplateLoader(input_template_dir).load("consistency_evaluator_baseline").format(target_story=row["narrative"])
+    if model_info.output_format() == "json":
+        bot = model_info.chatbot()(model_info.model(), "", SchemaLoader(schema_dir))
+        text_response, json_response = bot.get_structured_response(message, schema_key="consistency_evaluator_baseline", record=False, temperature=0)
+        return json_response["consistency"]
+    else:
+        raise ValueError(f"Unsupported output format: {model_info.output_format()}")
+
+def run_fol_evaluator_one(model_info: ModelInfo, row: dict, checkpoint_dir: str = None, solver_timeout_ms: int = _SOLVER_TIMEOUT_MS, solver_time_budget: float = _SOLVER_TIME_BUDGET, solver_cache_path: str = _SOLVER_CACHE_PATH) -> str:
+    timeline_session = TimelineMakerSession(model_info, prompt_dir=prompt_dir, schema_dir=schema_dir, input_template_dir=input_template_dir)
+    fol_session = FOLEvaluationSession(model_info, prompt_dir=prompt_dir, schema_dir=schema_dir, input_template_dir=input_template_dir, solver_timeout_ms=solver_timeout_ms, solver_time_budget=solver_time_budget, solver_cache_path=solver_cache_path)
+    # Both sessions are checkpointed after every section, so a retry or a rerun picks up at the section that failed
+    checkpoint_paths = [os.path.join(checkpoint_dir, f"{row['narrative_id']}_{name}.json") for name in ["timeline", "fol"]] if checkpoint_dir else []
+    if checkpoint_paths and all(os.path.exists(path) for path in checkpoint_paths):
+        timeline_session.load_checkpoint(checkpoint_paths[0])
+        fol_session.load_checkpoint(checkpoint_paths[1])
+        print(f"Resuming narrative {row['narrative_id']} at section {len(fol_session.rp_history) + 1}")
+    for section in divide_long_narratives(row["narrative"])[len(fol_session.rp_history):]:
+        timeline_session.append_conversation(section)
+        fol_session.append_conversation(section, new_timeline=timeline_session.get_timeline())
+        if checkpoint_paths:
+            timeline_session.save_checkpoint(checkpoint_paths[0])
+            fol_session.save_checkpoint(checkpoint_paths[1])
+    all_unsat_formulas = set()
+    for log in fol_session.logs:
+        all_unsat_formulas.update(log["unsat_formulas"])
+    for path in checkpoint_paths:
+        os.remove(path)
+    return "\n\n".join(list(all_unsat_formulas)) if len(all_unsat_formulas) > 0 else "No Output"
+
+def run_outline_evaluator_one(model_info: ModelInfo, row: dict) -> str:
+    # Imported here as the outline session needs sentence_transformers, which the other evaluators do not
+    from outline_evaluator import OutlineEvaluationSession
+    outline_session = OutlineEvaluationSession(model_info, None, prompt_dir=prompt_dir, schema_dir=schema_dir, input_template_dir=input_template_dir)
+    all_scores = {"abruptness": [], "predicability": []}
+    for section in divide_long_narratives(row["narrative"]):
+        new_scores = outline_session.append_conversation(section)
+        all_scores["abruptness"].append(new_scores["abruptness"])
+        all_scores["predicability"].append(new_scores["predicability"])
+    return str(all_scores)
+
+def run_character_evaluator_one(model_info: ModelInfo, row: dict) -> str:
+    character_session = CharacterEvaluationSession(model_info, prompt_dir=prompt_dir, schema_dir=schema_dir, input_template_dir=input_template_dir)
+    character_scores = {}
+    for section in divide_long_narratives(row["narrative"]):
+        new_scores = character_session.append_conversation(section)
+        for name, score in new_scores.items():
+            if name not in character_scores:
+                character_scores[name] = {"self_integrity": [], "action_integrity": []}
+            character_scores[name]["self_integrity"].append(score["self_integrity"])
+            character_scores[name]["action_integrity"].append(score["action_integrity"])
+    return json.dumps(character_scores, indent=2)
+
+def run_combined_evaluator_one(model_info: ModelInfo, row: dict) -> int:
+    input_template = InputTemplateLoader(input_template_dir).load("consistency_evaluator_combined")
+    message = input_template.format(target_story=row["narrative"], outline_evaluator_result=row["outline_scores"], character_evaluator_result=row["character_scores"], logical_evaluator_result=row["unsat_formulas"])
+    if model_info.output_format() == "json":
+        bot = model_info.chatbot()(model_info.model(), "", SchemaLoader(schema_dir))
+        text_response, json_response = bot.get_structured_response(message, schema_key="consistency_evaluator_combined", record=False, temperature=0.1)
+        return json_response["consistency"]
+    else:
+        raise ValueError(f"Unsupported output format: {model_info.output_format()}")
+
+_evaluator_runs = {
+    "baseline": run_baseline_evaluator_one,
+    "fol": run_fol_evaluator_one,
+    "outline": run_outline_evaluator_one,
+    "character": run_character_evaluator_one,
+    "combined": run_combined_evaluator_one,
+}
+
+# Written when a narrative runs out of retries, as the notebook runners did, so a batch is never held up by one narrative
+_evaluator_fallbacks = {
+    "baseline": None,
+    "fol": "Error processing narrative",
+    "outline": str({"abruptness": [0], "predicability": [0.5]}),
+    "character": json.dumps({}),
+    "combined": None,
+}
+
+def evaluate_narrative(evaluator: str, model_name: str, row: dict, retries: int, checkpoint_dir: str = None, solver_timeout_ms: int = _SOLVER_TIMEOUT_MS, solver_time_budget: float = _SOLVER_TIME_BUDGET, solver_cache_path: str = _SOLVER_CACHE_PATH) -> tuple[str, object, int]:
+    # Runs in a pool worker, returns (narrative_id, result, failed attempts)
+    model_info = ModelInfo(model_name)
+    run_args = (model_info, row, checkpoint_dir, solver_timeout_ms, solver_time_budget, solver_cache_path) if evaluator == "fol" else (model_info, row)
+    failed_attempts = 0
+    while True:
+        try:
+            return row["narrative_id"], _evaluator_runs[evaluator](*run_args), failed_attempts
+        except FatalCallError as e:
+            # Another attempt would fail the same way, e.g. on a response missing from a replay only cache
+            print(f"Error processing narrative {row['narrative_id']}, not retried: {e}")
+            return row["narrative_id"], None, failed_attempts + 1
+        except Exception as e:
+            failed_attempts += 1
+            print(f"Error processing narrative {row['narrative_id']} (attempt {failed_attempts}/{retries}): {e}")
+            if failed_attempts >= retries:
+                print(f"Failed to process narrative {row['narrative_id']} after multiple attempts.")
+                return row["narrative_id"], _evaluator_fallbacks[evaluator], failed_attempts
+
+def read_csv_rows(path: str) -> list[dict]:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return list(csv.DictReader(f))
+
+def get_output_path(input_path: str, prefix: str, evaluator: str, model_name: str, shard: tuple[int, int] = None) -> str:
+    out_name = f"{prefix}_{evaluator}_output_{model_name}"
+    if shard is not None:
+        out_name += f"_shard{shard[0]}of{shard[1]}"
+    return os.path.join(os.path.dirname(input_path), out_name + ".csv")
+
+def load_input_rows(evaluator: str, input_path: str, prefix: str, model_name: str) -> list[dict]:
+    rows = read_csv_rows(input_path)
+    if evaluator == "combined":
+        # The combined evaluator reads the outputs of the three session based evaluators for the same model
+        for sub_evaluator in ["outline", "character", "fol"]:
+            column = _RESULT_COLUMNS[sub_evaluator]
+            sub_results = {sub_row["narrative_id"]: sub_row[column] for sub_row in read_csv_rows(get_output_path(input_path, prefix, sub_evaluator, model_name))}
+            for row in rows:
+                row[column] = sub_results.get(row["narrative_id"], "")
+    return rows
+
+def parse_shard(shard_text: str) -> tuple[int, int]:
+    shard_index, shard_count = [int(part) for part in shard_text.split("/")]
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(f"Invalid shard '{shard_text}', expected i/n with 0 <= i < n")
+    return shard_index, shard_count
+
+def select_shard(rows: list[dict], shard: tuple[int, int]) -> list[dict]:
+    # Round robin by position, so every shard gets a similar mix of short and long narratives
+    if shard is None:
+        return rows
+    return [row for i, row in enumerate(rows) if i % shard[1] == shard[0]]
+
+def prepare_output(out_path: str, result_column: str) -> set:
+    # Returns the ids already done. Rows are appended whole, so a crash can only leave the last one cut short, which is dropped
+    if not os.path.exists(out_path) or os.path.getsize(out_path) == 0:
+        with open(out_path, "w", encoding="utf-8", newline="") as f:
+            csv.writer(f).writerow(["narrative_id", result_column])
+        return set()
+    with open(out_path, "r", encoding="utf-8", newline="") as f:
+        content = f.read()
+    rows = []
+    try:
+        for row in csv.reader(io.StringIO(content), strict=True):
+            rows.append(row)
+        # Without a closing line break the last row parsed fine but may still be missing its end
+        cut_short = not content.endswith("\n")
+        if cut_short and len(rows) > 1:
+            rows.pop()
+    except csv.Error:
+        # A quoted result cut short never parses, so the rows read so far are the complete ones
+        cut_short = True
+    if cut_short:
+        with open(out_path, "w", encoding="utf-8", newline="") as f:
+            csv.writer(f).writerows(rows)
+    return {row[0] for row in rows[1:]}
+
+def append_output_row(out_path: str, narrative_id: str, result) -> None:
+    with open(out_path, "a", encoding="utf-8", newline="") as f:
+        csv.writer(f).writerow([narrative_id, result])
+        f.flush()
+        os.fsync(f.fileno())
+
+def sort_output(out_path: str) -> None:
+    with open(out_path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = sorted(reader, key=lambda row: int(row[0]) if row[0].isdigit() else row[0])
+    temp_path = out_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+    os.replace(temp_path, out_path)
+
+def merge_shards(input_path: str, prefix: str, evaluator: str, model_name: str, shard_count: int) -> str:
+    out_path = get_output_path(input_path, prefix, evaluator, model_name)
+    result_column = _RESULT_COLUMNS[evaluator]
+    done_ids = prepare_output(out_path, result_column)
+    for shard_index in range(shard_count):
+        shard_path = get_output_path(input_path, prefix, evaluator, model_name, (shard_index, shard_count))
+        if not os.path.exists(shard_path):
+            print(f"Missing shard output {shard_path}")
+            continue
+        prepare_output(shard_path, result_column)
+        for row in read_csv_rows(shard_path):
+            if row["narrative_id"] not in done_ids:
+                append_output_row(out_path, row["narrative_id"], row[result_column])
+                done_ids.add(row["narrative_id"])
+    sort_output(out_path)
+    return out_path
+
+def run_batch(evaluator: str, model_name: str, input_path: str, prefix: str, workers: int, shard: tuple[int, int] = None, retries: int = _NARRATIVE_RETRIES, out_path: str = None, checkpoint_dir: str = None, solver_timeout_ms: int = _SOLVER_TIMEOUT_MS, solver_time_budget: float = _SOLVER_TIME_BUDGET, solver_cache_path: str = _SOLVER_CACHE_PATH) -> str:
+    out_path = out_path or get_output_path(input_path, prefix, evaluator, model_name, shard)
+    if evaluator == "fol":
+        checkpoint_dir = checkpoint_dir or os.path.splitext(out_path)[0] + "_checkpoints"
+        os.makedirs(checkpoint_dir, exist_ok=True)
+    rows = select_shard(load_input_rows(evaluator, input_path, prefix, model_name), shard)
+    done_ids = prepare_output(out_path, _RESULT_COLUMNS[evaluator])
+    pending_rows = [row for row in rows if row["narrative_id"] not in done_ids]
+    if not pending_rows:
+        print("No new narratives to process.")
+        return out_path
+    print(f"Processing {len(pending_rows)} narratives, {len(rows) - len(pending_rows)} already done in {out_path}")
+
+    done_count = len(rows) - len(pending_rows)
+    failed_count = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(evaluate_narrative, evaluator, model_name, row, retries, checkpoint_dir, solver_timeout_ms, solver_time_budget, solver_cache_path) for row in pending_rows]
+        for future in as_completed(futures):
+            narrative_id, result, failed_attempts = future.result()
+            if result is None:
+                # Nothing sensible to fall back to, left out so the next run tries it again
+                failed_count += 1
+                continue
+            append_output_row(out_path, narrative_id, result)
+            done_count += 1
+            print(f"Overall progress: {done_count}/{len(rows)}")
+    sort_output(out_path)
+    if failed_count:
+        print(f"{failed_count} narratives failed and were left for the next run.")
+    elif checkpoint_dir and not os.listdir(checkpoint_dir):
+        os.rmdir(checkpoint_dir)
+    return out_path
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Run an evaluator over every narrative of a CSV, resuming from its partial output.")
+    arg_parser.add_argument("evaluator", choices=_EVALUATORS)
+    arg_parser.add_argument("--model", required=True, help="Model info name from config, e.g. gemini-structured")
+    arg_parser.add_argument("--input", default=os.path.join(cur_dir, "test_data", "hanna_stories.csv"), help="CSV with narrative_id and narrative columns")
+    arg_parser.add_argument("--prefix", default="hanna", help="Dataset name the output files are prefixed with")
+    arg_parser.add_argument("--output", default=None, help="Output CSV, {prefix}_{evaluator}_output_{model}.csv next to the input by default")
+    arg_parser.add_argument("--workers", type=int, default=os.cpu_count())
+    arg_parser.add_argument("--shard", default=None, help="Only run shard i of n, as i/n, into its own output file")
+    arg_parser.add_argument("--retries", type=int, default=_NARRATIVE_RETRIES, help="Attempts per narrative before its fallback result is written")
+    arg_parser.add_argument("--checkpoint-dir", default=None, help="Where FOL runs checkpoint their sessions after every section, next to the output by default")
+    arg_parser.add_argument("--solver-timeout-ms", type=int, default=_SOLVER_TIMEOUT_MS, help="Timeout of every FOL solver check, 0 for none")
+    arg_parser.add_argument("--solver-budget-ms", type=int, default=None, help="Total FOL solving time per narrative, checks past it report unknown")
+    arg_parser.add_argument("--solver-cache", default=_SOLVER_CACHE_PATH, help="SQLite file caching FOL solver results, shared by the workers and by reruns")
+    arg_parser.add_argument("--merge-shards", type=int, default=None, metavar="N", help="Merge the outputs of N shards into the main output file and exit")
+    args = arg_parser.parse_args()
+    solver_time_budget = args.solver_budget_ms / 1000 if args.solver_budget_ms is not None else _SOLVER_TIME_BUDGET
+
+    if args.merge_shards:
+        print(f"Merged into {merge_shards(args.input, args.prefix, args.evaluator, args.model, args.merge_shards)}")
+    else:
+        shard = parse_shard(args.shard) if args.shard else None
+        out_path = run_batch(args.evaluator, args.model, args.input, args.prefix, args.workers, shard, args.retries, args.output, args.checkpoint_dir, args.solver_timeout_ms, solver_time_budget, args.solver_cache)
+        print(f"{args.evaluator} run completed: {out_path}")
@@ -0,0 +1,96 @@
+import os
+import time
+import argparse
+from z3 import *
+from lark import Lark
+
+from parser.str_to_z3_parser import Z3Builder, FOLParsingError, parse_z3, close_brackets, get_fol_parser, clear_fol_parsers, get_parse_path_counts, reset_parse_path_counts, FOLParseCache
+from benchmarks.sample_formulas import load_sample_narratives
+
+# Usage (from dev/): python -m benchmarks.parser_benchmark [--repeat N]
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+
+def make_builder(relations: dict) -> Z3Builder:
+    z3_context = Context()
+    functions = {name: Function(name, *[IntSort(z3_context) for i in range(arity)], BoolSort(z3_context)) for name, arity in relations.items()}
+    return Z3Builder(functions.get, z3_context)
+
+def parse_z3_uncached(builder: Z3Builder, formula_str: str):
+    # The original behaviour: the grammar is read and compiled again for every formula
+    grammar_path = os.path.join(cur_dir, "..", "parser", "fol.lark")
+    with open(grammar_path, 'r') as f:
+        grammar = f.read()
+    parser = Lark(grammar, start='formula', parser='earley', lexer='dynamic')
+    tree = parser.parse(close_brackets(formula_str))
+    return builder.transform(tree)
+
+def parse_z3_earley(builder: Z3Builder, formula_str: str):
+    tree = get_fol_parser().parse(close_brackets(formula_str))
+    return builder.transform(tree)
+
+def load_workload() -> list[tuple[Z3Builder, list[str]]]:
+    # Formulas that do not build against their narrative's function table (e.g. a relation redeclared with another arity) are dropped
+    workload = []
+    for narrative in load_sample_narratives():
+        builder = make_builder(narrative["relations"])
+        formulas = []
+        for section in narrative["sections"]:
+            for scope, formula in section:
+                try:
+                    parse_z3(builder, formula)
+                    formulas.append(formula)
+                except FOLParsingError:
+                    continue
+        workload.append((builder, formulas))
+    return workload
+
+def time_parsing(parse_function, workload: list[tuple[Z3Builder, list[str]]], repeat: int) -> float:
+    formula_count = 0
+    start = time.perf_counter()
+    for i in range(repeat):
+        for builder, formulas in workload:
+            for formula in formulas:
+                parse_function(builder, formula)
+            formula_count += len(formulas)
+    elapsed = time.perf_counter() - start
+    return formula_count / elapsed
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Formulas per second of the FOL parser on the sample logs.")
+    arg_parser.add_argument("--repeat", type=int, default=3)
+    args = arg_parser.parse_args()
+    
+    workload = load_workload()
+    print(f"Loaded {sum(len(formulas) for builder, formulas in workload)} formulas from {len(workload)} sample logs.")
+    
+    uncached_rate = time_parsing(parse_z3_uncached, workload, args.repeat)
+    print(f"Grammar compiled per formula: {uncached_rate:.1f} formulas/s")
+    
+    clear_fol_parsers()
+    earley_rate = time_parsing(parse_z3_earley, workload, args.repeat)
+    print(f"Shared Earley parser:         {earley_rate:.1f} formulas/s ({earley_rate / uncached_rate:.1f}x)")
+    
+    clear_fol_parsers()
+    reset_parse_path_counts()
+    lalr_rate = time_parsing(parse_z3, workload, args.repeat)
+    path_counts = get_parse_path_counts()
+    hit_rate = path_counts.get("lalr", 0) / sum(path_counts.values())
+    print(f"LALR with Earley fallback:    {lalr_rate:.1f} formulas/s ({lalr_rate / uncached_rate:.1f}x), LALR hit rate {hit_rate:.1%}")
+    
+    parse_caches = {id(builder): FOLParseCache() for builder, formulas in workload}
+    cached_rate = time_parsing(lambda builder, formula: parse_z3(builder, formula, parse_cache=parse_caches[id(builder)]), workload, args.repeat)
+    cache_hits = sum(parse_cache.hits for parse_cache in parse_caches.values())
+    cache_lookups = cache_hits + sum(parse_cache.misses for parse_cache in parse_caches.values())
+    print(f"With parse cache:             {cached_rate:.1f} formulas/s ({cached_rate / uncached_rate:.1f}x), cache hit rate {cache_hits / cache_lookups:.1%}")
+    
+    mismatches = 0
+    for builder, formulas in workload:
+        for formula in formulas:
+            parse_paths = []
+            if not parse_z3(builder, formula, parse_paths).eq(parse_z3_earley(builder, formula)):
+                mismatches += 1
+                print(f"  Mismatch between grammars ({parse_paths[0]}): {formula}")
+            elif parse_paths[0] == "earley":
+                print(f"  Earley fallback: {formula}")
+    print(f"Formulas built differently by the two grammars: {mismatches}")
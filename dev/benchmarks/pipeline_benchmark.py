@@ -0,0 +1,106 @@
+import os
+import json
+import time
+import argparse
+import statistics
+
+from config import ModelInfo
+from api_wrapper.mock_chatbot import set_mock_latency
+from utils.loaders import get_loader_stats
+from fol_evaluator import FOLEvaluationSession
+from timeline_maker import TimelineMakerSession
+from character_evaluator import CharacterEvaluationSession
+from main_pipeline import stream_timeline_snapshots, lockstep_timeline_snapshots
+
+# Drives the evaluation sessions over the sample narratives with the mock provider, so the pipeline's own overhead and its
+# behaviour under provider latency can be measured without API keys or network.
+# Usage (from dev/): python -m benchmarks.pipeline_benchmark [--narratives N] [--latency none|fixed|uniform|lognormal] [--stages timeline fol outline character] [--sequential-stages] [--timeline-lookahead N]
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+dev_dir = os.path.join(cur_dir, "..")
+session_dirs = {"prompt_dir": os.path.join(dev_dir, "prompts"), "schema_dir": os.path.join(dev_dir, "schemas"), "input_template_dir": os.path.join(dev_dir, "input_templates")}
+
+def load_narratives(count: int) -> list:
+    with open(os.path.join(dev_dir, "sample_rp.json"), "r", encoding="utf-8") as f:
+        narratives = json.load(f)
+    return narratives[:count] if count else narratives
+
+def make_outline_session(model_info: ModelInfo):
+    # The outline session needs sentence_transformers, which not every environment has
+    try:
+        from outline_evaluator import OutlineEvaluationSession
+    except ImportError as e:
+        print(f"Skipping the outline stage: {e}")
+        return None
+    return OutlineEvaluationSession(model_info, None, **session_dirs)
+
+def run_narrative(narrative: list, model_info: ModelInfo, stages: list, concurrent_stages: bool, timeline_lookahead: int) -> dict:
+    stage_times = {stage: [] for stage in stages}
+    timeline_session = TimelineMakerSession(model_info, **session_dirs)
+    fol_session = FOLEvaluationSession(model_info, concurrent_stages=concurrent_stages, **session_dirs) if "fol" in stages else None
+    outline_session = make_outline_session(model_info) if "outline" in stages else None
+    character_session = CharacterEvaluationSession(model_info, **session_dirs) if "character" in stages else None
+
+    start = time.perf_counter()
+    start_disk_reads = get_loader_stats()["disk_reads"]
+    if timeline_lookahead > 0:
+        timeline_snapshots = stream_timeline_snapshots(timeline_session, narrative, timeline_lookahead)
+    else:
+        timeline_snapshots = lockstep_timeline_snapshots(timeline_session, narrative)
+    while True:
+        # With a lookahead this only counts the time spent waiting for the timeline maker
+        stage_start = time.perf_counter()
+        snapshot = next(timeline_snapshots, None)
+        if snapshot is None:
+            break
+        section, new_timeline = snapshot
+        stage_times["timeline"].append(time.perf_counter() - stage_start)
+        if fol_session is not None:
+            stage_start = time.perf_counter()
+            fol_session.append_conversation(section, new_timeline=new_timeline)
+            stage_times["fol"].append(time.perf_counter() - stage_start)
+        if outline_session is not None:
+            stage_start = time.perf_counter()
+            outline_session.append_conversation(section)
+            stage_times["outline"].append(time.perf_counter() - stage_start)
+        if character_session is not None:
+            stage_start = time.perf_counter()
+            character_session.append_conversation(section)
+            stage_times["character"].append(time.perf_counter() - stage_start)
+    fol_stage_latency = [log["stage_latency"] for log in fol_session.logs] if fol_session is not None else []
+    return {"end_to_end": time.perf_counter() - start, "sections": len(narrative), "stage_times": stage_times, "fol_stage_latency": fol_stage_latency, "disk_reads": get_loader_stats()["disk_reads"] - start_disk_reads}
+
+def summarize_times(times: list) -> str:
+    if not times:
+        return "skipped"
+    ordered = sorted(times)
+    p95 = ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+    return f"mean {statistics.mean(times):7.3f}s  p95 {p95:7.3f}s  total {sum(times):8.3f}s"
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Per-stage and end-to-end latency of the evaluation pipeline on the mock provider.")
+    arg_parser.add_argument("--narratives", type=int, default=0, help="Number of sample narratives to run, all by default")
+    arg_parser.add_argument("--stages", nargs="+", default=["timeline", "fol", "outline", "character"])
+    arg_parser.add_argument("--latency", default="none", choices=["none", "fixed", "uniform", "lognormal"])
+    arg_parser.add_argument("--seconds", type=float, default=1.0, help="Fixed latency, or the median of the lognormal latency")
+    arg_parser.add_argument("--low", type=float, default=0.5)
+    arg_parser.add_argument("--high", type=float, default=2.0)
+    arg_parser.add_argument("--sigma", type=float, default=0.5)
+    arg_parser.add_argument("--sequential-stages", action="store_true", help="Run the FOL session's semantic analyser and formula maker one after another")
+    arg_parser.add_argument("--timeline-lookahead", type=int, default=0, help="Sections the timeline maker may run ahead of the other stages, 0 runs them in lockstep")
+    args = arg_parser.parse_args()
+
+    set_mock_latency("mock", args.latency, seconds=args.seconds, low=args.low, high=args.high, median=args.seconds, sigma=args.sigma)
+    model_info = ModelInfo("mock-structured")
+    stages = ["timeline"] + [stage for stage in args.stages if stage != "timeline"]
+
+    runs = [run_narrative(narrative, model_info, stages, not args.sequential_stages, args.timeline_lookahead) for narrative in load_narratives(args.narratives)]
+    for stage in stages:
+        print(f"{stage:<21} {summarize_times([stage_time for run in runs for stage_time in run['stage_times'][stage]])}")
+        if stage == "fol":
+            for fol_stage in ["declaration_builder", "semantic_analyser", "formula_maker", "analysis_stages", "solver"]:
+                print(f"  {fol_stage:<19} {summarize_times([latency[fol_stage] for run in runs for latency in run['fol_stage_latency']])}")
+    print(f"{'narrative':<21} {summarize_times([run['end_to_end'] for run in runs])}")
+    print(f"{sum(run['sections'] for run in runs)} sections in {len(runs)} narratives")
+    # Prompts, templates and schemas are only read from disk while the loader cache warms up
+    print(f"Prompt, template and schema reads per narrative: {[run['disk_reads'] for run in runs]}")
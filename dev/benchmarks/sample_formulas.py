@@ -0,0 +1,131 @@
+import os
+import re
+import ast
+import json
+
+# The sample logs store formulas as printed by z3, which happens to be valid Python expression syntax,
+# so they are walked with ast and rendered back into the FOL language accepted by fol.lark
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+SAMPLE_LOGS = [os.path.join(cur_dir, "..", f"sample_fol_log{suffix}.json") for suffix in ["", "2", "3"]]
+
+_COMPARE_OPS = {
+    ast.Lt: "<",
+    ast.LtE: "<=",
+    ast.Gt: ">",
+    ast.GtE: ">=",
+    ast.Eq: "=",
+    ast.NotEq: "!=",
+}
+
+class UnsupportedFormula(Exception):
+    pass
+
+def z3_str_to_fol(node) -> str:
+    if isinstance(node, ast.Expression):
+        return z3_str_to_fol(node.body)
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Constant) and isinstance(node.value, int):
+        return str(node.value)
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        op = _COMPARE_OPS.get(type(node.ops[0]))
+        if op is None:
+            raise UnsupportedFormula(ast.dump(node))
+        return f"{z3_str_to_fol(node.left)} {op} {z3_str_to_fol(node.comparators[0])}"
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        name = node.func.id
+        args = node.args
+        if name in ("ForAll", "Exists"):
+            bound = args[0].elts if isinstance(args[0], ast.List) else [args[0]]
+            quantifier = "forall" if name == "ForAll" else "exists"
+            return f"{quantifier} ({' '.join(z3_str_to_fol(var) for var in bound)}) . ({z3_str_to_fol(args[1])})"
+        if name in ("And", "Or"):
+            joiner = " and " if name == "And" else " or "
+            return "(" + joiner.join(z3_str_to_fol(arg) for arg in args) + ")"
+        if name == "Implies":
+            return f"({z3_str_to_fol(args[0])} -> {z3_str_to_fol(args[1])})"
+        if name == "Not":
+            return f"not ({z3_str_to_fol(args[0])})"
+        return f"{name}({', '.join(z3_str_to_fol(arg) for arg in args)})"
+    raise UnsupportedFormula(ast.dump(node))
+
+def collect_relations(node, relations: dict) -> None:
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+        if node.func.id not in ("ForAll", "Exists", "And", "Or", "Implies", "Not"):
+            relations[node.func.id] = len(node.args)
+    for child in ast.iter_child_nodes(node):
+        collect_relations(child, relations)
+
+def split_formula_block(formula_block: str) -> list[tuple[str, str]]:
+    # Pretty printed formulas span several lines, a formula ends where its brackets are balanced
+    scoped_lines = []
+    scope = "global"
+    pending = ""
+    for line in formula_block.splitlines():
+        if not pending and line.startswith("Scope: "):
+            scope = line[len("Scope: "):].strip()
+            continue
+        pending += " " + line.strip()
+        if pending.count("(") == pending.count(")"):
+            scoped_lines.append((scope, pending.strip()))
+            pending = ""
+    return scoped_lines
+
+def parse_declared_objects(declarations_str: str) -> list[str]:
+    # The "Objects:" block of the declarations the session logs at the end, one "name: description" line each
+    objects = []
+    in_objects = False
+    for line in declarations_str.splitlines():
+        if line.strip() in ("Objects:", "Relations:"):
+            in_objects = line.strip() == "Objects:"
+        elif in_objects and ":" in line:
+            objects.append(line.split(":", 1)[0].strip())
+    return objects
+
+def load_sample_narratives(log_paths: list = None) -> list[dict]:
+    # Every log is one narrative: the formulas of each section as (scope, fol_formula) pairs plus the arity of every relation.
+    # Relation names are only unique within a narrative, so narratives must not share a function table
+    narratives = []
+    for log_path in log_paths or SAMPLE_LOGS:
+        with open(log_path, "r", encoding="utf-8") as f:
+            logs = json.load(f)
+        sections = []
+        relations = {}
+        objects = []
+        for log in logs:
+            if "full_declarations" in log:
+                objects = parse_declared_objects(log["full_declarations"])
+            if "formula" not in log:
+                continue
+            section = []
+            for scope, z3_str in split_formula_block(log["formula"]):
+                try:
+                    tree = ast.parse(z3_str, mode="eval")
+                    section.append((scope, z3_str_to_fol(tree)))
+                    collect_relations(tree, relations)
+                except (SyntaxError, UnsupportedFormula):
+                    continue
+            sections.append(section)
+        narratives.append({"name": os.path.basename(log_path), "sections": sections, "relations": relations, "objects": objects})
+    return narratives
+
+_FOL_KEYWORDS = {"forall", "exists", "and", "or", "not"}
+_IDENT_PATTERN = re.compile(r"\b[a-zA-Z][a-zA-Z0-9_]*+(?!\s*\()")
+
+def rename_constants(formula: str, suffix: str) -> str:
+    # Gives every object, time point and bound variable a suffix while keeping relation names, used to stretch the samples into longer narratives
+    def rename(match):
+        name = match.group(0)
+        if name in _FOL_KEYWORDS:
+            return name
+        return name + suffix
+    return _IDENT_PATTERN.sub(rename, formula)
+
+def stretch_sections(sections: list, loops: int) -> list:
+    stretched = []
+    for loop in range(loops):
+        suffix = f"_l{loop}" if loop > 0 else ""
+        for section in sections:
+            stretched.append([(scope, rename_constants(formula, suffix)) for scope, formula in section])
+    return stretched
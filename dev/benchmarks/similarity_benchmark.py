@@ -0,0 +1,61 @@
+import os
+import re
+import json
+import time
+import argparse
+import statistics
+
+from api_wrapper.sentence_similarity_lm import SentenceSimilarityWorker, _SIMILARITY_BACKENDS
+
+# Throughput of the local sentence similarity backends and how far their similarities drift from the PyTorch model.
+# Every section of the sample narratives is compared with the sentences of the section after it, standing in for the
+# outline predictions, and the workload is repeated to reach a stable timing. No embedding cache is used.
+# Usage (from dev/): python -m benchmarks.similarity_benchmark [--model NAME] [--backends torch onnx onnx-int8] [--repeat N]
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+_SENTENCE_PATTERN = re.compile(r"(?<=[.!?])\s+")
+
+def load_workload(max_candidates: int) -> list[tuple[str, list[str]]]:
+    with open(os.path.join(cur_dir, "..", "sample_rp.json"), "r", encoding="utf-8") as f:
+        narratives = json.load(f)
+    workload = []
+    for narrative in narratives:
+        for section, next_section in zip(narrative, narrative[1:]):
+            candidates = [sentence for sentence in _SENTENCE_PATTERN.split(next_section) if sentence.strip()]
+            if candidates:
+                workload.append((section, candidates[:max_candidates]))
+    return workload
+
+def run_backend(model_name: str, backend: str, workload: list, repeat: int) -> tuple[float, float, list]:
+    load_start = time.perf_counter()
+    worker = SentenceSimilarityWorker(model_name, backend=backend)
+    load_time = time.perf_counter() - load_start
+    # Warm-up, the first calls include one-off graph and allocator set-up
+    similarities = [worker.batch_cosine_similarity(section, candidates) for section, candidates in workload]
+    start = time.perf_counter()
+    for i in range(repeat):
+        for section, candidates in workload:
+            worker.batch_cosine_similarity(section, candidates)
+    return load_time, time.perf_counter() - start, similarities
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Throughput and similarity drift of the sentence similarity backends.")
+    arg_parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    arg_parser.add_argument("--backends", nargs="+", default=_SIMILARITY_BACKENDS, choices=_SIMILARITY_BACKENDS)
+    arg_parser.add_argument("--repeat", type=int, default=5)
+    arg_parser.add_argument("--max-candidates", type=int, default=8, help="Predictions compared with every section")
+    args = arg_parser.parse_args()
+
+    workload = load_workload(args.max_candidates)
+    sentence_count = sum(1 + len(candidates) for section, candidates in workload) * args.repeat
+    baseline = None
+    for backend in args.backends:
+        load_time, run_time, similarities = run_backend(args.model, backend, workload, args.repeat)
+        print(f"{backend:10s} load {load_time:6.2f}s  {sentence_count / run_time:8.1f} sentences/s  {run_time / (len(workload) * args.repeat) * 1000:7.2f}ms per section")
+        if baseline is None:
+            baseline = (backend, similarities)
+            continue
+        # Drift against the first backend: how much the scores move and whether the best prediction stays the same
+        differences = [abs(a - b) for base_values, values in zip(baseline[1], similarities) for a, b in zip(base_values, values)]
+        same_best = sum(1 for base_values, values in zip(baseline[1], similarities) if base_values.index(max(base_values)) == values.index(max(values)))
+        print(f"{'':10s} drift from {baseline[0]}: mean {statistics.mean(differences):.5f}  max {max(differences):.5f}  same best prediction in {same_best}/{len(workload)} sections")
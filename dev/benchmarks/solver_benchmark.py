@@ -0,0 +1,84 @@
+import os
+import time
+import argparse
+from z3 import *
+from collections import defaultdict
+
+from config import ModelInfo
+from fol_evaluator import FOLEvaluationSession, Relation
+from parser.str_to_z3_parser import parse_z3, FOLParsingError
+from benchmarks.sample_formulas import load_sample_narratives, stretch_sections
+
+# Replays the formulas of the sample logs section by section through FOLEvaluationSession's solving stage, without any LLM call.
+# Usage (from dev/): python -m benchmarks.solver_benchmark [--loops N] [--modes scratch sliced incremental] [--encodings distinct pinned]
+
+cur_dir = os.path.dirname(os.path.realpath(__file__))
+dev_dir = os.path.join(cur_dir, "..")
+
+def make_session(relations: dict, objects: list = None, **session_options) -> FOLEvaluationSession:
+    session = FOLEvaluationSession(ModelInfo("gemini-structured"), prompt_dir=os.path.join(dev_dir, "prompts"), schema_dir=os.path.join(dev_dir, "schemas"), input_template_dir=os.path.join(dev_dir, "input_templates"), **session_options)
+    # Declared objects are what the pinned encoding pins, time points and other constants are not
+    for name in objects or []:
+        session.objects[name] = ""
+    for name, arity in relations.items():
+        params = [f"x{i}" for i in range(arity)]
+        z3_function = Function(name, *[IntSort(session.z3_context) for param in params], BoolSort(session.z3_context))
+        session.relations[name] = Relation(name, params, "", z3_function)
+    return session
+
+def parse_section(session: FOLEvaluationSession, section: list) -> dict:
+    section_formulas = defaultdict(list)
+    section_formulas["global"] = []
+    for scope, formula in section:
+        try:
+            section_formulas[scope].append(parse_z3(session.z3_builder, formula, parse_cache=session.parse_cache))
+        except FOLParsingError:
+            continue
+        if scope != "global":
+            session.scopes[scope] = scope
+    return section_formulas
+
+def replay_narrative(narrative: dict, loops: int, **session_options) -> tuple[float, list, list]:
+    objects = [name + (f"_l{loop}" if loop > 0 else "") for loop in range(loops) for name in narrative["objects"]]
+    session = make_session(narrative["relations"], objects, **session_options)
+    section_results = []
+    solve_time = 0
+    for section in stretch_sections(narrative["sections"], loops):
+        section_formulas = parse_section(session, section)
+        start = time.perf_counter()
+        results, unsat_formulas, solver_log = session.check_section_formulas(section_formulas)
+        solve_time += time.perf_counter() - start
+        section_results.append(results)
+        session.logs.append(solver_log)
+    return solve_time, section_results, session
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Solving time of the FOL session on the sample logs.")
+    arg_parser.add_argument("--loops", type=int, default=1, help="Replay every narrative this many times with renamed constants to stretch it")
+    arg_parser.add_argument("--modes", nargs="+", default=["scratch", "incremental"])
+    arg_parser.add_argument("--encodings", nargs="+", default=["distinct"], help="How object constants are kept apart, see ObjectEncoding")
+    args = arg_parser.parse_args()
+    
+    narratives = load_sample_narratives()
+    baseline = {}
+    setups = [(mode, encoding) for mode in args.modes for encoding in args.encodings]
+    for mode, encoding in setups:
+        total_time = 0
+        mismatches = 0
+        pruned_count = 0
+        kept_count = 0
+        for narrative in narratives:
+            solve_time, section_results, session = replay_narrative(narrative, args.loops, solver_mode=mode, object_encoding=encoding)
+            total_time += solve_time
+            for solver_log in session.logs:
+                if "sliced_assertions" in solver_log:
+                    kept_count += solver_log["sliced_assertions"]["kept"]
+                    pruned_count += solver_log["sliced_assertions"]["pruned"]
+            if narrative["name"] in baseline:
+                mismatches += sum(1 for a, b in zip(section_results, baseline[narrative["name"]]) if a != b)
+            else:
+                baseline[narrative["name"]] = section_results
+        setup_name = f"{mode}/{encoding}"
+        print(f"{setup_name:22s} {total_time:8.3f}s solving, {mismatches} sections with results differing from {'/'.join(setups[0])}")
+        if kept_count + pruned_count:
+            print(f"{'':22s} {pruned_count} of {kept_count + pruned_count} assertions pruned by relevance slicing")
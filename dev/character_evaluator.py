@@ -3,6 +3,8 @@ import json
 
 from config import print_warning_message, print_dev_message, ModelInfo, _ERROR_RETRIES
 from utils.loaders import PromptLoader, SchemaLoader, InputTemplateLoader
+from utils.log_sink import JsonlLogSink
+from utils.steps import BotCall, run_steps, arun_steps
 
 class CharacterProcessingError(Exception):
     pass
@@ -46,6 +48,7 @@ class CharacterEvaluationSession:
         self.chatbot = self.model_info.chatbot()
         self.character_records = {}
         self.logs = []
+        self.log_sink = None
     
     def get_simple_strs(self, character_names) -> list[CharacterInfo]:
         out_str = ""
@@ -74,20 +77,26 @@ class CharacterEvaluationSession:
         return out_str
     
     def append_conversation(self, lastest_conversation: str) -> dict:
-        appeared_characters, actions = self.handle_character_extractor(lastest_conversation)
-        integrity_scores = self.handle_integrity_evaluator(actions)
-        self.handle_trait_extractor(lastest_conversation, appeared_characters)
+        return run_steps(self.append_conversation_steps(lastest_conversation))
+    
+    async def aappend_conversation(self, lastest_conversation: str) -> dict:
+        return await arun_steps(self.append_conversation_steps(lastest_conversation))
+    
+    def append_conversation_steps(self, lastest_conversation: str):
+        appeared_characters, actions = yield from self.character_extractor_steps(lastest_conversation)
+        integrity_scores = yield from self.integrity_evaluator_steps(actions)
+        yield from self.trait_extractor_steps(lastest_conversation, appeared_characters)
         
         new_log = {
             "conversation": lastest_conversation,
             "integrity_scores": integrity_scores,
             "characters": [char.to_dict() for char in self.character_records.values()]
         }
-        self.logs.append(new_log)
+        self.add_log(new_log)
         
         return integrity_scores
     
-    def handle_character_extractor(self, lastest_conversation: str) -> tuple[list[str], dict]:
+    def character_extractor_steps(self, lastest_conversation: str):
         processed_success = False
         tries_count = _ERROR_RETRIES
         
@@ -98,7 +107,7 @@ class CharacterEvaluationSession:
             bot = self.chatbot(self.model_info.model(), sys_prompt, self.schema_loader)
             while not processed_success:
                 try:
-                    text_response, json_response = bot.get_structured_response(message, schema_key="character_extractor", record=True, temperature=0.2)
+                    text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="character_extractor", record=True, temperature=0.2)
                     print_dev_message(f"Character extractor response:")
                     print_dev_message(text_response)
                     appeared_characters = []
@@ -120,7 +129,7 @@ class CharacterEvaluationSession:
     
         return appeared_characters, actions
     
-    def handle_integrity_evaluator(self, actions: dict) -> dict:
+    def integrity_evaluator_steps(self, actions: dict):
         tries_count = _ERROR_RETRIES
         
         integrity_scores = {}
@@ -138,7 +147,7 @@ class CharacterEvaluationSession:
                 processed_success = False
                 while not processed_success:
                     try:
-                        text_response, json_response = bot.get_structured_response(message, schema_key="character_integrity_self", record=True, temperature=0.2)
+                        text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="character_integrity_self", record=True, temperature=0.2)
                         print_dev_message(f"Integrity self evaluation: {text_response}")
                         integrity_scores[name]["self_integrity"] = json_response["integrity_score"]
                         processed_success = True
@@ -155,7 +164,7 @@ class CharacterEvaluationSession:
                 processed_success = False
                 while not processed_success:
                     try:
-                        text_response, json_response = bot.get_structured_response(message, schema_key="character_integrity_cross", record=True, temperature=0.2)
+                        text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="character_integrity_cross", record=True, temperature=0.2)
                         print_dev_message(f"Integrity cross evaluation: {text_response}")
                         integrity_scores[name]["action_integrity"] = json_response["action_score"]
                         processed_success = True
@@ -170,7 +179,7 @@ class CharacterEvaluationSession:
         
         return integrity_scores
     
-    def handle_trait_extractor(self, lastest_conversation:str, appeared_characters: list[str]) -> None:
+    def trait_extractor_steps(self, lastest_conversation:str, appeared_characters: list[str]):
         processed_success = False
         tries_count = _ERROR_RETRIES
         
@@ -181,7 +190,7 @@ class CharacterEvaluationSession:
             bot = self.chatbot(self.model_info.model(), sys_prompt, self.schema_loader)
             while not processed_success:
                 try:
-                    text_response, json_response = bot.get_structured_response(message, schema_key="character_trait_extractor", record=True, temperature=0.2)
+                    text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="character_trait_extractor", record=True, temperature=0.2)
                     print_dev_message(f"Trait extractor response:")
                     print_dev_message(text_response)
                     for character in json_response["characters"]:
@@ -200,7 +209,23 @@ class CharacterEvaluationSession:
                         raise e
         else:
             raise NotImplementedError("Only JSON output format is supported for trait extraction.")
-
+    
+    def add_log(self, new_log: dict) -> None:
+        self.logs.append(new_log)
+        if self.log_sink is not None:
+            self.log_sink.append_section(new_log)
+    
+    def stream_logs(self, file_path: str, fsync_policy: str = "close") -> None:
+        # Appends every section log to a JSONL file as it comes, logs from before the call are written first
+        self.log_sink = JsonlLogSink(file_path, fsync_policy)
+        for log in self.logs:
+            self.log_sink.append_section(log)
+    
+    def close_log_stream(self) -> None:
+        if self.log_sink is not None:
+            self.log_sink.close()
+            self.log_sink = None
+    
     def export_logs(self, file_path: str) -> None:
         with open(file_path, "w", encoding="utf-8") as f:
             json.dump(self.logs, f, ensure_ascii=False, indent=4)
@@ -223,6 +248,8 @@ if __name__ == "__main__":
 
     character_session = CharacterEvaluationSession(using_model_info, prompt_dir=prompt_dir, schema_dir=schema_dir, input_template_dir=input_template_dir)
     
+    character_session.stream_logs(os.path.join(cur_dir, "sample_character_log.jsonl"))
     for section in sample_narrative:
         character_session.append_conversation(section)
-        character_session.export_logs(os.path.join(cur_dir, "sample_character_log.json"))
\ No newline at end of file
+    character_session.close_log_stream()
+    character_session.export_logs(os.path.join(cur_dir, "sample_character_log.json"))
\ No newline at end of file
@@ -1,11 +1,40 @@
 from api_wrapper.chatbot import ChatBot, ChatBotDeepSeekSimple, ChatBotGeminiSimple, ChatBotGPTSimple, ChatBotClaudeSimple
+from api_wrapper.rate_limiter import configure_rate_limit
+from api_wrapper.response_cache import CachingChatBot, get_response_cache
+from api_wrapper.mock_chatbot import ChatBotMock
+from functools import partial
 
 _PRINT_WARNING = False
 _PRINT_DEV_MESSAGE = False
 _ERROR_RETRIES = 10
+_PARSE_CACHE_SIZE = 2048
+_SOLVER_WORKERS = 4
+_SOLVER_TIMEOUT_MS = 30000
+_SOLVER_RLIMIT = 0
+_SOLVER_CACHE_PATH = None
+# Total solving time allowed per FOL narrative in seconds, None leaves it to the per-check timeout alone
+_SOLVER_TIME_BUDGET = None
+# Threads shared by all FOL sessions for running the semantic analyser and formula maker side by side
+_STAGE_WORKERS = 16
+# How many sections the timeline maker may run ahead of the FOL session, 0 runs them in lockstep
+_TIMELINE_LOOKAHEAD = 2
+# LLM responses are recorded to this SQLite file when set, "replay" serves recorded responses only and fails on misses
+_RESPONSE_CACHE_PATH = None
+_RESPONSE_CACHE_MODE = "record"
+# Local sentence embeddings are kept in this directory when set, shared by reruns and by the processes of a batch run
+_EMBEDDING_CACHE_DIR = None
+# How local sentence similarity models run: "torch", "onnx" or "onnx-int8"
+_SIMILARITY_BACKEND = "torch"
 
 
 
+def set_response_cache(path: str, mode: str = "record") -> None:
+    global _RESPONSE_CACHE_PATH, _RESPONSE_CACHE_MODE
+    if mode not in ["record", "replay"]:
+        raise ValueError(f"Unknown response cache mode '{mode}', expected 'record' or 'replay'")
+    _RESPONSE_CACHE_PATH = path
+    _RESPONSE_CACHE_MODE = mode
+
 def print_warning_message(message):
     global _PRINT_WARNING
     if _PRINT_WARNING:
@@ -20,70 +49,100 @@ _model_info = {
     "deepseek-chat": {
         "model": "deepseek-chat",
         "chatbot": ChatBotDeepSeekSimple,
-        "output_format": "text"
+        "output_format": "text",
+        "rate_limit": {"max_in_flight": 32}
     },
     
     "deepseek-structured": {
         "model": "deepseek-chat",
         "chatbot": ChatBotDeepSeekSimple,
-        "output_format": "json"
+        "output_format": "json",
+        "rate_limit": {"max_in_flight": 32}
     },
     
     "gemini-chat": {
         "model": "gemini-2.0-flash",
         "chatbot": ChatBotGeminiSimple,
-        "output_format": "text"
+        "output_format": "text",
+        "rate_limit": {"requests_per_minute": 2000, "tokens_per_minute": 4000000, "max_in_flight": 32}
     },
     
     "gemini-lite": {
         "model": "gemini-2.0-flash-lite",
         "chatbot": ChatBotGeminiSimple,
-        "output_format": "text"
+        "output_format": "text",
+        "rate_limit": {"requests_per_minute": 4000, "tokens_per_minute": 4000000, "max_in_flight": 32}
     },
     
     "gemini-structured": {
         "model": "gemini-2.0-flash",
         "chatbot": ChatBotGeminiSimple,
-        "output_format": "json"
+        "output_format": "json",
+        "rate_limit": {"requests_per_minute": 2000, "tokens_per_minute": 4000000, "max_in_flight": 32}
     },
     
     "gemini-lite-structured": {
         "model": "gemini-2.0-flash-lite",
         "chatbot": ChatBotGeminiSimple,
-        "output_format": "json"
+        "output_format": "json",
+        "rate_limit": {"requests_per_minute": 4000, "tokens_per_minute": 4000000, "max_in_flight": 32}
     },
     
     "gemini-15-structured": {
         "model": "gemini-1.5-flash",
         "chatbot": ChatBotGeminiSimple,
-        "output_format": "json"
+        "output_format": "json",
+        "rate_limit": {"requests_per_minute": 2000, "tokens_per_minute": 4000000, "max_in_flight": 32}
     },
     
     "gpt-41-structured": {
         "model": "gpt-4.1",
         "chatbot": ChatBotGPTSimple,
-        "output_format": "json"
+        "output_format": "json",
+        "rate_limit": {"requests_per_minute": 500, "tokens_per_minute": 30000, "max_in_flight": 16}
     },
     
     "gpt-41-mini-structured": {
         "model": "gpt-4.1-mini",
         "chatbot": ChatBotGPTSimple,
-        "output_format": "json"
+        "output_format": "json",
+        "rate_limit": {"requests_per_minute": 500, "tokens_per_minute": 200000, "max_in_flight": 16}
     },
     
     "gpt-4o-mini-structured": {
         "model": "gpt-4o-mini",
         "chatbot": ChatBotGPTSimple,
-        "output_format": "json"
+        "output_format": "json",
+        "rate_limit": {"requests_per_minute": 500, "tokens_per_minute": 200000, "max_in_flight": 16}
     },
     
     "claude-sonnet-structured": {
         "model": "claude-sonnet-4-20250514",
         "chatbot": ChatBotClaudeSimple,
-        "output_format": "json"
+        "output_format": "json",
+        "rate_limit": {"requests_per_minute": 50, "tokens_per_minute": 30000, "max_in_flight": 8}
+    },
+    
+    # Offline providers for benchmarking the pipeline, see set_mock_latency for other latency profiles
+    "mock-structured": {
+        "model": "mock",
+        "chatbot": ChatBotMock,
+        "output_format": "json",
+        "rate_limit": {}
+    },
+    
+    "mock-realistic-structured": {
+        "model": "mock-realistic",
+        "chatbot": ChatBotMock,
+        "output_format": "json",
+        "rate_limit": {"max_in_flight": 32}
     },
 }
 
+# Rate limits follow the provider quotas of each model, adjust them to the account tier in use
+for model_info_entry in _model_info.values():
+    configure_rate_limit(model_info_entry["chatbot"].provider, model_info_entry["model"], **model_info_entry.get("rate_limit", {}))
+
 class ModelInfo:
     def __init__(self, model_name: str):
         self.info_name = model_name
@@ -99,10 +158,15 @@ class ModelInfo:
         return self.model_info["model"]
     
     def chatbot(self) -> ChatBot:
+        if _RESPONSE_CACHE_PATH:
+            return partial(CachingChatBot, self.model_info["chatbot"], cache=get_response_cache(_RESPONSE_CACHE_PATH), replay_only=_RESPONSE_CACHE_MODE == "replay")
         return self.model_info["chatbot"]
     
     def output_format(self) -> str:
         return self.model_info["output_format"]
     
+    def rate_limit(self) -> dict:
+        return self.model_info.get("rate_limit", {})
+    
     def is_valid(self) -> bool:
         return self._valid
\ No newline at end of file
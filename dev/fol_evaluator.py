@@ -1,14 +1,20 @@
 import os
 import json
 import re
+import time
+import threading
 from z3 import *
-from collections import defaultdict
+from collections import defaultdict, Counter
+from concurrent.futures import ThreadPoolExecutor
 
-from parser.str_to_z3_parser import Z3Builder, parse_z3, FOLParsingError
+from parser.str_to_z3_parser import Z3Builder, FOLParseCache, parse_z3, FOLParsingError
+from solver.fol_solver import FormulaStore, IncrementalFOLSolver, ObjectEncoding, SymbolIndex, SolverLimits, SolverResultCache, get_solver_pool, get_solver_result_cache, solve_scopes_in_pool
 from utils.loaders import PromptLoader, SchemaLoader, InputTemplateLoader
+from utils.log_sink import JsonlLogSink
 from utils.regex import divide_response_parts, get_relation_params
+from utils.steps import BotCall, BlockingCall, ConcurrentSteps, run_steps, arun_steps
 from utils.utils import *
-from config import print_warning_message, print_dev_message, ModelInfo, _ERROR_RETRIES
+from config import print_warning_message, print_dev_message, ModelInfo, _ERROR_RETRIES, _PARSE_CACHE_SIZE, _SOLVER_WORKERS, _SOLVER_TIMEOUT_MS, _SOLVER_RLIMIT, _SOLVER_TIME_BUDGET, _SOLVER_CACHE_PATH, _STAGE_WORKERS
 
 class Relation:
     def __init__(self, name: str, params: list, meaning: str, function: Function) -> None:
@@ -21,24 +27,64 @@ class Relation:
         params_str = ", ".join(self.params)
         return f"{self.name}({params_str}): {self.meaning}"
 
+_SOLVER_MODES = ["incremental", "scratch", "sliced", "parallel"]
+_OBJECT_ENCODINGS = ["distinct", "pinned"]
+
+_stage_pool = None
+_stage_pool_lock = threading.Lock()
+
+def get_stage_pool() -> ThreadPoolExecutor:
+    # LLM stages spend their time waiting on the provider, so one thread pool serves the stages of every session
+    global _stage_pool
+    with _stage_pool_lock:
+        if _stage_pool is None:
+            _stage_pool = ThreadPoolExecutor(max_workers=_STAGE_WORKERS, thread_name_prefix="fol_stage")
+    return _stage_pool
+
 class FOLEvaluationSession():
-    def __init__(self, model_info: ModelInfo, history: list = None, prompt_dir: str = "../prompts/", schema_dir: str = "../schemas/", input_template_dir: str = "../input_templates/"):
+    def __init__(self, model_info: ModelInfo, history: list = None, prompt_dir: str = "../prompts/", schema_dir: str = "../schemas/", input_template_dir: str = "../input_templates/", solver_mode: str = "incremental", verify_solver: bool = False, solver_workers: int = _SOLVER_WORKERS, solver_timeout_ms: int = _SOLVER_TIMEOUT_MS, solver_rlimit: int = _SOLVER_RLIMIT, solver_time_budget: float = _SOLVER_TIME_BUDGET, solver_cache_path: str = _SOLVER_CACHE_PATH, object_encoding: str = "distinct", concurrent_stages: bool = True):
+        if solver_mode not in _SOLVER_MODES:
+            raise ValueError(f"Unknown solver mode '{solver_mode}', expected one of {_SOLVER_MODES}")
+        if object_encoding not in _OBJECT_ENCODINGS:
+            raise ValueError(f"Unknown object encoding '{object_encoding}', expected one of {_OBJECT_ENCODINGS}")
         self.rp_history = history if history is not None else []
         self.model_info = model_info
         self.chatbot = self.model_info.chatbot()
-        self.formulas = []
+        self.formula_store = FormulaStore()
         self.objects = {}
         self.relations = {}
         self.timeline = {}
         self.scopes = {}
         self.logs = []
+        self.log_sink = None
+        self.parse_paths = []
         self.z3_context = Context()
         self.z3_builder = Z3Builder(self.get_z3_function, self.z3_context)
+        self.parse_cache = FOLParseCache(_PARSE_CACHE_SIZE)
+        self.solver_mode = solver_mode
+        self.verify_solver = verify_solver
+        self.solver_workers = solver_workers
+        self.solver_limits = SolverLimits(solver_timeout_ms, solver_rlimit, solver_time_budget)
+        self.object_encoding = ObjectEncoding(self.z3_context, object_encoding, self.is_declared_object)
+        # Checks of every solver mode but parallel go through the result cache, so reruns and resumed narratives skip solved sets
+        self.solver_cache = get_solver_result_cache(solver_cache_path) if solver_cache_path else None
+        self.incremental_solver = IncrementalFOLSolver(self.z3_context, self.solver_limits, self.object_encoding, self.solver_cache)
+        self.symbol_index = SymbolIndex()
+        # The semantic analyser and formula maker only need the declaration builder's output, so they can run side by side.
+        # Z3 contexts are not thread safe, down to reference counting, so the formula maker builds its formulas in a context of its
+        # own that nothing else touches while it runs. The calling thread translates them into the session's context afterwards
+        self.concurrent_stages = concurrent_stages
+        self.formula_maker_context = Context()
+        self.formula_maker_builder = Z3Builder(self.get_formula_maker_function, self.formula_maker_context)
+        self.formula_maker_parse_cache = FOLParseCache(_PARSE_CACHE_SIZE)
         
         self.prompt_loader = PromptLoader(prompt_dir)
         self.schema_loader = SchemaLoader(schema_dir)
         self.input_template_loader = InputTemplateLoader(input_template_dir)
         
+    def is_declared_object(self, name: str) -> bool:
+        return name in self.objects
+    
     def get_timeline_str(self) -> str:
         return dict_pretty_str(self.timeline)
     
@@ -84,7 +130,21 @@ class FOLEvaluationSession():
         else:
             return None
     
-    def handle_declaration_builder(self, lastest_conversation: str) -> tuple[list, list]:
+    def get_formula_maker_function(self, name: str) -> Function:
+        # The same declaration as the relation's function, made in the formula maker's context
+        if name in self.relations:
+            local_IntSort = IntSort(self.formula_maker_context)
+            return Function(name, *[local_IntSort for param in self.relations[name].params], BoolSort(self.formula_maker_context))
+        else:
+            return None
+    
+    def translate_scoped_formulas(self, scoped_formulas: dict) -> dict:
+        translated_formulas = defaultdict(list)
+        for scope, formulas in scoped_formulas.items():
+            translated_formulas[scope] = [formula.translate(self.z3_context) for formula in formulas]
+        return translated_formulas
+    
+    def declaration_builder_steps(self, lastest_conversation: str):
         
         
         declarations_str = self.get_all_declarations_str()
@@ -99,7 +159,7 @@ class FOLEvaluationSession():
             bot = self.chatbot(self.model_info.model(), sys_prompt, self.schema_loader)
             while not processed_success:
                 try:
-                    text_response, json_response = bot.get_structured_response(message, schema_key="declaration_builder", record=True, temperature=0.2)
+                    text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="declaration_builder", record=True, temperature=0.2)
                     print_dev_message("Declaration Maker Response:")
                     print_dev_message(text_response)
                     new_objects, new_relations = self.parse_obj_rel_declarations_json(json_response)
@@ -119,7 +179,7 @@ class FOLEvaluationSession():
         else:
             sys_prompt = self.prompt_loader.load_sys_prompts("declaration_builder", subtype="text")
             bot = self.chatbot(self.model_info.model(), sys_prompt)
-            complete_response = bot.send_message(message, record=True, temperature=0.2)
+            complete_response = yield BotCall(bot, "send_message", message, record=True, temperature=0.2)
             print_dev_message("Declaration Maker Response:")
             print_dev_message(complete_response)
             while not processed_success:
@@ -149,14 +209,14 @@ class FOLEvaluationSession():
                         print_dev_message("Error: Too many failing responses.")
                         raise e
                         
-                    complete_response = bot.send_message(error_message, record=True, temperature=0.2)
+                    complete_response = yield BotCall(bot, "send_message", error_message, record=True, temperature=0.2)
                     print_dev_message("Retry with:\n")
                     print_dev_message(complete_response)
         
         
         return obj_keys, rel_keys
-
-    def handle_semantic_analyser(self, lastest_conversation: str, obj_keys: list, rel_keys: list) -> tuple[list, list, list, str]:
+    
+    def semantic_analyser_steps(self, lastest_conversation: str, obj_keys: list, rel_keys: list):
         
         
         obj_str, rel_str = self.get_keyed_declarations_str(obj_keys, rel_keys)
@@ -181,7 +241,7 @@ class FOLEvaluationSession():
             
             while not processed_success:
                 try:
-                    text_response, json_response = bot.get_structured_response(message, schema_key="semantic_analyser", record=True, temperature=0.2)
+                    text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="semantic_analyser", record=True, temperature=0.2)
                     print_dev_message("Semantic Analyser Response:")
                     print_dev_message(text_response)
                     returning_formulas = self.parse_semantic_analyser_json(json_response)
@@ -199,7 +259,7 @@ class FOLEvaluationSession():
         else:
             sys_prompt = self.prompt_loader.load_sys_prompts("semantic_analyser", subtype="text")
             bot = self.chatbot(self.model_info.model(), sys_prompt)
-            complete_response = bot.send_message(message, record=True, temperature=0)
+            complete_response = yield BotCall(bot, "send_message", message, record=True, temperature=0)
             print_dev_message("Semantic Definer Response:")
             print_dev_message(complete_response)
             
@@ -215,7 +275,7 @@ class FOLEvaluationSession():
                         print_dev_message("Error: Too many failing responses.")
                         raise e
                         
-                    complete_response = bot.send_message(error_message, record=True, temperature=0.2)
+                    complete_response = yield BotCall(bot, "send_message", error_message, record=True, temperature=0.2)
                     print_dev_message("Retry with:\n")
                     print_dev_message(complete_response)
             
@@ -235,7 +295,7 @@ class FOLEvaluationSession():
                             print_dev_message("Error: Too many failing responses.")
                             raise e
                             
-                        exclusive_definitions_text = bot.send_message(error_message, record=True, temperature=0.1)
+                        exclusive_definitions_text = yield BotCall(bot, "send_message", error_message, record=True, temperature=0.1)
                         print_dev_message("Retry with:\n")
                         print_dev_message(exclusive_definitions_text)
             
@@ -255,7 +315,7 @@ class FOLEvaluationSession():
                             print_dev_message("Error: Too many failing responses.")
                             raise e
                             
-                        formula_definitions_text = bot.send_message(error_message, record=True, temperature=0.1)
+                        formula_definitions_text = yield BotCall(bot, "send_message", error_message, record=True, temperature=0.1)
                         print_dev_message("Retry with:\n")
                         print_dev_message(formula_definitions_text)
             
@@ -264,7 +324,7 @@ class FOLEvaluationSession():
         
         return returning_formulas, pseudo_definitions
     
-    def handle_formula_maker(self, lastest_conversation: str, obj_keys: list, rel_keys: list) -> dict:
+    def formula_maker_steps(self, lastest_conversation: str, obj_keys: list, rel_keys: list):
         
         
         # Make up the prompt from data
@@ -285,7 +345,7 @@ class FOLEvaluationSession():
             
             while not processed_success:
                 try:
-                    text_response, json_response = bot.get_structured_response(message, schema_key="formula_maker", record=True, temperature=0)
+                    text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="formula_maker", record=True, temperature=0)
                     print_dev_message("Formula Maker Response:")
                     print_dev_message(text_response)
                     current_formula = self.parse_formula_maker_json(json_response)
@@ -301,7 +361,7 @@ class FOLEvaluationSession():
         else:
             sys_prompt = self.prompt_loader.load_sys_prompts("formula_maker", subtype="text")
             bot = self.chatbot(self.model_info.model(), sys_prompt)
-            complete_response = bot.send_message(message, record=True, temperature=0)
+            complete_response = yield BotCall(bot, "send_message", message, record=True, temperature=0)
             print_dev_message("Formula Maker Response:")
             print_dev_message(complete_response)
             
@@ -326,7 +386,7 @@ class FOLEvaluationSession():
                         print_dev_message("Error: Too many failing responses.")
                         raise e
                         
-                    complete_response = bot.send_message(error_message, record=True, temperature=0.2)
+                    complete_response = yield BotCall(bot, "send_message", error_message, record=True, temperature=0.2)
                     print_dev_message("Retry with:\n")
                     print_dev_message(complete_response)
             
@@ -347,36 +407,52 @@ class FOLEvaluationSession():
                             print_dev_message("Error: Too many failing responses.")
                             raise e
                             
-                        formula_text = bot.send_message(error_message, record=True, temperature=0.1)
+                        formula_text = yield BotCall(bot, "send_message", error_message, record=True, temperature=0.1)
                         print_dev_message("Retry with:\n")
                         print_dev_message(formula_text)
         
         return current_formula
-        
+    
+    def timed_stage_steps(self, stage_latency: dict, stage_name: str, stage_steps):
+        stage_start = time.perf_counter()
+        stage_output = yield from stage_steps
+        stage_latency[stage_name] = time.perf_counter() - stage_start
+        return stage_output
 
     def append_conversation(self, lastest_conversation: str, new_timeline: dict) -> list:
+        return run_steps(self.append_conversation_steps(lastest_conversation, new_timeline))
+    
+    async def aappend_conversation(self, lastest_conversation: str, new_timeline: dict) -> list:
+        return await arun_steps(self.append_conversation_steps(lastest_conversation, new_timeline))
+    
+    def append_conversation_steps(self, lastest_conversation: str, new_timeline: dict):
         
         self.timeline = new_timeline.copy()
+        self.parse_paths = []
         timeline_definitions = dict_pretty_str(self.timeline) # Get timeline from foreign agent
-        obj_keys, rel_keys = self.handle_declaration_builder(lastest_conversation)  # Extracting elements
-        semantic_defined_formulas, definitions_text = self.handle_semantic_analyser(lastest_conversation, obj_keys, rel_keys) # Analyse inherent logical properties
-        current_formula = self.handle_formula_maker(lastest_conversation, obj_keys, rel_keys) # Extract explicit propositios into scoped formulas
+        section_start = time.perf_counter()
+        stage_latency = {}
+        obj_keys, rel_keys = yield from self.timed_stage_steps(stage_latency, "declaration_builder", self.declaration_builder_steps(lastest_conversation))  # Extracting elements
+        concurrent_start = time.perf_counter()
+        semantic_analyser_steps = self.timed_stage_steps(stage_latency, "semantic_analyser", self.semantic_analyser_steps(lastest_conversation, obj_keys, rel_keys)) # Analyse inherent logical properties
+        formula_maker_steps = self.timed_stage_steps(stage_latency, "formula_maker", self.formula_maker_steps(lastest_conversation, obj_keys, rel_keys)) # Extract explicit propositios into scoped formulas
+        if self.concurrent_stages:
+            (semantic_defined_formulas, definitions_text), current_formula = yield ConcurrentSteps(get_stage_pool(), semantic_analyser_steps, formula_maker_steps)
+        else:
+            semantic_defined_formulas, definitions_text = yield from semantic_analyser_steps
+            current_formula = yield from formula_maker_steps
+        stage_latency["analysis_stages"] = time.perf_counter() - concurrent_start
+        current_formula = self.translate_scoped_formulas(current_formula)
         self.rp_history.append(lastest_conversation)
         
         complete_current_formula = current_formula.copy()
         complete_current_formula["global"] = semantic_defined_formulas + complete_current_formula["global"]
         
-        combined_past_formula = defaultdict(list)
-        combined_past_formula["global"] = []
-        for scope, formulas in complete_current_formula.items():
-            for history_formula in self.formulas:
-                if scope in history_formula:
-                    combined_past_formula[scope] += history_formula[scope]
-            combined_past_formula[scope] += formulas
-        
-        results, unsat_formulas = self.solve_combined_formulas(combined_past_formula)
-            
-        self.formulas.append(complete_current_formula)
+        # Solving is CPU bound, z3 releases the GIL while it runs so other sessions on the event loop keep going
+        solver_start = time.perf_counter()
+        results, unsat_formulas, solver_log = yield BlockingCall(self.check_section_formulas, complete_current_formula)
+        stage_latency["solver"] = time.perf_counter() - solver_start
+        stage_latency["end_to_end"] = time.perf_counter() - section_start
         
         pretty_formula = self.scoped_formula_to_str(complete_current_formula)
         
@@ -390,8 +466,11 @@ class FOLEvaluationSession():
             "pseudo_predefinitions": definitions_text,
             "formula": pretty_formula,
             "unsat_formulas": unsat_formulas,
+            "parse_paths": dict(Counter(self.parse_paths)),
+            "stage_latency": {stage: round(latency, 4) for stage, latency in stage_latency.items()},
         }
-        self.logs.append(new_log)
+        new_log.update(solver_log)
+        self.add_log(new_log)
         return unsat_formulas
     
     def parse_object_declarations(self, objects_text: str) -> dict:
@@ -440,7 +519,7 @@ class FOLEvaluationSession():
             if  "```" in parsing_formula:
                 continue
             if parsing_formula:
-                parsed_formula = parse_z3(self.z3_builder, parsing_formula)
+                parsed_formula = parse_z3(self.z3_builder, parsing_formula, self.parse_paths, self.parse_cache)
                 formulas.append(parsed_formula)
         return formulas
     
@@ -465,7 +544,7 @@ class FOLEvaluationSession():
                             self.scopes[scope] = self.objects[scope]
                         else:
                             raise FOLParsingError(f"Scope {scope} not found in scope table. Please remove any related usage of this scope for now.")
-                parsed_formula = parse_z3(self.z3_builder, parsing_formula)
+                parsed_formula = parse_z3(self.formula_maker_builder, parsing_formula, self.parse_paths, self.formula_maker_parse_cache)
                 formulas[scope].append(parsed_formula)
         return formulas
     
@@ -580,7 +659,7 @@ class FOLEvaluationSession():
         for formula_line in definitions_json["formulas"]:
             parsing_formula = formula_line.strip()
             if parsing_formula:
-                parsed_formula = parse_z3(self.z3_builder, parsing_formula)
+                parsed_formula = parse_z3(self.z3_builder, parsing_formula, self.parse_paths, self.parse_cache)
                 formulas.append(parsed_formula)
         
         return formulas
@@ -608,20 +687,51 @@ class FOLEvaluationSession():
                 scope = "global"
                 
             parsing_formula = formula_line["formula"]
-            parsed_formula = parse_z3(self.z3_builder, parsing_formula)
+            parsed_formula = parse_z3(self.formula_maker_builder, parsing_formula, self.parse_paths, self.formula_maker_parse_cache)
             formulas[scope].append(parsed_formula)
         return formulas
         
     
-    def solve_combined_formulas(self, combined_formulas: dict) -> tuple[list, int]:
+    def check_section_formulas(self, complete_current_formula: dict) -> tuple[list, list, dict]:
+        solver_log = {}
+        # Only formulas not already asserted in their scope reach the solvers
+        new_formulas = self.formula_store.add_section(complete_current_formula)
+        if self.solver_mode == "incremental":
+            results, unsat_formulas = self.incremental_solver.check_section(new_formulas)
+            if self.verify_solver:
+                verification_limits = SolverLimits(self.solver_limits.timeout_ms, self.solver_limits.rlimit)
+                scratch_results, scratch_unsat_formulas = self.solve_combined_formulas(self.formula_store.combine_scopes(new_formulas.keys()), verification_limits)
+                solver_log["solver_verification"] = {"incremental": results, "scratch": scratch_results, "match": results == scratch_results}
+                if results != scratch_results:
+                    print_warning_message(f"Warning: incremental solver results {results} differ from the from-scratch results {scratch_results}.")
+        elif self.solver_mode == "sliced":
+            sliced_formulas, kept_count, pruned_count = self.symbol_index.slice_section(new_formulas)
+            results, unsat_formulas = self.solve_combined_formulas(sliced_formulas)
+            solver_log["sliced_assertions"] = {"kept": kept_count, "pruned": pruned_count}
+            print_dev_message(f"Relevance slicing kept {kept_count} assertions and pruned {pruned_count}.")
+        elif self.solver_mode == "parallel":
+            results, unsat_formulas = solve_scopes_in_pool(get_solver_pool(self.solver_workers), self.z3_context, self.formula_store.combine_scopes(new_formulas.keys()), self.solver_limits, self.object_encoding)
+        else:
+            results, unsat_formulas = self.solve_combined_formulas(self.formula_store.combine_scopes(new_formulas.keys()))
+        
+        solver_checks = self.solver_limits.pop_section_checks()
+        solver_log["solver_checks"] = solver_checks
+        solver_log["unknown_checks"] = sum(1 for check in solver_checks if check["result"] == "unknown")
+        solver_log["cached_checks"] = sum(1 for check in solver_checks if check["cached"])
+        solver_log["solver_time_spent"] = round(self.solver_limits.time_spent, 4)
+        solver_log["formula_store"] = self.formula_store.stats()
+        return results, unsat_formulas, solver_log
+    
+    def solve_combined_formulas(self, combined_formulas: dict, solver_limits: SolverLimits = None) -> tuple[list, int]:
+        solver_limits = self.solver_limits if solver_limits is None else solver_limits
         solver = Solver(ctx=self.z3_context)
         # Get a list of all variables in the formulas
         var_list = set()
         for formulas in combined_formulas.values():
             for formula in formulas:
                 var_list.update(z3util.get_vars(formula))
-        if var_list:
-            solver.add(Distinct(*var_list))
+        var_constraints = self.object_encoding.constraints(var_list)
+        solver.add(*var_constraints)
             
         # First, add the global formulas
         track_table = {}
@@ -633,18 +743,9 @@ class FOLEvaluationSession():
             track_table[assert_key] = formula.sexpr()
             
         # Check the satisfiability of global formulas
-        results = [str(solver.check())]
-        if solver.unsat_core():
-            print_dev_message(track_table)
-            for assertion in solver.unsat_core():
-                assertion_str = str(assertion)
-                print_dev_message(track_table[assertion_str])
-        for assertion in solver.unsat_core():
-            assertion_str = str(assertion)
-            if assertion_str in track_table:
-                conflicting_assertions.add(track_table[assertion_str])
-            else:
-                raise FOLParsingError(f"Assertion {assertion_str} not found in track table. Please check the solver assertions.")
+        global_result, global_core = self.check_with_result_cache(solver, solver_limits, "global", var_constraints, global_formulas, track_table)
+        results = [global_result]
+        conflicting_assertions.update(global_core)
         print_dev_message(conflicting_assertions)
         
         # Check formulas by scope
@@ -655,14 +756,9 @@ class FOLEvaluationSession():
                     assert_key = f"{scope}_assertion_{i}"
                     solver.assert_and_track(formula, assert_key)
                     track_table[assert_key] = formula.sexpr()
-                scope_result = solver.check()
-                results.append(str(scope_result))
-                for assertion in solver.unsat_core():
-                    assertion_str = str(assertion)
-                    if assertion_str in track_table:
-                        conflicting_assertions.add(track_table[assertion_str])
-                    else:
-                        raise FOLParsingError(f"Assertion {assertion_str} not found in track table. Please check the solver assertions.")
+                scope_result, scope_core = self.check_with_result_cache(solver, solver_limits, scope, var_constraints, global_formulas + formulas, track_table)
+                results.append(scope_result)
+                conflicting_assertions.update(scope_core)
                 solver.pop()
         
         print_dev_message(solver.assertions())
@@ -670,17 +766,130 @@ class FOLEvaluationSession():
         
         return results, list(conflicting_assertions)
     
-    def export_logs(self, file_path: str) -> None:
+    def check_with_result_cache(self, solver: Solver, solver_limits: SolverLimits, scope: str, var_constraints: list, formulas: list, track_table: dict) -> tuple[str, list]:
+        # Returns the result and the unsat core as formula sexprs, looking the assertion set up in the result cache first
+        cache_key = None
+        if self.solver_cache is not None:
+            cache_key = SolverResultCache.make_key(var_constraints, formulas)
+            cached_result = self.solver_cache.get(cache_key, solver_limits.timeout_ms, solver_limits.rlimit)
+            if cached_result is not None:
+                result, core = cached_result
+                solver_limits.record(scope, result, 0.0, 0, cached=True)
+                return result, core
+        
+        result = solver_limits.check(solver, scope)
+        unsat_core = solver.unsat_core() if result == unsat else []
+        if unsat_core:
+            print_dev_message(track_table)
+        core = []
+        for assertion in unsat_core:
+            assertion_str = str(assertion)
+            if assertion_str in track_table:
+                print_dev_message(track_table[assertion_str])
+                core.append(track_table[assertion_str])
+            else:
+                raise FOLParsingError(f"Assertion {assertion_str} not found in track table. Please check the solver assertions.")
+        if cache_key is not None and solver_limits.last_limits is not None:
+            self.solver_cache.put(cache_key, str(result), core, *solver_limits.last_limits)
+        return str(result), core
+    
+    def add_log(self, new_log: dict) -> None:
+        self.logs.append(new_log)
+        if self.log_sink is not None:
+            self.log_sink.append_section(new_log)
+    
+    def stream_logs(self, file_path: str, fsync_policy: str = "close") -> None:
+        # Appends every section log to a JSONL file as it comes, logs from before the call are written first
+        self.log_sink = JsonlLogSink(file_path, fsync_policy)
+        for log in self.logs:
+            self.log_sink.append_section(log)
+    
+    def close_log_stream(self) -> None:
+        # The global data is only written once, when the stream is closed
+        if self.log_sink is not None:
+            self.log_sink.write_summary(self.get_summary_log())
+            self.log_sink.close()
+            self.log_sink = None
+    
+    def get_summary_log(self) -> dict:
         # Add the global data to the log
         new_log = {
             "full_conversation": "\n".join(self.rp_history),
-            "full_formulas": "\n".join([str(formula) for formula in self.formulas]),
+            "full_formulas": "\n".join([str(self.formula_store.section_formulas(i)) for i in range(len(self.formula_store.sections))]),
             "full_declarations": self.get_all_declarations_str(),
             "full_timeline": self.get_timeline_str(),
             "full_scopes": self.get_scopes_str(),
+            "parse_cache": self.parse_cache.stats(),
+            "formula_maker_parse_cache": self.formula_maker_parse_cache.stats(),
         }
+        if self.solver_cache is not None:
+            new_log["solver_cache"] = self.solver_cache.stats()
+        return new_log
+    
+    def export_logs(self, file_path: str) -> None:
         with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(self.logs + [new_log], f, indent=2)
+            json.dump(self.logs + [self.get_summary_log()], f, indent=2)
+    
+    def save_checkpoint(self, file_path: str) -> None:
+        # Every unique formula goes into one SMT-LIB script with its declarations, sections refer to formulas by their position in it
+        serializer = Solver(ctx=self.z3_context)
+        serializer.add(*self.formula_store.formulas)
+        checkpoint = {
+            "rp_history": self.rp_history,
+            "objects": self.objects,
+            "relations": [{"name": relation.name, "params": relation.params, "arity": len(relation.params), "meaning": relation.meaning} for relation in self.relations.values()],
+            "scopes": self.scopes,
+            "timeline": self.timeline,
+            "formulas_smt2": serializer.sexpr(),
+            "formula_count": len(self.formula_store.formulas),
+            "sections": self.formula_store.sections,
+            "object_pins": self.object_encoding.pins,
+            "unpinned_constants": sorted(self.object_encoding.unpinned),
+            # A resumed narrative carries on with what is left of its solver budget, rather than starting it again
+            "solver_time_spent": self.solver_limits.time_spent,
+            "logs": self.logs,
+        }
+        # Written aside and moved over, so a crash while saving leaves the previous checkpoint intact
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f)
+        os.replace(temp_path, file_path)
+    
+    def load_checkpoint(self, file_path: str) -> None:
+        if self.rp_history or self.formula_store.sections:
+            raise ValueError("Checkpoints can only be loaded into a session that has not processed any section.")
+        with open(file_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        
+        self.rp_history = checkpoint["rp_history"]
+        self.objects = checkpoint["objects"]
+        self.scopes = checkpoint["scopes"]
+        self.timeline = checkpoint["timeline"]
+        self.logs = checkpoint["logs"]
+        self.object_encoding.pins = checkpoint["object_pins"]
+        self.object_encoding.unpinned = set(checkpoint["unpinned_constants"])
+        self.solver_limits.time_spent = checkpoint["solver_time_spent"]
+        local_IntSort = IntSort(self.z3_context)
+        local_BoolSort = BoolSort(self.z3_context)
+        for relation in checkpoint["relations"]:
+            rel_z3_func = Function(relation["name"], *[local_IntSort for i in range(relation["arity"])], local_BoolSort)
+            self.relations[relation["name"]] = Relation(relation["name"], relation["params"], relation["meaning"], rel_z3_func)
+        
+        # Declarations parsed from the script are the same z3 objects as the relation functions, as z3 hash-conses them by signature
+        formulas = list(parse_smt2_string(checkpoint["formulas_smt2"], ctx=self.z3_context)) if checkpoint["formula_count"] else []
+        if len(formulas) != checkpoint["formula_count"]:
+            raise ValueError(f"Checkpoint {file_path} holds {len(formulas)} formulas, expected {checkpoint['formula_count']}.")
+        for section_ids in checkpoint["sections"]:
+            self.restore_section_formulas({scope: [formulas[formula_id] for formula_id in formula_ids] for scope, formula_ids in section_ids.items()})
+    
+    def restore_section_formulas(self, section_formulas: dict) -> None:
+        # Rebuilds what check_section_formulas keeps between sections, without solving again
+        new_formulas = self.formula_store.add_section(section_formulas)
+        if self.solver_mode == "incremental":
+            self.incremental_solver.add_formulas(new_formulas)
+        elif self.solver_mode == "sliced":
+            for scope, formulas in new_formulas.items():
+                self.symbol_index.add_formulas(scope, formulas)
 
 # No longer usable independently
 # if __name__ == "__main__":
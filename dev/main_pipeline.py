@@ -1,12 +1,70 @@
 import os
 import json
+import queue
+import threading
 
-from config import ModelInfo
+from config import ModelInfo, _TIMELINE_LOOKAHEAD
 from fol_evaluator import FOLEvaluationSession
 from timeline_maker import TimelineMakerSession
+from utils.log_sink import convert_jsonl_logs
+from utils.steps import run_steps, StepsStopped
 
 cur_dir = os.path.dirname(os.path.abspath(__file__))
-def do_one_run_fol(target_narrative: list[str], model: str) -> None:
+
+_STREAM_END = object()
+_STREAM_POLL = 0.1
+
+def stream_timeline_snapshots(timeline_session: TimelineMakerSession, target_narrative: list[str], lookahead: int = _TIMELINE_LOOKAHEAD):
+    # Yields (section, timeline) pairs while the timeline maker keeps working up to lookahead sections ahead in its own thread.
+    # Every pair carries a copy of the timeline as it was right after its section, so consumers see the same timeline as in lockstep
+    snapshots = queue.Queue()
+    # One permit per section the timeline maker may be ahead by, counting the one it is working on
+    sections_ahead = threading.Semaphore(max(lookahead, 1))
+    stop = threading.Event()
+
+    def wait_for_turn() -> bool:
+        while not stop.is_set():
+            if sections_ahead.acquire(timeout=_STREAM_POLL):
+                return True
+        return False
+
+    def make_timeline() -> None:
+        try:
+            for section in target_narrative:
+                if not wait_for_turn():
+                    return
+                # Run step by step, so a stop also ends a section that is still retrying its responses
+                run_steps(timeline_session.append_conversation_steps(section), stop)
+                snapshots.put((section, timeline_session.get_timeline()))
+        except StepsStopped:
+            return
+        except Exception as e:
+            snapshots.put(e)
+            return
+        snapshots.put(_STREAM_END)
+
+    timeline_thread = threading.Thread(target=make_timeline, name="timeline_maker", daemon=True)
+    timeline_thread.start()
+    try:
+        while True:
+            snapshot = snapshots.get()
+            if snapshot is _STREAM_END:
+                return
+            if isinstance(snapshot, Exception):
+                raise snapshot
+            sections_ahead.release()
+            yield snapshot
+    finally:
+        # Also reached when the consumer fails or stops early, the timeline thread then stops before its next response
+        stop.set()
+        timeline_thread.join()
+
+def lockstep_timeline_snapshots(timeline_session: TimelineMakerSession, target_narrative: list[str]):
+    for section in target_narrative:
+        timeline_session.append_conversation(section)
+        yield section, timeline_session.get_timeline()
+
+def do_one_run_fol(target_narrative: list[str], model: str, lookahead: int = _TIMELINE_LOOKAHEAD) -> None:
     prompt_dir = os.path.join(cur_dir, "prompts")
     schema_dir = os.path.join(cur_dir, "schemas")
     input_template_dir = os.path.join(cur_dir, "input_templates")
@@ -16,11 +74,17 @@ def do_one_run_fol(target_narrative: list[str], model: str) -> None:
     timeline_session = TimelineMakerSession(using_model_info, prompt_dir=prompt_dir, schema_dir=schema_dir, input_template_dir=input_template_dir)
     fol_session = FOLEvaluationSession(using_model_info, prompt_dir=prompt_dir, schema_dir=schema_dir, input_template_dir=input_template_dir)
     
-    for section in target_narrative:
-        timeline_session.append_conversation(section)
-        new_timeline = timeline_session.get_timeline()
-        fol_session.append_conversation(section, new_timeline=new_timeline)
-        fol_session.export_logs(os.path.join(cur_dir, "sample_fol_log3.json"))
+    if lookahead > 0:
+        timeline_snapshots = stream_timeline_snapshots(timeline_session, target_narrative, lookahead)
+    else:
+        timeline_snapshots = lockstep_timeline_snapshots(timeline_session, target_narrative)
+    fol_session.stream_logs(os.path.join(cur_dir, "sample_fol_log3.jsonl"))
+    try:
+        for section, new_timeline in timeline_snapshots:
+            fol_session.append_conversation(section, new_timeline=new_timeline)
+    finally:
+        fol_session.close_log_stream()
+    convert_jsonl_logs(os.path.join(cur_dir, "sample_fol_log3.jsonl"), os.path.join(cur_dir, "sample_fol_log3.json"), indent=2)
 
 # def do_one_run_outline(target_narrative: list[str], model: str, similarity_model: str) -> None:
 #     prompt_dir = os.path.join(cur_dir, "prompts")
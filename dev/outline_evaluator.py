@@ -2,9 +2,11 @@ import os
 import json
 import math
 
-from config import print_warning_message, print_dev_message, ModelInfo, _ERROR_RETRIES
+from config import print_warning_message, print_dev_message, ModelInfo, _ERROR_RETRIES, _EMBEDDING_CACHE_DIR, _SIMILARITY_BACKEND
 from utils.loaders import PromptLoader, SchemaLoader, InputTemplateLoader
-from api_wrapper.sentence_similarity_lm import SentenceSimilarityWorker
+from utils.log_sink import JsonlLogSink
+from utils.steps import BotCall, BlockingCall, run_steps, arun_steps
+from api_wrapper.sentence_similarity_lm import get_similarity_worker, _SIMILARITY_BACKENDS
 
 SIMILARITY_BASE_VALUE = 0.7
 
@@ -63,19 +65,24 @@ class Outline:
         return result
     
 class OutlineEvaluationSession:
-    def __init__(self, model_info: ModelInfo, similarity_model: str, prompt_dir: str, schema_dir: str, input_template_dir: str):
+    def __init__(self, model_info: ModelInfo, similarity_model: str, prompt_dir: str, schema_dir: str, input_template_dir: str, embedding_cache_dir: str = _EMBEDDING_CACHE_DIR, similarity_backend: str = _SIMILARITY_BACKEND):
+        if similarity_backend not in _SIMILARITY_BACKENDS:
+            raise ValueError(f"Unknown similarity backend '{similarity_backend}', expected one of {_SIMILARITY_BACKENDS}")
         self.model_info = model_info
         self.prompt_loader = PromptLoader(prompt_dir)
         self.schema_loader = SchemaLoader(schema_dir)
         self.input_template_loader = InputTemplateLoader(input_template_dir)
         self.similarity_model = similarity_model
         self.similarity_model_info = self.model_info if similarity_model is None else ModelInfo(similarity_model)
+        self.embedding_cache_dir = embedding_cache_dir
+        self.similarity_backend = similarity_backend
 
         self.chatbot = self.model_info.chatbot()
         self.outline = Outline()
         self.predictions = []
         self.rp_history = []
         self.logs = []
+        self.log_sink = None
 
     def get_outline(self) -> Outline:
         return self.outline
@@ -86,9 +93,15 @@ class OutlineEvaluationSession:
         return "Empty"
 
     def append_conversation(self, lastest_conversation: str) -> dict:
+        return run_steps(self.append_conversation_steps(lastest_conversation))
+    
+    async def aappend_conversation(self, lastest_conversation: str) -> dict:
+        return await arun_steps(self.append_conversation_steps(lastest_conversation))
+    
+    def append_conversation_steps(self, lastest_conversation: str):
         previous_outline = self.outline.to_str()
         previous_story = self.get_previous_story()
-        new_chapter, new_sections, predicted_sections = self.handle_outline_builder(lastest_conversation, previous_outline, previous_story)
+        new_chapter, new_sections, predicted_sections = yield from self.outline_builder_steps(lastest_conversation, previous_outline, previous_story)
         first_section = new_sections[0]
         
         # single_likelihood_result = None
@@ -97,9 +110,9 @@ class OutlineEvaluationSession:
         last_prediction = None
         if self.predictions:
             last_prediction = self.predictions[-1]
-            similarity_results, prediction_options = self.handle_similarity_worker(first_section, last_prediction)
-            multi_likelihood_result = self.handle_outline_multi_likelihood(first_section, new_chapter, prediction_options, previous_outline, previous_story)
-            # single_likelihood_result = self.handle_outline_single_likelihood(first_section, new_chapter, prediction_options, previous_outline, previous_story)
+            similarity_results, prediction_options = yield from self.similarity_worker_steps(first_section, last_prediction)
+            multi_likelihood_result = yield from self.outline_multi_likelihood_steps(first_section, new_chapter, prediction_options, previous_outline, previous_story)
+            # single_likelihood_result = yield from self.outline_single_likelihood_steps(first_section, new_chapter, prediction_options, previous_outline, previous_story)
         
         self.predictions.append(predicted_sections)
         self.rp_history.append(lastest_conversation)
@@ -112,7 +125,7 @@ class OutlineEvaluationSession:
             "multi_likelihood_result": multi_likelihood_result,
             # "single_likelihood_result": single_likelihood_result,
         }
-        self.logs.append(new_log)
+        self.add_log(new_log)
         
         final_result = {"abruptness": 0, "predicability": 1}
         if multi_likelihood_result:
@@ -123,7 +136,7 @@ class OutlineEvaluationSession:
         
         return final_result
     
-    def handle_outline_builder(self, lastest_conversation: str, existing_outline: str, previous_story: str) -> tuple[str, str, list[str]]:
+    def outline_builder_steps(self, lastest_conversation: str, existing_outline: str, previous_story: str):
         message = self.input_template_loader.load("outline_builder").format(existing_outline=existing_outline, previous_story=previous_story, new_story=lastest_conversation)
         
         processed_success = False
@@ -135,7 +148,7 @@ class OutlineEvaluationSession:
             
             while not processed_success:
                 try:
-                    text_response, json_response = bot.get_structured_response(message, schema_key="outline_builder", record=True, temperature=0.2)
+                    text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="outline_builder", record=True, temperature=0.2)
                     print_dev_message("Outline Builder Response:")
                     print_dev_message(text_response)
                     
@@ -164,18 +177,19 @@ class OutlineEvaluationSession:
     
         return new_chapter, new_sections, predicted_sections
     
-    def handle_similarity_worker(self, new_section: str, predicted_sections: list[str]) -> tuple[list[float], list[str]]:
+    def similarity_worker_steps(self, new_section: str, predicted_sections: list[str]):
         similarities = []
         if not self.similarity_model_info.is_valid():
-            similarity_worker = SentenceSimilarityWorker(self.similarity_model)
-            similarities = [similarity_worker.cosine_similarity(new_section, section) for section in predicted_sections]
+            # Loading and running the local model is CPU bound, so the async path keeps it off the event loop
+            similarity_worker = yield BlockingCall(get_similarity_worker, self.similarity_model, self.embedding_cache_dir, self.similarity_backend)
+            similarities = yield BlockingCall(similarity_worker.batch_cosine_similarity, new_section, predicted_sections)
         else:
             message = self.input_template_loader.load("outline_similarity").format(predictions=predicted_sections, real_section=new_section)
             if self.model_info.output_format() == "json":
                 sys_prompt = self.prompt_loader.load_sys_prompts("outline_similarity", subtype="json")
                 bot = self.chatbot(self.similarity_model_info.model(), sys_prompt, self.schema_loader)
                 
-                text_response, json_response = bot.get_structured_response(message, schema_key="outline_similarity", record=False, temperature=0.2)
+                text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="outline_similarity", record=False, temperature=0.2)
                 print_dev_message(message)
                 print_dev_message(text_response)
                 similarities = json_response["similarities"]
@@ -203,7 +217,7 @@ class OutlineEvaluationSession:
         
         return similarity_results, prediction_options
     
-    def handle_outline_multi_likelihood(self, new_section: str, new_chapter: str, prediction_options: list[str], existing_outline: str, previous_story: str) -> dict:
+    def outline_multi_likelihood_steps(self, new_section: str, new_chapter: str, prediction_options: list[str], existing_outline: str, previous_story: str):
         options = prediction_options + [new_section]
         options_text = "\n".join([f"{i + 1}. {option}" for i, option in enumerate(options)])
         correct_answer_index = options.index(new_section)
@@ -218,7 +232,7 @@ class OutlineEvaluationSession:
             
             while not processed_success:
                 try:
-                    text_response, json_response = bot.get_structured_response(message, schema_key="outline_multi_likelihood", record=True, temperature=0.2)
+                    text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="outline_multi_likelihood", record=True, temperature=0.2)
                     print_dev_message("Outline Multi Likelihood Response:")
                     print_dev_message(text_response)
                     
@@ -245,7 +259,7 @@ class OutlineEvaluationSession:
         
         return multichoice_result
     
-    def handle_outline_single_likelihood(self, new_section: str, new_chapter: str, prediction_options: list[str], existing_outline: str, previous_story: str) -> dict:
+    def outline_single_likelihood_steps(self, new_section: str, new_chapter: str, prediction_options: list[str], existing_outline: str, previous_story: str):
         
         processed_success = False
         tries_count = _ERROR_RETRIES
@@ -259,7 +273,7 @@ class OutlineEvaluationSession:
                     corresponding_prediction_results = {}
                     for prediction in prediction_options:
                         message = self.input_template_loader.load("outline_single_likelihood").format(existing_outline=existing_outline, latest_story=previous_story, prediction=prediction)
-                        text_response, json_response = bot.get_structured_response(message, schema_key="outline_single_likelihood", record=False, temperature=0)
+                        text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="outline_single_likelihood", record=False, temperature=0)
                         corresponding_prediction_results[prediction] = json_response["likelihood"]
                     score_sum = sum(corresponding_prediction_results.values())
                     
@@ -285,7 +299,23 @@ class OutlineEvaluationSession:
             raise NotImplementedError("Output format not supported for this method.")
         
         return multichoice_result
-        
+    
+    def add_log(self, new_log: dict) -> None:
+        self.logs.append(new_log)
+        if self.log_sink is not None:
+            self.log_sink.append_section(new_log)
+    
+    def stream_logs(self, file_path: str, fsync_policy: str = "close") -> None:
+        # Appends every section log to a JSONL file as it comes, logs from before the call are written first
+        self.log_sink = JsonlLogSink(file_path, fsync_policy)
+        for log in self.logs:
+            self.log_sink.append_section(log)
+    
+    def close_log_stream(self) -> None:
+        if self.log_sink is not None:
+            self.log_sink.close()
+            self.log_sink = None
+    
     def export_logs(self, file_path: str) -> None:
         with open(file_path, "w", encoding="utf-8") as f:
             json.dump(self.logs, f, ensure_ascii=False, indent=4)
@@ -309,6 +339,8 @@ if __name__ == "__main__":
 
     outline_session = OutlineEvaluationSession(using_model_info, similarity_model, prompt_dir=prompt_dir, schema_dir=schema_dir, input_template_dir=input_template_dir)
     
+    outline_session.stream_logs(os.path.join(cur_dir, "sample_outline_log.jsonl"))
     for section in sample_narrative:
         outline_session.append_conversation(section)
-        outline_session.export_logs(os.path.join(cur_dir, "sample_outline_log.json"))
\ No newline at end of file
+    outline_session.close_log_stream()
+    outline_session.export_logs(os.path.join(cur_dir, "sample_outline_log.json"))
\ No newline at end of file
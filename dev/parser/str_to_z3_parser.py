@@ -1,12 +1,111 @@
 import os
+import re
+import threading
+from collections import Counter, OrderedDict
 from z3 import *
-from lark import Lark, Transformer, v_args
+from lark import Lark, Transformer, Tree, v_args
+from lark.exceptions import LarkError
 
 # Load grammar
+_GRAMMAR_DIR = os.path.dirname(os.path.realpath(__file__))
+_parser_registry = {}
+_parser_registry_lock = threading.Lock()
+# Counted separately from the registry lock, so parses never wait on a grammar being compiled
+_parse_path_counts = Counter()
+_parse_path_counts_lock = threading.Lock()
+_FUNCTION_CALL_PATTERN = re.compile(r"([a-zA-Z][a-zA-Z0-9_]*)\s*\(")
 
 class FOLParsingError(Exception):
     pass
 
+def get_fol_parser(grammar_file: str = "fol.lark", parser: str = "earley", lexer: str = "dynamic", cache: bool | str = False) -> Lark:
+    # Grammar compilation dominates the cost of a single parse, so each configuration is built once per process
+    registry_key = (grammar_file, parser, lexer)
+    fol_parser = _parser_registry.get(registry_key)
+    if fol_parser is not None:
+        return fol_parser
+    if cache and parser != "lalr":
+        raise ValueError(f"Lark can only cache LALR grammars on disk, got parser='{parser}'.")
+    with _parser_registry_lock:
+        fol_parser = _parser_registry.get(registry_key)
+        if fol_parser is None:
+            grammar_path = os.path.join(_GRAMMAR_DIR, grammar_file)
+            with open(grammar_path, 'r') as f:
+                grammar = f.read()
+            lark_options = {"start": 'formula', "parser": parser, "lexer": lexer}
+            if cache:
+                lark_options["cache"] = cache
+            fol_parser = Lark(grammar, **lark_options)
+            _parser_registry[registry_key] = fol_parser
+    return fol_parser
+
+def clear_fol_parsers() -> None:
+    with _parser_registry_lock:
+        _parser_registry.clear()
+
+def parse_fol_tree(formula_str: str) -> tuple[Tree, str]:
+    # Try the unambiguous LALR grammar first, only formulas it rejects pay for the Earley parser
+    try:
+        tree = get_fol_parser("fol_lalr.lark", parser="lalr", lexer="contextual", cache=True).parse(formula_str)
+        parse_path = "lalr"
+    except LarkError:
+        tree = get_fol_parser().parse(formula_str)
+        parse_path = "earley"
+    with _parse_path_counts_lock:
+        _parse_path_counts[parse_path] += 1
+    return tree, parse_path
+
+def get_parse_path_counts() -> dict:
+    with _parse_path_counts_lock:
+        return dict(_parse_path_counts)
+
+def reset_parse_path_counts() -> None:
+    with _parse_path_counts_lock:
+        _parse_path_counts.clear()
+
+class FOLParseCache:
+    # LRU cache from formula text to the built z3 expression. Expressions belong to one z3 context, so a cache must
+    # not be shared between builders. Keys include the arity of every relation the formula references, so a relation
+    # redeclared with a different signature never serves a stale expression.
+    def __init__(self, max_size: int = 2048):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def make_key(self, builder, formula_str: str) -> tuple:
+        normalized_formula = " ".join(formula_str.split())
+        signature = []
+        for name in sorted(set(_FUNCTION_CALL_PATTERN.findall(normalized_formula))):
+            z3_func = builder.get_fun(name)
+            signature.append((name, z3_func.arity() if z3_func is not None else None))
+        return normalized_formula, tuple(signature)
+    
+    def get(self, key: tuple):
+        with self.lock:
+            built_formula = self.entries.get(key)
+            if built_formula is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return built_formula
+    
+    def put(self, key: tuple, built_formula) -> None:
+        with self.lock:
+            self.entries[key] = built_formula
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+    
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.entries), "max_size": self.max_size}
+
 def close_brackets(formula_str):
     open_count = formula_str.count('(')
     close_count = formula_str.count(')')
@@ -58,12 +157,7 @@ class IdCollector(Transformer):
         return None
 
 def collect_iden(formula_str):
-    cur_dir = os.path.dirname(os.path.realpath(__file__))
-    grammar_path = os.path.join(cur_dir, "fol.lark")
-    with open(grammar_path, 'r') as f:
-        grammar = f.read()
-    parser = Lark(grammar, start='formula', parser='earley', lexer='dynamic')
-    tree = parser.parse(formula_str)
+    tree, parse_path = parse_fol_tree(formula_str)
     collector = IdCollector()
     collector.transform(tree)
     return list(collector.variables), list(collector.functions)
@@ -121,7 +215,8 @@ class Z3Builder(Transformer):
         return IntVal(int(tok), ctx=self.ctx)
     @v_args(inline=True)
     def func(self, name, terms):
-        terms_children = terms.children
+        # The Earley grammar inlines a single argument instead of wrapping it in a term_list
+        terms_children = terms.children if isinstance(terms, Tree) else [terms]
         z3_func = self.get_fun(str(name))
         if z3_func is None:
             raise FOLParsingError(f"Function {name}() not found in function table. Please remove any references to it and do not add in anything else.")
@@ -131,21 +226,27 @@ class Z3Builder(Transformer):
             raise FOLParsingError(f"Error constructing function {name} with arguments {terms_children}: {e}")
         return contructed_func
 
-def parse_z3(builder, formula_str):
-    cur_dir = os.path.dirname(os.path.realpath(__file__))
-    grammar_path = os.path.join(cur_dir, "fol.lark")
-    with open(grammar_path, 'r') as f:
-        grammar = f.read()
-    parser = Lark(grammar, start='formula', parser='earley', lexer='dynamic')
+def parse_z3(builder, formula_str, parse_paths: list = None, parse_cache: FOLParseCache = None):
     if "'" in formula_str or '"' in formula_str:
         raise FOLParsingError(f"Formula should not contain strings: {formula_str}")
     formula_str = close_brackets(formula_str)
+    if parse_cache is not None:
+        cache_key = parse_cache.make_key(builder, formula_str)
+        built_formula = parse_cache.get(cache_key)
+        if built_formula is not None:
+            if parse_paths is not None:
+                parse_paths.append("cache")
+            return built_formula
     try:
-        tree = parser.parse(formula_str)
+        tree, parse_path = parse_fol_tree(formula_str)
     except Exception as e:
         raise FOLParsingError(f"Syntax error when parsing formula: {formula_str} {e}")
+    if parse_paths is not None:
+        parse_paths.append(parse_path)
     try:
         built_formula = builder.transform(tree)
     except Exception as e:
         raise FOLParsingError(f"Error when building formula: {formula_str} {e}")
+    if parse_cache is not None:
+        parse_cache.put(cache_key, built_formula)
     return built_formula
\ No newline at end of file
@@ -0,0 +1,494 @@
+import time
+import json
+import hashlib
+import sqlite3
+import threading
+from z3 import *
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+from parser.str_to_z3_parser import FOLParsingError
+
+class SolverLimits:
+    # Per-check timeout and resource limit (0 disables either), plus an optional cap on the total solving time of a narrative.
+    # Every check made through it is recorded with its scope, result, elapsed time and consumed rlimit for the section logs.
+    def __init__(self, timeout_ms: int = 0, rlimit: int = 0, time_budget: float = None) -> None:
+        self.timeout_ms = timeout_ms
+        self.rlimit = rlimit
+        self.time_budget = time_budget
+        self.time_spent = 0.0
+        self.checks = []
+        self.last_limits = None
+    
+    def next_timeout_ms(self, concurrent_checks: int = 1) -> int:
+        # None once the narrative budget is used up, otherwise the timeout for each of the next checks. Checks running at the
+        # same time split what is left of the budget, as the time of every one of them is counted against it.
+        if self.time_budget is None:
+            return self.timeout_ms
+        remaining_ms = int((self.time_budget - self.time_spent) * 1000)
+        if remaining_ms <= 0:
+            return None
+        # At least 1ms, as a timeout of 0 would disable it
+        share_ms = max(1, remaining_ms // concurrent_checks)
+        return min(self.timeout_ms, share_ms) if self.timeout_ms else share_ms
+    
+    def record(self, scope: str, result: str, elapsed: float, rlimit_used: int, reason: str = None, cached: bool = False) -> None:
+        self.time_spent += elapsed
+        self.checks.append({"scope": scope, "result": result, "elapsed": round(elapsed, 4), "rlimit": rlimit_used, "reason_unknown": reason, "cached": cached})
+    
+    def check(self, solver: Solver, scope: str, *assumptions) -> CheckSatResult:
+        timeout_ms = self.next_timeout_ms()
+        if timeout_ms is None:
+            self.last_limits = None
+            self.record(scope, "unknown", 0.0, 0, "solver time budget exhausted")
+            return unknown
+        self.last_limits = (timeout_ms, self.rlimit)
+        solver.set("timeout", timeout_ms)
+        solver.set("rlimit", self.rlimit)
+        rlimit_before = get_rlimit_count(solver)
+        start = time.perf_counter()
+        result = solver.check(*assumptions)
+        elapsed = time.perf_counter() - start
+        reason = solver.reason_unknown() if result == unknown else None
+        self.record(scope, str(result), elapsed, get_rlimit_count(solver) - rlimit_before, reason)
+        return result
+    
+    def pop_section_checks(self) -> list:
+        section_checks = self.checks
+        self.checks = []
+        return section_checks
+
+_PIN_OFFSET = 1000000
+
+class ObjectEncoding:
+    # How object constants are kept apart: one Distinct over all of them, or each declared object "pinned" to an integer literal
+    # of its own. Pinning spares z3 the pairwise disequalities Distinct expands into. It is equisatisfiable with Distinct as long as
+    # formulas neither order objects nor equate them with numerals, which is why the literals start far above the numerals formulas
+    # use. Every other constant, time points above all, is ordered by formulas, so those keep a Distinct among themselves and are
+    # only bounded below the pins. Whether a constant is an object is decided once, when it is first seen.
+    def __init__(self, z3_context: Context, mode: str = "distinct", is_object=None) -> None:
+        self.z3_context = z3_context
+        self.mode = mode
+        self.is_object = is_object if is_object is not None else (lambda name: False)
+        self.pins = {}
+        self.unpinned = set()
+    
+    def classify(self, sorted_vars: list) -> tuple[list, list]:
+        pinned_vars = []
+        free_vars = []
+        for var in sorted_vars:
+            name = str(var)
+            if name not in self.pins and name not in self.unpinned:
+                if self.is_object(name):
+                    self.pins[name] = _PIN_OFFSET + len(self.pins)
+                else:
+                    self.unpinned.add(name)
+            (pinned_vars if name in self.pins else free_vars).append(var)
+        return pinned_vars, free_vars
+    
+    def pin_constraints(self, var_list) -> list:
+        # Constraints that never change once a constant is known, so they can be asserted for good
+        if self.mode == "distinct":
+            return []
+        pinned_vars, free_vars = self.classify(sorted(var_list, key=str))
+        pin_bound = IntVal(_PIN_OFFSET, self.z3_context)
+        return [var == IntVal(self.pins[str(var)], self.z3_context) for var in pinned_vars] + [var < pin_bound for var in free_vars]
+    
+    def distinct_constraints(self, var_list) -> list:
+        # Constraints over all constants at once, which have to be rebuilt as constants are added
+        sorted_vars = sorted(var_list, key=str)
+        if self.mode == "pinned":
+            sorted_vars = self.classify(sorted_vars)[1]
+        return [Distinct(*sorted_vars)] if sorted_vars else []
+    
+    def constraints(self, var_list) -> list:
+        # Sorted so the constraints, and the solver result cache keys built from them, do not depend on set order
+        return self.pin_constraints(var_list) + self.distinct_constraints(var_list)
+
+def get_rlimit_count(solver: Solver) -> int:
+    statistics = solver.statistics()
+    if "rlimit count" in statistics.keys():
+        return statistics.get_key_value("rlimit count")
+    return 0
+
+def limit_covers(stored_limit: int, limit: int) -> bool:
+    # 0 means unlimited for both the timeout and the rlimit
+    return stored_limit == 0 or (limit != 0 and stored_limit >= limit)
+
+class SolverResultCache:
+    # On-disk cache of check results keyed by the assertion set, shared by every session and process using the same file.
+    # sat and unsat results are reused regardless of limits, unknown only when it was reached with limits at least as generous.
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS solver_results (key TEXT PRIMARY KEY, result TEXT NOT NULL, core TEXT NOT NULL, timeout_ms INTEGER NOT NULL, rlimit INTEGER NOT NULL)")
+        self.connection.commit()
+    
+    @staticmethod
+    def make_key(var_constraints: list, formulas: list) -> str:
+        # The sorted sexprs make the key independent of assertion order and tracking names
+        key_parts = sorted(constraint.sexpr() for constraint in var_constraints)
+        key_parts.append("")
+        key_parts += sorted(set(formula.sexpr() for formula in formulas))
+        return hashlib.sha256("\n".join(key_parts).encode("utf-8")).hexdigest()
+    
+    def get(self, key: str, timeout_ms: int, rlimit: int) -> tuple[str, list]:
+        with self.lock:
+            row = self.connection.execute("SELECT result, core, timeout_ms, rlimit FROM solver_results WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                result, core, stored_timeout_ms, stored_rlimit = row
+                if result != "unknown" or (limit_covers(stored_timeout_ms, timeout_ms) and limit_covers(stored_rlimit, rlimit)):
+                    self.hits += 1
+                    return result, json.loads(core)
+            self.misses += 1
+            return None
+    
+    def put(self, key: str, result: str, core: list, timeout_ms: int, rlimit: int) -> None:
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO solver_results VALUES (?, ?, ?, ?, ?)", (key, result, json.dumps(sorted(core)), timeout_ms, rlimit))
+            self.connection.commit()
+    
+    def clear(self) -> None:
+        with self.lock:
+            self.connection.execute("DELETE FROM solver_results")
+            self.connection.commit()
+            self.hits = 0
+            self.misses = 0
+    
+    def stats(self) -> dict:
+        with self.lock:
+            size = self.connection.execute("SELECT COUNT(*) FROM solver_results").fetchone()[0]
+            return {"path": self.path, "size": size, "hits": self.hits, "misses": self.misses}
+
+_solver_result_caches = {}
+_solver_result_caches_lock = threading.Lock()
+
+def get_solver_result_cache(path: str) -> SolverResultCache:
+    with _solver_result_caches_lock:
+        cache = _solver_result_caches.get(path)
+        if cache is None:
+            cache = SolverResultCache(path)
+            _solver_result_caches[path] = cache
+    return cache
+
+_solver_pools = {}
+_solver_pools_lock = threading.Lock()
+
+def get_solver_pool(workers: int) -> ProcessPoolExecutor:
+    # Pools are shared by every session in the process, one per worker count
+    with _solver_pools_lock:
+        pool = _solver_pools.get(workers)
+        if pool is None:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            _solver_pools[workers] = pool
+    return pool
+
+def shutdown_solver_pools() -> None:
+    with _solver_pools_lock:
+        for pool in _solver_pools.values():
+            pool.shutdown()
+        _solver_pools.clear()
+
+def serialize_tracked_formulas(z3_context: Context, var_constraints: list, tracked_formulas: list[tuple[str, ExprRef]]) -> str:
+    # Tracking literals become implication guards so a worker can recover the unsat core through check assumptions
+    serializer = Solver(ctx=z3_context)
+    serializer.add(*var_constraints)
+    for assert_key, formula in tracked_formulas:
+        serializer.add(Implies(Bool(assert_key, z3_context), formula))
+    return serializer.sexpr()
+
+def check_smt2_problem(smt2_text: str, assert_keys: list[str], timeout_ms: int, rlimit: int) -> tuple[str, list[str], float, int, str]:
+    # Runs in a worker process, with a context of its own
+    z3_context = Context()
+    solver = Solver(ctx=z3_context)
+    solver.from_string(smt2_text)
+    solver.set("timeout", timeout_ms)
+    solver.set("rlimit", rlimit)
+    start = time.perf_counter()
+    result = solver.check(*[Bool(assert_key, z3_context) for assert_key in assert_keys])
+    elapsed = time.perf_counter() - start
+    unsat_core = [str(assertion) for assertion in solver.unsat_core()] if result == unsat else []
+    reason = solver.reason_unknown() if result == unknown else None
+    return str(result), unsat_core, elapsed, get_rlimit_count(solver), reason
+
+def solve_scopes_in_pool(pool: ProcessPoolExecutor, z3_context: Context, combined_formulas: dict, solver_limits: SolverLimits, object_encoding: ObjectEncoding) -> tuple[list, list]:
+    # Same checks as FOLEvaluationSession.solve_combined_formulas, but the global check and every scope check are independent problems
+    scopes = ["global"] + [scope for scope in combined_formulas if scope != "global"]
+    # The problems run at the same time, so each gets an equal share of the budget left before any of them runs
+    timeout_ms = solver_limits.next_timeout_ms(len(scopes))
+    if timeout_ms is None:
+        for scope in scopes:
+            solver_limits.record(scope, "unknown", 0.0, 0, "solver time budget exhausted")
+        return ["unknown"] * len(scopes), []
+    
+    var_list = set()
+    for formulas in combined_formulas.values():
+        for formula in formulas:
+            var_list.update(z3util.get_vars(formula))
+    var_constraints = object_encoding.constraints(var_list)
+    
+    track_table = {}
+    global_tracked = []
+    for i, formula in enumerate(combined_formulas["global"]):
+        assert_key = f"global_assertion_{i}"
+        global_tracked.append((assert_key, formula))
+        track_table[assert_key] = formula.sexpr()
+    
+    futures = [pool.submit(check_smt2_problem, serialize_tracked_formulas(z3_context, var_constraints, global_tracked), [key for key, formula in global_tracked], timeout_ms, solver_limits.rlimit)]
+    for scope in scopes[1:]:
+        scope_tracked = []
+        for i, formula in enumerate(combined_formulas[scope]):
+            assert_key = f"{scope}_assertion_{i}"
+            scope_tracked.append((assert_key, formula))
+            track_table[assert_key] = formula.sexpr()
+        tracked = global_tracked + scope_tracked
+        futures.append(pool.submit(check_smt2_problem, serialize_tracked_formulas(z3_context, var_constraints, tracked), [key for key, formula in tracked], timeout_ms, solver_limits.rlimit))
+    
+    results = []
+    conflicting_assertions = set()
+    for scope, future in zip(scopes, futures):
+        result, unsat_core, elapsed, rlimit_used, reason = future.result()
+        solver_limits.record(scope, result, elapsed, rlimit_used, reason)
+        results.append(result)
+        for assertion_str in unsat_core:
+            if assertion_str in track_table:
+                conflicting_assertions.add(track_table[assertion_str])
+            else:
+                raise FOLParsingError(f"Assertion {assertion_str} not found in track table. Please check the solver assertions.")
+    return results, list(conflicting_assertions)
+
+class FormulaStore:
+    # Interns every asserted formula once and keeps per-scope lists of formula ids, so the history is never copied per section.
+    # Formulas are keyed by their SMT-LIB text rather than their AST id: quantified formulas parsed back from a checkpoint are
+    # different ASTs from the ones the parser builds for the same source, though they print the same.
+    def __init__(self) -> None:
+        self.formulas = []
+        self.formula_ids = {}
+        self.scope_indices = defaultdict(list)
+        self.scope_members = defaultdict(set)
+        self.sections = []
+        self.duplicate_count = 0
+    
+    def intern(self, formula: ExprRef) -> int:
+        formula_key = formula.sexpr()
+        formula_id = self.formula_ids.get(formula_key)
+        if formula_id is None:
+            formula_id = len(self.formulas)
+            self.formulas.append(formula)
+            self.formula_ids[formula_key] = formula_id
+        return formula_id
+    
+    def add_section(self, section_formulas: dict) -> dict:
+        # Returns the formulas of the section that are new to their scope
+        section_ids = {}
+        new_formulas = defaultdict(list)
+        new_formulas["global"] = []
+        for scope, formulas in section_formulas.items():
+            section_ids[scope] = []
+            new_formulas[scope] = []
+            for formula in formulas:
+                formula_id = self.intern(formula)
+                section_ids[scope].append(formula_id)
+                if formula_id in self.scope_members[scope]:
+                    self.duplicate_count += 1
+                    continue
+                self.scope_members[scope].add(formula_id)
+                self.scope_indices[scope].append(formula_id)
+                new_formulas[scope].append(formula)
+        self.sections.append(section_ids)
+        return new_formulas
+    
+    def scope_formulas(self, scope: str) -> list:
+        return [self.formulas[formula_id] for formula_id in self.scope_indices[scope]]
+    
+    def combine_scopes(self, scopes) -> dict:
+        # Every formula asserted so far in the given scopes, global formulas always included
+        combined_formulas = defaultdict(list)
+        combined_formulas["global"] = self.scope_formulas("global")
+        for scope in scopes:
+            combined_formulas[scope] = self.scope_formulas(scope)
+        return combined_formulas
+    
+    def section_formulas(self, section_index: int) -> dict:
+        return {scope: [self.formulas[formula_id] for formula_id in formula_ids] for scope, formula_ids in self.sections[section_index].items()}
+    
+    def stats(self) -> dict:
+        return {"unique_formulas": len(self.formulas), "scoped_formulas": sum(len(indices) for indices in self.scope_indices.values()), "duplicates": self.duplicate_count}
+
+class ScopeSolverState:
+    def __init__(self, z3_context: Context) -> None:
+        self.solver = Solver(ctx=z3_context)
+        self.global_count = 0
+        self.scope_count = 0
+        self.pinned_count = 0
+
+class IncrementalFOLSolver:
+    # Keeps one long-lived solver for the global formulas and one per scope (global formulas plus the scope's own),
+    # so every section only asserts what is new instead of rebuilding the whole history. z3 only has a single
+    # push/pop stack per solver, which is why scopes get their own solver rather than a frame that would be popped.
+    # Global formulas are synced into a scope solver lazily, the next time it is checked. The Distinct constraint over every
+    # variable grows each section, so it lives in a push/pop frame around the check instead of piling up in the solver.
+    def __init__(self, z3_context: Context, solver_limits: SolverLimits, object_encoding: ObjectEncoding, result_cache: SolverResultCache = None) -> None:
+        self.z3_context = z3_context
+        self.solver_limits = solver_limits
+        self.object_encoding = object_encoding
+        self.result_cache = result_cache
+        self.global_formulas = []
+        self.scope_formulas = defaultdict(list)
+        self.track_table = {}
+        self.distinct_vars = []
+        self.known_var_ids = set()
+        self.global_state = ScopeSolverState(z3_context)
+        self.scope_states = {}
+    
+    def add_distinct_vars(self, formulas: list) -> None:
+        for formula in formulas:
+            for var in z3util.get_vars(formula):
+                if var.get_id() not in self.known_var_ids:
+                    self.known_var_ids.add(var.get_id())
+                    self.distinct_vars.append(var)
+    
+    def sync_state(self, state: ScopeSolverState) -> None:
+        for i in range(state.global_count, len(self.global_formulas)):
+            assert_key = f"global_assertion_{i}"
+            state.solver.assert_and_track(self.global_formulas[i], assert_key)
+        state.global_count = len(self.global_formulas)
+    
+    def check_state(self, state: ScopeSolverState, scope: str, conflicting_assertions: set, formulas: list) -> str:
+        # A pin never changes once given, so pins are asserted for good and only the Distinct needs the frame
+        state.solver.add(*self.object_encoding.pin_constraints(self.distinct_vars[state.pinned_count:]))
+        state.pinned_count = len(self.distinct_vars)
+        # Keyed by everything the scope's solver holds, so a rerun of the same narrative is served from the cache
+        cache_key = None
+        if self.result_cache is not None:
+            cache_key = SolverResultCache.make_key(self.object_encoding.constraints(self.distinct_vars), formulas)
+            cached_result = self.result_cache.get(cache_key, self.solver_limits.timeout_ms, self.solver_limits.rlimit)
+            if cached_result is not None:
+                result, core = cached_result
+                self.solver_limits.record(scope, result, 0.0, 0, cached=True)
+                conflicting_assertions.update(core)
+                return result
+        state.solver.push()
+        state.solver.add(*self.object_encoding.distinct_constraints(self.distinct_vars))
+        result = self.solver_limits.check(state.solver, scope)
+        unsat_core = state.solver.unsat_core() if result == unsat else []
+        core = []
+        for assertion in unsat_core:
+            assertion_str = str(assertion)
+            if assertion_str in self.track_table:
+                core.append(self.track_table[assertion_str])
+            else:
+                raise FOLParsingError(f"Assertion {assertion_str} not found in track table. Please check the solver assertions.")
+        state.solver.pop()
+        conflicting_assertions.update(core)
+        if cache_key is not None and self.solver_limits.last_limits is not None:
+            self.result_cache.put(cache_key, str(result), core, *self.solver_limits.last_limits)
+        return str(result)
+    
+    def add_formulas(self, current_formulas: dict) -> None:
+        # Only records the formulas, the solvers take them in the next time their scope is checked
+        for formula in current_formulas["global"]:
+            self.track_table[f"global_assertion_{len(self.global_formulas)}"] = formula.sexpr()
+            self.global_formulas.append(formula)
+        for scope, formulas in current_formulas.items():
+            if scope != "global":
+                for formula in formulas:
+                    self.track_table[f"{scope}_assertion_{len(self.scope_formulas[scope])}"] = formula.sexpr()
+                    self.scope_formulas[scope].append(formula)
+        for formulas in current_formulas.values():
+            self.add_distinct_vars(formulas)
+    
+    def check_section(self, current_formulas: dict) -> tuple[list, list]:
+        # Same results as solving the full history from scratch: the global formulas first, then every scope used in this section
+        self.add_formulas(current_formulas)
+        
+        conflicting_assertions = set()
+        self.sync_state(self.global_state)
+        results = [self.check_state(self.global_state, "global", conflicting_assertions, self.global_formulas)]
+        
+        for scope in current_formulas.keys():
+            if scope != "global":
+                if scope not in self.scope_states:
+                    self.scope_states[scope] = ScopeSolverState(self.z3_context)
+                state = self.scope_states[scope]
+                self.sync_state(state)
+                scope_formulas = self.scope_formulas[scope]
+                for i in range(state.scope_count, len(scope_formulas)):
+                    state.solver.assert_and_track(scope_formulas[i], f"{scope}_assertion_{i}")
+                state.scope_count = len(scope_formulas)
+                results.append(self.check_state(state, scope, conflicting_assertions, self.global_formulas + scope_formulas))
+        
+        return results, list(conflicting_assertions)
+
+def collect_symbols(formula) -> frozenset:
+    # Names of every uninterpreted constant and relation in the formula, bound variables are not symbols
+    symbols = set()
+    visited = set()
+    pending = [formula]
+    while pending:
+        expr = pending.pop()
+        if expr.get_id() in visited:
+            continue
+        visited.add(expr.get_id())
+        if is_quantifier(expr):
+            pending.append(expr.body())
+        elif is_app(expr):
+            if expr.decl().kind() == Z3_OP_UNINTERPRETED:
+                symbols.add(expr.decl().name())
+            pending.extend(expr.children())
+    return frozenset(symbols)
+
+class SymbolIndex:
+    # Dependency index from symbols to the asserted formulas using them, for checking only the formulas a new section can affect.
+    # Formulas that share no symbol, directly or transitively, with the new section cannot change its satisfiability: without
+    # numerals every model of a disconnected group can be shifted along the integers to keep all constants distinct.
+    def __init__(self) -> None:
+        self.entries = defaultdict(list)
+        self.symbol_entries = defaultdict(list)
+    
+    def add_formulas(self, scope: str, formulas: list) -> set:
+        added_symbols = set()
+        for formula in formulas:
+            symbols = collect_symbols(formula)
+            position = len(self.entries[scope])
+            self.entries[scope].append((formula, symbols))
+            for symbol in symbols:
+                self.symbol_entries[symbol].append((scope, position))
+            added_symbols.update(symbols)
+        return added_symbols
+    
+    def slice_section(self, current_formulas: dict) -> tuple[dict, int, int]:
+        # Indexes the section, then collects the connected component reachable from its symbols within the scopes it checks
+        checked_scopes = set(current_formulas.keys())
+        pending_symbols = []
+        for scope, formulas in current_formulas.items():
+            pending_symbols.extend(self.add_formulas(scope, formulas))
+        
+        visited_symbols = set(pending_symbols)
+        kept_positions = defaultdict(set)
+        while pending_symbols:
+            symbol = pending_symbols.pop()
+            for scope, position in self.symbol_entries[symbol]:
+                if scope not in checked_scopes or position in kept_positions[scope]:
+                    continue
+                kept_positions[scope].add(position)
+                for next_symbol in self.entries[scope][position][1]:
+                    if next_symbol not in visited_symbols:
+                        visited_symbols.add(next_symbol)
+                        pending_symbols.append(next_symbol)
+        
+        sliced_formulas = defaultdict(list)
+        sliced_formulas["global"] = []
+        kept_count = 0
+        total_count = 0
+        for scope, formulas in current_formulas.items():
+            scope_entries = self.entries[scope]
+            # Formulas without any symbol (e.g. trivially true ones) are always kept
+            sliced_formulas[scope] = [formula for position, (formula, symbols) in enumerate(scope_entries) if position in kept_positions[scope] or not symbols]
+            kept_count += len(sliced_formulas[scope])
+            total_count += len(scope_entries)
+        return sliced_formulas, kept_count, total_count - kept_count
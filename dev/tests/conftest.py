@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The modules import each other by their path from dev/, as when they are run from there
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)), ".."))
@@ -0,0 +1,51 @@
+import os
+import json
+
+import pytest
+
+from config import ModelInfo
+from fol_evaluator import FOLEvaluationSession
+from timeline_maker import TimelineMakerSession
+
+dev_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+session_dirs = {"prompt_dir": "../prompts", "schema_dir": "../schemas", "input_template_dir": "../input_templates"}
+
+def make_sessions(solver_mode: str) -> tuple[TimelineMakerSession, FOLEvaluationSession]:
+    model_info = ModelInfo("mock-structured")
+    return TimelineMakerSession(model_info, **session_dirs), FOLEvaluationSession(model_info, solver_mode=solver_mode, solver_cache_path=None, **session_dirs)
+
+def run_narrative(narrative: list, solver_mode: str, resume_at: int = None, checkpoint_dir: str = None) -> tuple[list, dict]:
+    timeline_session, fol_session = make_sessions(solver_mode)
+    verdicts = []
+    for i, section in enumerate(narrative):
+        if i == resume_at:
+            checkpoint_paths = [os.path.join(checkpoint_dir, "timeline.json"), os.path.join(checkpoint_dir, "fol.json")]
+            timeline_session.save_checkpoint(checkpoint_paths[0])
+            fol_session.save_checkpoint(checkpoint_paths[1])
+            timeline_session, fol_session = make_sessions(solver_mode)
+            timeline_session.load_checkpoint(checkpoint_paths[0])
+            fol_session.load_checkpoint(checkpoint_paths[1])
+        timeline_session.append_conversation(section)
+        verdicts.append(sorted(fol_session.append_conversation(section, new_timeline=timeline_session.get_timeline())))
+    return verdicts, fol_session.formula_store.stats()
+
+@pytest.mark.parametrize("solver_mode", ["incremental", "scratch", "sliced"])
+def test_resumed_narrative_matches_uninterrupted_run(solver_mode, tmp_path):
+    # The second sample narrative re-asserts quantified formulas after section 4, which must still be recognised as duplicates
+    # of the formulas reloaded from the checkpoint
+    with open(os.path.join(dev_dir, "sample_rp.json"), "r", encoding="utf-8") as f:
+        narrative = json.load(f)[1]
+    uninterrupted_verdicts, uninterrupted_stats = run_narrative(narrative, solver_mode)
+    resumed_verdicts, resumed_stats = run_narrative(narrative, solver_mode, resume_at=4, checkpoint_dir=str(tmp_path))
+    assert resumed_verdicts == uninterrupted_verdicts
+    assert resumed_stats == uninterrupted_stats
+
+def test_resumed_narrative_keeps_its_spent_solver_budget(tmp_path):
+    model_info = ModelInfo("mock-structured")
+    fol_session = FOLEvaluationSession(model_info, solver_time_budget=0.5, solver_cache_path=None, **session_dirs)
+    fol_session.solver_limits.time_spent = 0.5
+    checkpoint_path = str(tmp_path / "fol.json")
+    fol_session.save_checkpoint(checkpoint_path)
+    resumed_session = FOLEvaluationSession(model_info, solver_time_budget=0.5, solver_cache_path=None, **session_dirs)
+    resumed_session.load_checkpoint(checkpoint_path)
+    assert resumed_session.solver_limits.next_timeout_ms() is None
@@ -0,0 +1,31 @@
+import time
+import asyncio
+import threading
+
+from api_wrapper.mock_chatbot import ChatBotMock, set_mock_latency
+from api_wrapper.rate_limiter import configure_rate_limit, get_rate_limiter
+
+def test_mock_requests_respect_max_in_flight():
+    configure_rate_limit("mock", "mock-limited", max_in_flight=2)
+    set_mock_latency("mock-limited", "fixed", seconds=0.1)
+    threads = [threading.Thread(target=lambda: ChatBotMock("mock-limited", "").send_message("hello")) for i in range(6)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Three rounds of two requests
+    assert time.perf_counter() - start >= 0.3
+    stats = get_rate_limiter("mock", "mock-limited").stats()
+    assert stats["requests"] == 6
+    assert stats["throttled_attempts"] >= 4
+
+def test_async_mock_requests_go_through_the_limiter():
+    configure_rate_limit("mock", "mock-limited-async", max_in_flight=1)
+    set_mock_latency("mock-limited-async", "fixed", seconds=0.05)
+    async def send_all():
+        await asyncio.gather(*[ChatBotMock("mock-limited-async", "").asend_message("hello") for i in range(4)])
+    start = time.perf_counter()
+    asyncio.run(send_all())
+    assert time.perf_counter() - start >= 0.2
+    assert get_rate_limiter("mock", "mock-limited-async").stats()["requests"] == 4
@@ -0,0 +1,37 @@
+import pytest
+from z3 import Function, IntSort, BoolSort
+
+from config import ModelInfo
+from fol_evaluator import FOLEvaluationSession, Relation
+from parser.str_to_z3_parser import parse_z3
+
+def make_session(solver_mode: str, object_encoding: str) -> FOLEvaluationSession:
+    session = FOLEvaluationSession(ModelInfo("mock-structured"), solver_mode=solver_mode, object_encoding=object_encoding, solver_cache_path=None)
+    session.objects["joseph"] = "A citizen of London"
+    session.objects["london"] = "The city"
+    at_function = Function("at", IntSort(session.z3_context), IntSort(session.z3_context), BoolSort(session.z3_context))
+    session.relations["at"] = Relation("at", ["x", "t"], "[x] is around at [t]", at_function)
+    return session
+
+def check(session: FOLEvaluationSession, formulas: list) -> list:
+    section_formulas = {"global": [parse_z3(session.z3_builder, formula) for formula in formulas]}
+    results, unsat_formulas, solver_log = session.check_section_formulas(section_formulas)
+    return results
+
+@pytest.mark.parametrize("solver_mode", ["scratch", "incremental", "sliced", "parallel"])
+@pytest.mark.parametrize("object_encoding", ["distinct", "pinned"])
+def test_time_points_keep_their_order(solver_mode, object_encoding):
+    # T10 sorts before T9 by name, which must not decide the order of the time points
+    session = make_session(solver_mode, object_encoding)
+    assert check(session, ["at(joseph, T9)", "at(joseph, T10)", "T9 < T10"]) == ["sat"]
+    assert check(session, ["at(london, T10)", "T10 < T11"]) == ["sat"]
+    assert check(session, ["T10 < T9"]) == ["unsat"]
+
+@pytest.mark.parametrize("solver_mode", ["scratch", "incremental"])
+def test_only_objects_are_pinned(solver_mode):
+    session = make_session(solver_mode, "pinned")
+    check(session, ["at(joseph, T9)", "at(london, T10)"])
+    assert set(session.object_encoding.pins) == {"joseph", "london"}
+    assert session.object_encoding.unpinned == {"T9", "T10"}
+    # Objects stay distinct from each other under pinning
+    assert check(session, ["joseph = london"]) == ["unsat"]
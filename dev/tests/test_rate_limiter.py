@@ -0,0 +1,29 @@
+import httpx
+import pytest
+
+from api_wrapper import rate_limiter
+from api_wrapper.rate_limiter import RateLimiter
+
+def test_retried_request_is_counted_once(monkeypatch):
+    monkeypatch.setattr(rate_limiter, "_BACKOFF_BASE", 0.001)
+    limiter = RateLimiter(requests_per_minute=6000)
+    failures = [httpx.ConnectError("connection reset"), httpx.ConnectError("connection reset")]
+    def request(messages):
+        if failures:
+            raise failures.pop()
+        return "ok"
+    assert limiter.call(request, messages=["hello"]) == "ok"
+    stats = limiter.stats()
+    assert stats["requests"] == 1
+    assert stats["attempts"] == 3
+    assert stats["retries"] == 2
+    assert stats["connection_errors"] == 2
+
+def test_failed_request_is_counted_once():
+    limiter = RateLimiter()
+    def request(messages):
+        raise ValueError("invalid response")
+    with pytest.raises(ValueError):
+        limiter.call(request, messages=["hello"])
+    assert limiter.stats()["requests"] == 1
+    assert limiter.stats()["attempts"] == 1
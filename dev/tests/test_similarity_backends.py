@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+pytest.importorskip("sentence_transformers")
+pytest.importorskip("onnxruntime")
+pytest.importorskip("optimum")
+
+from api_wrapper import sentence_similarity_lm
+from api_wrapper.sentence_similarity_lm import SentenceSimilarityWorker, find_quantized_model, get_quantization_config
+
+_MODEL_NAME = "all-MiniLM-L6-v2"
+_SENTENCES = ["Joseph walked to the market.", "Joseph went to the market.", "The ship sank in the storm."]
+
+@pytest.mark.parametrize("backend", ["torch", "onnx", "onnx-int8"])
+def test_backend_embeddings(backend):
+    worker = SentenceSimilarityWorker(_MODEL_NAME, backend=backend)
+    assert worker.backend == backend
+    embeddings = worker.encode(_SENTENCES)
+    assert embeddings.shape == (len(_SENTENCES), worker.model.get_sentence_embedding_dimension())
+    similarities = worker.batch_cosine_similarity(_SENTENCES[0], _SENTENCES[1:])
+    assert similarities[0] > similarities[1]
+
+def test_missing_quantized_file_is_exported_with_a_warning(tmp_path, monkeypatch):
+    monkeypatch.setattr(sentence_similarity_lm, "_ONNX_EXPORT_DIR", str(tmp_path))
+    monkeypatch.setattr(sentence_similarity_lm, "has_model_file", lambda model_name, file_name: False)
+    quantized_file = f"onnx/model_qint8_{get_quantization_config()}.onnx"
+    with pytest.warns(UserWarning, match="quantizing"):
+        model_dir = find_quantized_model(_MODEL_NAME, quantized_file)
+    assert os.path.isfile(os.path.join(model_dir, quantized_file))
+    # The export is reused without quantizing again
+    assert find_quantized_model(_MODEL_NAME, quantized_file) == model_dir
@@ -0,0 +1,30 @@
+from z3 import Context, Int
+
+from solver.fol_solver import ObjectEncoding, SolverLimits, solve_scopes_in_pool
+
+class RefusingPool:
+    def submit(self, *args):
+        raise AssertionError("a problem was submitted after the budget ran out")
+
+def test_spent_budget_submits_nothing():
+    z3_context = Context()
+    x = Int("x", z3_context)
+    solver_limits = SolverLimits(timeout_ms=1000, time_budget=0.5)
+    solver_limits.time_spent = 0.5
+    combined_formulas = {"global": [x > 0], "1": [x < 0], "2": [x == 3]}
+    results, conflicting = solve_scopes_in_pool(RefusingPool(), z3_context, combined_formulas, solver_limits, ObjectEncoding(z3_context))
+    assert results == ["unknown", "unknown", "unknown"]
+    assert conflicting == []
+    assert [check["scope"] for check in solver_limits.checks] == ["global", "1", "2"]
+    assert all(check["reason_unknown"] == "solver time budget exhausted" for check in solver_limits.checks)
+
+def test_concurrent_checks_split_the_remaining_budget():
+    solver_limits = SolverLimits(timeout_ms=0, time_budget=1.0)
+    solver_limits.time_spent = 0.2
+    assert solver_limits.next_timeout_ms() == 800
+    assert solver_limits.next_timeout_ms(4) == 200
+    # The per-check timeout still caps every share
+    assert SolverLimits(timeout_ms=100, time_budget=1.0).next_timeout_ms(2) == 100
+    # A share never rounds down to 0, which would disable the timeout
+    solver_limits.time_spent = 0.998
+    assert solver_limits.next_timeout_ms(4) == 1
@@ -0,0 +1,33 @@
+import os
+import json
+
+import pytest
+
+from config import ModelInfo
+from fol_evaluator import FOLEvaluationSession
+from timeline_maker import TimelineMakerSession
+
+dev_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+session_dirs = {"prompt_dir": "../prompts", "schema_dir": "../schemas", "input_template_dir": "../input_templates"}
+
+def run_narrative(narrative: list, solver_mode: str, solver_cache_path: str) -> tuple[list, list]:
+    model_info = ModelInfo("mock-structured")
+    timeline_session = TimelineMakerSession(model_info, **session_dirs)
+    fol_session = FOLEvaluationSession(model_info, solver_mode=solver_mode, solver_cache_path=solver_cache_path, **session_dirs)
+    verdicts = []
+    for section in narrative:
+        timeline_session.append_conversation(section)
+        verdicts.append(sorted(fol_session.append_conversation(section, new_timeline=timeline_session.get_timeline())))
+    return verdicts, fol_session.logs
+
+@pytest.mark.parametrize("solver_mode", ["incremental", "scratch", "sliced"])
+def test_rerun_is_served_from_the_solver_cache(solver_mode, tmp_path):
+    with open(os.path.join(dev_dir, "sample_rp.json"), "r", encoding="utf-8") as f:
+        narrative = json.load(f)[1]
+    solver_cache_path = str(tmp_path / f"solver_cache_{solver_mode}.sqlite")
+    first_verdicts, first_logs = run_narrative(narrative, solver_mode, solver_cache_path)
+    rerun_verdicts, rerun_logs = run_narrative(narrative, solver_mode, solver_cache_path)
+    assert rerun_verdicts == first_verdicts
+    assert sum(log["cached_checks"] for log in first_logs) == 0
+    for log in rerun_logs:
+        assert log["cached_checks"] == len(log["solver_checks"])
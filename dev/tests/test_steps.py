@@ -0,0 +1,86 @@
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from utils.steps import BotCall, BlockingCall, ConcurrentSteps, run_steps, arun_steps
+from api_wrapper.mock_chatbot import ChatBotMock
+from api_wrapper.response_cache import CachingChatBot, LLMResponseCache, ResponseCacheMiss
+
+class FlakyBot:
+    def __init__(self, failures):
+        self.failures = failures
+        self.messages = []
+
+    def send_message(self, message):
+        self.messages.append(message)
+        if len(self.messages) <= self.failures:
+            raise RuntimeError("bad response")
+        return message.upper()
+
+    async def asend_message(self, message):
+        return self.send_message(message)
+
+def retrying_steps(bot, tries=3):
+    message = "first"
+    while True:
+        try:
+            return (yield BotCall(bot, "send_message", message))
+        except RuntimeError as e:
+            tries -= 1
+            if tries <= 0:
+                raise
+            message = f"retry after {e}"
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_call_errors_reach_the_stage_retry(use_async):
+    bot = FlakyBot(failures=1)
+    steps = retrying_steps(bot)
+    result = asyncio.run(arun_steps(steps)) if use_async else run_steps(steps)
+    assert result == "RETRY AFTER BAD RESPONSE"
+    assert bot.messages == ["first", "retry after bad response"]
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_stage_gives_up_after_its_retries(use_async):
+    bot = FlakyBot(failures=5)
+    with pytest.raises(RuntimeError):
+        steps = retrying_steps(bot, tries=2)
+        asyncio.run(arun_steps(steps)) if use_async else run_steps(steps)
+    assert len(bot.messages) == 2
+
+def failing_steps():
+    yield BlockingCall(time.sleep, 0)
+    raise ValueError("stage failed")
+
+def slow_steps(finished):
+    yield BlockingCall(time.sleep, 0.2)
+    finished.append(True)
+    return "done"
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_concurrent_steps_wait_for_every_stage(use_async):
+    finished = []
+    def section_steps():
+        return (yield ConcurrentSteps(executor, failing_steps(), slow_steps(finished)))
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        with pytest.raises(ValueError):
+            asyncio.run(arun_steps(section_steps())) if use_async else run_steps(section_steps())
+        assert finished == [True]
+
+@pytest.mark.parametrize("use_async", [False, True])
+def test_replay_miss_is_not_retried(use_async, tmp_path):
+    bot = CachingChatBot(ChatBotMock, "mock-replay", cache=LLMResponseCache(str(tmp_path / "responses.sqlite")), replay_only=True)
+    attempts = []
+    def any_error_retrying_steps():
+        while True:
+            attempts.append(True)
+            try:
+                return (yield BotCall(bot, "send_message", "first"))
+            except Exception:
+                if len(attempts) >= 3:
+                    raise
+    with pytest.raises(ResponseCacheMiss, match="mock/mock-replay plain response after 0 turns"):
+        steps = any_error_retrying_steps()
+        asyncio.run(arun_steps(steps)) if use_async else run_steps(steps)
+    assert len(attempts) == 1
@@ -0,0 +1,50 @@
+import time
+import threading
+
+import pytest
+
+from main_pipeline import stream_timeline_snapshots
+from utils.steps import BlockingCall
+
+class FakeTimelineSession:
+    def __init__(self, section_seconds=0.01, retry_forever=False):
+        self.section_seconds = section_seconds
+        self.retry_forever = retry_forever
+        self.started = []
+        self.calls = 0
+        self.lock = threading.Lock()
+
+    def append_conversation_steps(self, section):
+        with self.lock:
+            self.started.append(section)
+        while True:
+            self.calls += 1
+            yield BlockingCall(time.sleep, self.section_seconds)
+            if not self.retry_forever:
+                return
+
+    def get_timeline(self):
+        return {}
+
+@pytest.mark.parametrize("lookahead", [1, 2, 3])
+def test_timeline_stays_within_the_lookahead(lookahead):
+    session = FakeTimelineSession()
+    narrative = list(range(10))
+    for consumed, (section, timeline) in enumerate(stream_timeline_snapshots(session, narrative, lookahead)):
+        # Give the timeline thread every chance to run further ahead than it may
+        time.sleep(0.05)
+        with session.lock:
+            assert len(session.started) - 1 - consumed <= lookahead
+
+def test_consumer_failure_stops_a_retrying_section():
+    session = FakeTimelineSession(section_seconds=0.02)
+    snapshots = stream_timeline_snapshots(session, list(range(3)), lookahead=2)
+    next(snapshots)
+    session.retry_forever = True
+    time.sleep(0.1)
+    start = time.perf_counter()
+    snapshots.close()
+    assert time.perf_counter() - start < 1
+    calls = session.calls
+    time.sleep(0.1)
+    assert session.calls == calls
@@ -1,7 +1,10 @@
+import os
+import json
 
 from config import print_warning_message, print_dev_message, ModelInfo, _ERROR_RETRIES
 from utils.loaders import PromptLoader, SchemaLoader, InputTemplateLoader
 from utils.regex import divide_response_parts
+from utils.steps import BotCall, run_steps, arun_steps
 from utils.utils import *
 
 class TimelineMakerSession:
@@ -29,13 +32,19 @@ class TimelineMakerSession:
         return out_dict
     
     def append_conversation(self, lastest_conversation: str) -> None:
-        new_timeline, timeline_text = self.handle_new_section(lastest_conversation)
+        run_steps(self.append_conversation_steps(lastest_conversation))
+    
+    async def aappend_conversation(self, lastest_conversation: str) -> None:
+        await arun_steps(self.append_conversation_steps(lastest_conversation))
+    
+    def append_conversation_steps(self, lastest_conversation: str):
+        new_timeline, timeline_text = yield from self.new_section_steps(lastest_conversation)
         
         self.rp_history.append(lastest_conversation)
         self.timeline.update(new_timeline)
         self.logs.append({"conversation": lastest_conversation, "timeline": new_timeline})
         
-    def handle_new_section(self, lastest_conversation: str) -> tuple[dict, str]:
+    def new_section_steps(self, lastest_conversation: str):
         
         message = self.input_template_loader.load("timeline_maker").format(story=lastest_conversation)
         
@@ -55,7 +64,7 @@ class TimelineMakerSession:
             
             while not processed_success:
                 try:
-                    text_response, json_response = bot.get_structured_response(message, schema_key="timeline_maker", record=True, temperature=0.2)
+                    text_response, json_response = yield BotCall(bot, "get_structured_response", message, schema_key="timeline_maker", record=True, temperature=0.2)
                     print_dev_message("Timeline Maker Response:")
                     print_dev_message(text_response)
                     new_timeline = self.parse_timeline_declarations_json(json_response)
@@ -75,7 +84,7 @@ class TimelineMakerSession:
             if self.rp_history:
                 bot.add_fake_user_message("\n".join(self.rp_history))
                 bot.add_fake_model_message("-- **Reasoning**\n[Hidden]\n-- **Timeline Definitions**\n" + self.get_timeline_str())
-            complete_response = bot.send_message(message, record=True, temperature=0.2)
+            complete_response = yield BotCall(bot, "send_message", message, record=True, temperature=0.2)
             print_dev_message("Timeline Maker Response:")
             print_dev_message(complete_response)
             
@@ -93,13 +102,13 @@ class TimelineMakerSession:
                         print_dev_message("Error: Too many failing responses.")
                         raise e
                         
-                    complete_response = bot.send_message(error_message, record=True, temperature=0.2)
+                    complete_response = yield BotCall(bot, "send_message", error_message, record=True, temperature=0.2)
                     print_dev_message("Retry with:\n")
                     print_dev_message(complete_response)
         
         
         return new_timeline, timeline_text
-        
+    
     def parse_timeline_declarations(self, timeline_text: str) -> dict:
         new_timeline = {}
         for definition_line in timeline_text.splitlines():
@@ -122,4 +131,17 @@ class TimelineMakerSession:
                 print_warning_message(f"Warning: {time_point_name} already exists in timeline.")
             new_timeline[time_point_name] = time_point_description
 
-        return new_timeline
\ No newline at end of file
+        return new_timeline
+    
+    def save_checkpoint(self, file_path: str) -> None:
+        temp_path = file_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump({"timeline": self.timeline, "rp_history": self.rp_history, "logs": self.logs}, f)
+        os.replace(temp_path, file_path)
+    
+    def load_checkpoint(self, file_path: str) -> None:
+        with open(file_path, "r", encoding="utf-8") as f:
+            checkpoint = json.load(f)
+        self.timeline = checkpoint["timeline"]
+        self.rp_history = checkpoint["rp_history"]
+        self.logs = checkpoint["logs"]
@@ -1,6 +1,45 @@
 import os
+import copy
 import json
+import threading
+from jsonschema import Draft7Validator
+from jsonschema.exceptions import best_match
 
+# Prompts, input templates and schemas are read from disk once per process and shared by every loader. A file is read again
+# only when its modification time or size changes, so edits made while a run is going still take effect. Entries are keyed by
+# path and parser, so a schema file can be cached both as a dict and as its compiled validator.
+_loaded_files = {}
+_loaded_files_lock = threading.Lock()
+_loader_stats = {"disk_reads": 0, "hits": 0}
+
+def load_cached_file(file_path, parse=None):
+    file_path = os.path.normpath(file_path)
+    file_stat = os.stat(file_path)
+    version = (file_stat.st_mtime_ns, file_stat.st_size)
+    cache_key = (file_path, parse)
+    with _loaded_files_lock:
+        cached = _loaded_files.get(cache_key)
+        if cached is not None and cached[0] == version:
+            _loader_stats["hits"] += 1
+            return cached[1]
+    with open(file_path, 'r', encoding="utf-8") as f:
+        content = f.read()
+    if parse is not None:
+        content = parse(content)
+    with _loaded_files_lock:
+        _loaded_files[cache_key] = (version, content)
+        _loader_stats["disk_reads"] += 1
+    return content
+
+def compile_validator(schema_text):
+    # The schema itself is checked once here instead of on every response
+    schema = json.loads(schema_text)
+    Draft7Validator.check_schema(schema)
+    return Draft7Validator(schema, format_checker=Draft7Validator.FORMAT_CHECKER)
+
+def get_loader_stats():
+    with _loaded_files_lock:
+        return {"disk_reads": _loader_stats["disk_reads"], "hits": _loader_stats["hits"], "files": len(_loaded_files)}
 
 class InputTemplateLoader:
     def __init__(self, input_template_dir):
@@ -10,11 +49,8 @@ class InputTemplateLoader:
     def load(self, filename):
         sys_prompt_filename = f"{filename}.txt"
         full_input_template_dir = os.path.join(self.cur_dir, self.input_template_dir, sys_prompt_filename)
-        read_text = ""
-        with open(full_input_template_dir, 'r', encoding="utf-8") as f:
-            read_text = f.read()
-        return read_text
-    
+        return load_cached_file(full_input_template_dir)
+
 class PromptLoader:
     def __init__(self, prompt_dir):
         self.cur_dir = os.path.dirname(os.path.realpath(__file__))
@@ -23,19 +59,26 @@ class PromptLoader:
     def load_sys_prompts(self, filename, subtype="text"):
         sys_prompt_filename = f"sys_prompt_{filename}_{subtype}.txt"
         full_prompt_dir = os.path.join(self.cur_dir, self.prompt_dir, sys_prompt_filename)
-        read_text = ""
-        with open(full_prompt_dir, 'r', encoding="utf-8") as f:
-            read_text = f.read()
-        return read_text
-    
+        return load_cached_file(full_prompt_dir)
+
 class SchemaLoader:
     def __init__(self, schema_dir) -> None:
         self.cur_dir = os.path.dirname(os.path.realpath(__file__))
         self.schema_dir = schema_dir
-    
+
     def load_output_schema(self, filename, subtype="base"):
         schema_filename = f"{filename}_output_{subtype}.json"
         full_schema_dir = os.path.join(self.cur_dir, self.schema_dir, schema_filename)
-        with open(full_schema_dir, 'r', encoding="utf-8") as f:
-            schema = json.load(f)
-        return schema
\ No newline at end of file
+        # Copied, as the provider SDKs are handed the schema and may change it
+        return copy.deepcopy(load_cached_file(full_schema_dir, json.loads))
+
+    def load_output_validator(self, filename, subtype="base"):
+        schema_filename = f"{filename}_output_{subtype}.json"
+        full_schema_dir = os.path.join(self.cur_dir, self.schema_dir, schema_filename)
+        return load_cached_file(full_schema_dir, compile_validator)
+
+    def validate_output(self, instance, filename, subtype="base"):
+        # Raises the same error jsonschema.validate would, the most relevant one, so error correction messages stay the same
+        error = best_match(self.load_output_validator(filename, subtype).iter_errors(instance))
+        if error is not None:
+            raise error
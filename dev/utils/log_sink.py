@@ -0,0 +1,65 @@
+import os
+import json
+import threading
+
+# Session logs streamed as JSON lines, one compact record per section and the session summary once at the end, so exporting
+# after every section costs one line instead of rewriting the whole log. read_jsonl_logs gives back the list export_logs writes.
+# fsync policies: "none" leaves flushing to the OS, "section" syncs every record, "close" syncs once when the sink is closed.
+
+_FSYNC_POLICIES = ["none", "section", "close"]
+
+class JsonlLogSink:
+    def __init__(self, file_path: str, fsync_policy: str = "close", append: bool = False) -> None:
+        if fsync_policy not in _FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy '{fsync_policy}', expected one of {_FSYNC_POLICIES}")
+        self.file_path = file_path
+        self.fsync_policy = fsync_policy
+        self.lock = threading.Lock()
+        self.file = open(file_path, "a" if append else "w", encoding="utf-8")
+        self.records_written = 0
+
+    def write_record(self, record_type: str, log: dict) -> None:
+        line = json.dumps({"type": record_type, "log": log}, ensure_ascii=False, separators=(",", ":"))
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+            if self.fsync_policy == "section":
+                os.fsync(self.file.fileno())
+            self.records_written += 1
+
+    def append_section(self, log: dict) -> None:
+        self.write_record("section", log)
+
+    def write_summary(self, log: dict) -> None:
+        self.write_record("summary", log)
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.flush()
+            if self.fsync_policy != "none":
+                os.fsync(self.file.fileno())
+            self.file.close()
+
+def read_jsonl_logs(file_path: str) -> list:
+    # Section logs in order followed by the summary if there is one, as in the JSON logs. A last line cut short is skipped
+    section_logs = []
+    summary_logs = []
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if record["type"] == "summary":
+                summary_logs.append(record["log"])
+            else:
+                section_logs.append(record["log"])
+    return section_logs + summary_logs
+
+def convert_jsonl_logs(jsonl_path: str, json_path: str, indent: int = 2, ensure_ascii: bool = True) -> None:
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(read_jsonl_logs(jsonl_path), f, indent=indent, ensure_ascii=ensure_ascii)
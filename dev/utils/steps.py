@@ -0,0 +1,94 @@
+import asyncio
+from concurrent.futures import wait
+
+# Session stages are written once, as generators yielding every call that blocks: chat bot requests and CPU bound work.
+# run_steps makes those calls directly, arun_steps awaits the bots' async methods and moves blocking work to a thread, so
+# prompts, parsing and error correction are the same for both paths. An exception raised by a call is thrown back into the
+# generator where it yielded, so a stage's retry handling sees it as if it had made the call itself. A FatalCallError, which
+# no retry can fix, is not: the generator is closed and the error raised to the caller straight away.
+
+class BotCall:
+    def __init__(self, bot, method_name: str, *args, **kwargs) -> None:
+        self.bot = bot
+        self.method_name = method_name
+        self.args = args
+        self.kwargs = kwargs
+
+    def run(self):
+        return getattr(self.bot, self.method_name)(*self.args, **self.kwargs)
+
+    async def arun(self):
+        return await getattr(self.bot, "a" + self.method_name)(*self.args, **self.kwargs)
+
+class BlockingCall:
+    def __init__(self, function, *args) -> None:
+        self.function = function
+        self.args = args
+
+    def run(self):
+        return self.function(*self.args)
+
+    async def arun(self):
+        return await asyncio.to_thread(self.function, *self.args)
+
+class ConcurrentSteps:
+    # The first stage runs on the calling thread and the others on the executor, or all as tasks of the event loop. Every
+    # stage is waited for even when one fails, so none is left changing the session after the section has given up.
+    def __init__(self, executor, *stages) -> None:
+        self.executor = executor
+        self.stages = stages
+
+    def run(self) -> list:
+        futures = [self.executor.submit(run_steps, stage) for stage in self.stages[1:]]
+        try:
+            first_output = run_steps(self.stages[0])
+        finally:
+            wait(futures)
+        return [first_output] + [future.result() for future in futures]
+
+    async def arun(self) -> list:
+        outputs = await asyncio.gather(*[arun_steps(stage) for stage in self.stages], return_exceptions=True)
+        for output in outputs:
+            if isinstance(output, BaseException):
+                raise output
+        return outputs
+
+class StepsStopped(Exception):
+    pass
+
+class FatalCallError(Exception):
+    pass
+
+def run_steps(steps, stop_event=None):
+    # With a stop event, the stage is abandoned before its next call once the event is set, rather than after all its retries
+    output, error = None, None
+    while True:
+        try:
+            call = steps.send(output) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        if stop_event is not None and stop_event.is_set():
+            steps.close()
+            raise StepsStopped()
+        try:
+            output, error = call.run(), None
+        except FatalCallError:
+            steps.close()
+            raise
+        except Exception as e:
+            output, error = None, e
+
+async def arun_steps(steps):
+    output, error = None, None
+    while True:
+        try:
+            call = steps.send(output) if error is None else steps.throw(error)
+        except StopIteration as stop:
+            return stop.value
+        try:
+            output, error = await call.arun(), None
+        except FatalCallError:
+            steps.close()
+            raise
+        except Exception as e:
+            output, error = None, e